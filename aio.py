@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from time import perf_counter
+
+import socketio
+
+from broadcast import Broadcaster
+from namespaces import HostMessages, ViewerMessages, PlayerMessages
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# asyncio backend:
+#   - Runs the same Server (game_server.py) on a python-socketio AsyncServer instead of
+#     Flask-SocketIO on eventlet, see aio_server.py
+#   - Server logic stays synchronous and never blocks, handlers are called on the event loop and
+#     the tick loop and room sweeps are asyncio tasks (timer.PeriodicTimer.run_async)
+#   - Writes to engine.io are coroutines there, the broadcaster queues the frames of a tick and
+#     hands them over from a single task instead of one task per packet
+
+# Runs function(*args) in the event loop's default executor and calls done(result, error) back on
+# the loop, the offload of Server.register
+def offload(function, args, done):
+    def finished(future):
+        error = future.exception()
+        done(future.result() if error is None else None, error)
+
+    asyncio.get_event_loop().run_in_executor(None, function, *args).add_done_callback(finished)
+
+# Stands in for Flask-SocketIO in front of the Server
+class AsyncSocketIO:
+    def __init__(self, server):
+        # The python-socketio AsyncServer
+        self.server = server
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+    # target is a coroutine function
+    def start_background_task(self, target, *args, **kwargs):
+        return asyncio.ensure_future(target(*args, **kwargs))
+
+    def on_namespace(self, namespace):
+        self.server.register_namespace(namespace)
+
+class AsyncBroadcaster(Broadcaster):
+    def __init__(self, socket_io, max_queue=None, max_behind=None):
+        super(AsyncBroadcaster, self).__init__(socket_io, max_queue, max_behind)
+        # (connection id, frames) not handed to engine.io yet
+        self.pending = []
+        self.writing = False
+
+    def write(self, sid, frames):
+        self.pending.append((sid, frames))
+        if not self.writing:
+            self.writing = True
+            asyncio.ensure_future(self.write_pending())
+
+    async def write_pending(self):
+        try:
+            while self.pending:
+                pending, self.pending = self.pending, []
+                for sid, frames in pending:
+                    binary = False
+                    for frame in frames:
+                        try:
+                            await self.server.eio.send(sid, frame, binary=binary)
+                        except Exception as error:
+                            # The connection went away since the packet was queued
+                            logger.debug("Dropped packet for closed connection (id: {}, error: {})"
+                                         .format(sid, error))
+                            break
+                        binary = True
+        finally:
+            self.writing = False
+
+    def close(self, namespace, sid):
+        asyncio.ensure_future(self.server.disconnect(sid, namespace=namespace))
+
+# Times every on_* handler like namespaces.MeteredNamespace, and sends everything through the
+# parent's broadcaster
+class AsyncMeteredNamespace(socketio.AsyncNamespace):
+    def __init__(self, namespace, parent):
+        super(AsyncMeteredNamespace, self).__init__(namespace)
+        self.parent = parent
+
+    async def trigger_event(self, event, *args):
+        if not hasattr(self, 'on_' + event):
+            return await super(AsyncMeteredNamespace, self).trigger_event(event, *args)
+
+        start = perf_counter()
+        try:
+            return await super(AsyncMeteredNamespace, self).trigger_event(event, *args)
+        finally:
+            self.parent.handler_latency.observe(perf_counter() - start, (self.namespace, event))
+
+    def emit(self, event, data=None, room=None, **kwargs):
+        self.parent.broadcaster.emit(self.namespace, room, event, data)
+
+class AsyncHostNamespace(HostMessages, AsyncMeteredNamespace):
+    def on_connect(self, sid, environ):
+        self.parent.register_host_connect(sid)
+
+    def on_disconnect(self, sid):
+        self.parent.register_host_disconnect(sid)
+
+    def on_request_start_game(self, sid, data):
+        self.parent.register_request_start_game(sid)
+
+    def on_request_resume_room(self, sid, payload):
+        room_code = payload['room_code']
+        resume_token = payload['resume_token']
+
+        self.parent.register_host_resume_request(sid, room_code, resume_token)
+
+class AsyncViewerNamespace(ViewerMessages, AsyncMeteredNamespace):
+    def on_connect(self, sid, environ):
+        self.parent.register_viewer_connect(sid)
+
+    def on_disconnect(self, sid):
+        self.parent.register_viewer_disconnect(sid)
+
+    def on_request_game_view(self, sid, payload):
+        room_code = payload['room_code']
+        encoding = payload.get('encoding', 'json')
+
+        self.parent.register_request_game_view(sid, room_code, encoding)
+
+class AsyncPlayerNamespace(PlayerMessages, AsyncMeteredNamespace):
+    def on_connect(self, sid, environ):
+        self.parent.register_player_connect(sid)
+
+    def on_disconnect(self, sid):
+        self.parent.register_player_disconnect(sid)
+
+    def on_player_join_request(self, sid, payload):
+        room_code = payload['room_code']
+        user_name = payload['user_name']
+        batch = payload.get('batch', False)
+
+        self.parent.register_player_join_request(sid, room_code, user_name, batch)
+
+    def on_player_rejoin_request(self, sid, payload):
+        room_code = payload['room_code']
+        resume_token = payload['resume_token']
+
+        self.parent.register_player_rejoin_request(sid, room_code, resume_token)
+
+    def on_make_move(self, sid, payload):
+        origin = payload['origin']
+        action = payload['action']
+
+        self.parent.register_make_move(sid, origin, action)
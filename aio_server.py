@@ -0,0 +1,123 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from pathlib import Path
+import logging
+
+from aiohttp import web
+import socketio
+
+from aio import (
+    AsyncSocketIO, AsyncBroadcaster, AsyncHostNamespace, AsyncViewerNamespace, AsyncPlayerNamespace,
+    offload
+)
+from metrics import CONTENT_TYPE
+from assets import AssetCache
+from profiler import profile_arguments, render_profile
+from game_server import Server
+
+# Game server on asyncio (python-socketio AsyncServer on aiohttp), see aio.py. Run with
+#   gunicorn --worker-class aiohttp.GunicornWebWorker -w 1 aio_server:app
+# or python aio_server.py. Serves the same clients as the eventlet server (server.py), without
+# relays or a message queue.
+
+# create logger with '__name__'
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+STATIC_FOLDER = Path(getenv("ZOMBEANS_STATIC_FOLDER", default='static'))
+PORT = int(getenv("PORT", default=8000))
+# Where games are stepped: 'none' on the event loop, 'thread' in a worker thread while the event
+# loop goes on serving connections
+SIMULATION_EXECUTOR = getenv("ZOMBEANS_SIMULATION_EXECUTOR", default='none')
+
+sio = socketio.AsyncServer(async_mode='aiohttp', logger=logger)
+app = web.Application()
+sio.attach(app)
+
+server = Server(AsyncHostNamespace, AsyncViewerNamespace, AsyncPlayerNamespace)
+# The website is served from memory, see assets.py
+assets = AssetCache(STATIC_FOLDER).load()
+
+def simulation_executor(name):
+    if name == 'none':
+        return None
+    if name == 'thread':
+        # Rooms are stepped one after the other, a single thread is all the tick loop uses
+        return ThreadPoolExecutor(1, thread_name_prefix='simulation')
+    # Games hold live physics spaces, they cannot be stepped in another process
+    raise ValueError("Unknown simulation executor {}, use 'none' or 'thread'".format(name))
+
+# Tasks can only be started once the event loop runs
+async def start_server(app):
+    server.register(
+        AsyncSocketIO(sio), broadcaster_class=AsyncBroadcaster, asynchronous=True,
+        executor=simulation_executor(SIMULATION_EXECUTOR), offload=offload
+    )
+
+# Runs before open connections are closed. Once rooms are checkpointed clients are disconnected
+# right away, so they reconnect to the next server instead of waiting for the shutdown timeout.
+async def stop_server(app):
+    server.shutdown()
+    await asyncio.gather(*(sio.eio.disconnect(sid) for sid in list(sio.eio.sockets)))
+
+app.on_startup.append(start_server)
+app.on_shutdown.append(stop_server)
+
+def asset_response(request, path):
+    response = assets.respond(
+        path, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match')
+    )
+    if response is None:
+        raise web.HTTPNotFound()
+    status, headers, body = response
+    return web.Response(body=body, status=status, headers=headers)
+
+# Handle first page
+async def main_page(request):
+    return asset_response(request, 'index.html')
+
+# Tell clients (or a routing proxy) which worker owns a room
+async def route_room(request):
+    room_code = request.match_info['room_code']
+    return web.json_response({'room_code': room_code, 'worker': server.shard.url_for(room_code)})
+
+# Runtime metrics in the Prometheus text format
+async def metrics(request):
+    return web.Response(
+        body=server.metrics.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE}
+    )
+
+# Samples the server for the given seconds and returns the profile, see profiler.py. Only answers
+# with ZOMBEANS_ADMIN_TOKEN as bearer token.
+async def admin_profile(request):
+    if not server.is_admin(request.headers.get('Authorization')):
+        raise web.HTTPNotFound()
+    try:
+        seconds, interval, output = profile_arguments(request.query)
+    except ValueError as error:
+        raise web.HTTPBadRequest(text=str(error))
+    try:
+        server.profiler.start(interval)
+    except RuntimeError as error:
+        raise web.HTTPConflict(text=str(error))
+    logger.info("Profiling (seconds: {}, interval: {})".format(seconds, interval))
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile = server.profiler.stop()
+    body, content_type = render_profile(profile, output)
+    return web.Response(text=body, headers={'Content-Type': content_type})
+
+# Handle all static resources
+async def static_content(request):
+    return asset_response(request, request.match_info['subpath'])
+
+app.router.add_get('/', main_page)
+app.router.add_get('/route/{room_code}', route_room)
+app.router.add_get('/metrics', metrics)
+app.router.add_get('/admin/profile', admin_profile)
+app.router.add_get('/{subpath:.+}', static_content)
+
+if __name__ == '__main__':
+    web.run_app(app, port=PORT)
@@ -0,0 +1,179 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Static asset cache:
+#   - The built website is read once at startup and served from memory, requests never touch the
+#     disk or compress anything, so page loads during busy games cost the tick loop close to nothing
+#   - Text assets are kept gzip and brotli compressed as well (brotli when the module is installed),
+#     a variant is only kept if it is noticeably smaller. Requests get the best variant their
+#     Accept-Encoding allows.
+#   - Every variant has its own strong ETag derived from the content, requests whose If-None-Match
+#     names the variant they would get are answered with an empty 304
+#   - Files whose name carries a content hash (main.3f2a1b9c.js) never change under that name and
+#     are cached by browsers for a year, everything else is revalidated on every use
+#   - Files added to the folder after startup are not served until the next start
+
+ENCODING_IDENTITY = 'identity'
+ENCODING_GZIP = 'gzip'
+ENCODING_BROTLI = 'br'
+
+# Preferred encoding first
+COMPRESSED_ENCODINGS = (ENCODING_BROTLI, ENCODING_GZIP)
+COMPRESSIBLE_TYPES = (
+    'application/javascript', 'application/json', 'application/manifest+json', 'application/wasm',
+    'application/xml', 'image/svg+xml'
+)
+# Types served with an explicit utf-8 charset besides text/*
+TEXT_TYPES = ('application/javascript', 'application/json')
+# Compressed variants must save at least this fraction of the original
+MIN_COMPRESSION_SAVING = 0.1
+# Files smaller than this are not worth compressing
+MIN_COMPRESSED_SIZE = 256
+
+HASHED_NAME = re.compile(r'[.-][0-9a-fA-F]{8,}\.[^.]+$')
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDATE = 'no-cache'
+
+class Asset:
+    __slots__ = ('content_type', 'cache_control', 'variants')
+
+    def __init__(self, content_type, cache_control, variants):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        # Map encoding to (body, etag)
+        self.variants = variants
+
+def compress(encoding, body):
+    if encoding == ENCODING_BROTLI:
+        return brotli.compress(body)
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+def is_compressible(content_type):
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+def load_asset(path, name):
+    with open(path, 'rb') as asset_file:
+        body = asset_file.read()
+    content_type, _ = mimetypes.guess_type(name)
+    content_type = content_type or 'application/octet-stream'
+    digest = hashlib.sha256(body).hexdigest()[:32]
+
+    variants = {ENCODING_IDENTITY: (body, '"{}"'.format(digest))}
+    if is_compressible(content_type) and len(body) >= MIN_COMPRESSED_SIZE:
+        for encoding in COMPRESSED_ENCODINGS:
+            if encoding == ENCODING_BROTLI and brotli is None:
+                continue
+            compressed = compress(encoding, body)
+            if len(compressed) <= len(body) * (1 - MIN_COMPRESSION_SAVING):
+                variants[encoding] = (compressed, '"{}-{}"'.format(digest, encoding))
+
+    if content_type.startswith('text/') or content_type in TEXT_TYPES:
+        content_type += '; charset=utf-8'
+    cache_control = CACHE_IMMUTABLE if HASHED_NAME.search(name) else CACHE_REVALIDATE
+    return Asset(content_type, cache_control, variants)
+
+# Returns the encodings an Accept-Encoding header allows, '*' standing for any other one
+def accepted_encodings(accept_encoding):
+    accepted = set()
+    refused = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, parameters = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        name, _, value = parameters.strip().partition('=')
+        if name.strip() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                pass
+        (accepted if quality > 0 else refused).add(coding)
+    if '*' in accepted:
+        accepted.update(encoding for encoding in COMPRESSED_ENCODINGS if encoding not in refused)
+    return accepted
+
+def matches_etag(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+class AssetCache:
+    def __init__(self, root):
+        self.root = root
+        # Map path relative to root, with '/' separators, to its Asset
+        self.assets = {}
+        self.bytes = 0
+
+    def load(self):
+        assets = {}
+        size = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+                try:
+                    asset = assets[relative] = load_asset(path, name)
+                except OSError as error:
+                    logger.warning("Could not load asset (path: {}, error: {})".format(path, error))
+                    continue
+                size += sum(len(body) for body, _ in asset.variants.values())
+        if not assets:
+            logger.warning("No static assets found (path: {})".format(self.root))
+        self.assets = assets
+        self.bytes = size
+        logger.info("Loaded static assets (path: {}, files: {}, bytes: {}, brotli: {})".format(
+            self.root, len(assets), size, brotli is not None
+        ))
+        return self
+
+    def __len__(self):
+        return len(self.assets)
+
+    # Returns (status, headers, body) for a GET of path, None if there is no such asset
+    def respond(self, path, accept_encoding=None, if_none_match=None):
+        asset = self.assets.get(path.lstrip('/'))
+        if asset is None:
+            return None
+
+        accepted = accepted_encodings(accept_encoding)
+        encoding = ENCODING_IDENTITY
+        for candidate in COMPRESSED_ENCODINGS:
+            if candidate in accepted and candidate in asset.variants:
+                encoding = candidate
+                break
+        body, etag = asset.variants[encoding]
+
+        headers = {
+            'Content-Type': asset.content_type,
+            'ETag': etag,
+            'Cache-Control': asset.cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        # Only the variant being selected counts, a cache holding another one must not reuse it
+        if matches_etag(if_none_match, etag):
+            return 304, headers, b''
+
+        if encoding != ENCODING_IDENTITY:
+            headers['Content-Encoding'] = encoding
+        return 200, headers, body
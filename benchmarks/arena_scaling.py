@@ -0,0 +1,55 @@
+# Large arena scaling benchmark
+#
+# Plays arena games (game/arena.py) of a growing number of players with every player walking at
+# random, on the default bounding box tree and on the spatial hash, and reports the mean and 99th
+# percentile time of Game.tick against the network tick budget. Run from the repository root:
+#
+#   python -m benchmarks.arena_scaling --players 10,50,100,200,400,600
+
+import argparse
+import time
+
+from benchmarks.game_tick import Driver
+from game import Game
+from game.arena import Arena
+
+def measure(players, ticks, spatial_hash, seed):
+    game = Game(arena=Arena(players, spatial_hash=spatial_hash), spawn_seed=seed)
+    for i in range(players):
+        game.add_player('player-{}'.format(i))
+    game.start()
+    driver = Driver(game, seed)
+
+    times = []
+    for _ in range(ticks):
+        driver.random_walk()
+        start = time.perf_counter()
+        game.tick()
+        times.append(time.perf_counter() - start)
+        if game.ended:
+            break
+    game.release()
+    times.sort()
+    return sum(times) / len(times), times[int(len(times) * 0.99)], len(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Large arena scaling benchmark')
+    parser.add_argument('--players', default='10,50,100,200,400,600',
+                        help='comma separated player counts')
+    parser.add_argument('--ticks', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    budget = Game.EXTERNAL_TICK_TIME
+    print('{:>8} {:>12} {:>10} {:>11} {:>10} {:>8}'.format(
+        'players', 'index', 'ticks', 'mean (ms)', 'p99 (ms)', 'budget'
+    ))
+    for players in [int(players) for players in args.players.split(',')]:
+        for name, spatial_hash in (('bbtree', False), ('hash', True)):
+            mean, p99, ticks = measure(players, args.ticks, spatial_hash, args.seed)
+            print('{:>8} {:>12} {:>10} {:>11.2f} {:>10.2f} {:>8.0%}'.format(
+                players, name, ticks, mean * 1e3, p99 * 1e3, p99 / budget
+            ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# Server backend comparison
+#
+# Starts the eventlet server (server.py) and the asyncio server (aio_server.py) one after the other
+# and drives each with the load generator at a growing number of rooms. Reports per step whether
+# every room could be set up without connection errors, the tick jitter seen by viewers and the
+# server CPU. The capacity of a backend is the largest step it served with every room started, no
+# errors and a p99 tick jitter below one tick. Run from the repository root:
+#
+#   python -m benchmarks.backends --rooms 5,10,20,40 --viewers 5
+#
+# Load generator clients are threads, use a separate machine for them past a few hundred
+# connections or the client becomes the bottleneck.
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from argparse import Namespace
+
+from benchmarks import loadgen
+
+BACKENDS = {
+    'eventlet': ['gunicorn', '--worker-class', 'eventlet', '-w', '1', '-b', '{bind}', 'server:app'],
+    'asyncio': [
+        'gunicorn', '--worker-class', 'aiohttp.GunicornWebWorker', '-w', '1', '-b', '{bind}',
+        'aio_server:app'
+    ],
+    'asyncio-thread': [
+        'gunicorn', '--worker-class', 'aiohttp.GunicornWebWorker', '-w', '1', '-b', '{bind}',
+        'aio_server:app'
+    ],
+}
+BACKEND_ENV = {'asyncio-thread': {'ZOMBEANS_SIMULATION_EXECUTOR': 'thread'}}
+
+def wait_for_server(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen('http://localhost:{}/metrics'.format(port), timeout=1).read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+def start_backend(name, port):
+    command = [part.format(bind='127.0.0.1:{}'.format(port)) for part in BACKENDS[name]]
+    env = dict(os.environ, **BACKEND_ENV.get(name, {}))
+    return subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+def stop_backend(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+# The gunicorn master only forwards, the game runs in its single worker
+def worker_pid(process):
+    with open('/proc/{0}/task/{0}/children'.format(process.pid)) as children:
+        pids = children.read().split()
+    return int(pids[0]) if pids else process.pid
+
+def run_step(args, port, pid, rooms):
+    report = loadgen.run(Namespace(
+        host='localhost', port=port, rooms=rooms, players=args.players, viewers=args.viewers,
+        duration=args.duration, move_interval=0.3, god_cast_probability=0.1,
+        tick_time=args.tick_time, setup_timeout=args.setup_timeout, server_pid=pid, output=None
+    ))
+    jitter = report['tick_jitter_ms']
+    served = (
+        report['rooms_started'] == rooms and not report['errors']
+        and jitter.get('p99', float('inf')) < args.tick_time * 1000
+    )
+    return {
+        'rooms': rooms,
+        'connections': rooms * (1 + args.players + args.viewers),
+        'rooms_started': report['rooms_started'],
+        'errors': sum(report['errors'].values()),
+        'jitter_p50_ms': jitter.get('p50'),
+        'jitter_p99_ms': jitter.get('p99'),
+        'server_cpu': report.get('server_cpu', {}).get('utilization'),
+        'served': served,
+    }
+
+def run_backend(args, name, port):
+    process = start_backend(name, port)
+    steps = []
+    try:
+        if not wait_for_server(port, args.setup_timeout):
+            print('{} did not start'.format(name), file=sys.stderr)
+            return steps
+        pid = worker_pid(process)
+        for rooms in args.rooms:
+            step = run_step(args, port, pid, rooms)
+            steps.append(step)
+            print_step(name, step)
+            if not step['served'] and args.stop_on_failure:
+                break
+    finally:
+        stop_backend(process)
+    return steps
+
+def format_ms(value):
+    return '{:.1f}'.format(value) if value is not None else '-'
+
+def print_step(name, step):
+    print('{:>15} {:>6} {:>12} {:>8} {:>7} {:>11} {:>11} {:>6} {:>7}'.format(
+        name, step['rooms'], step['connections'], step['rooms_started'], step['errors'],
+        format_ms(step['jitter_p50_ms']), format_ms(step['jitter_p99_ms']),
+        '{:.0%}'.format(step['server_cpu']) if step['server_cpu'] is not None else '-',
+        'yes' if step['served'] else 'no'
+    ))
+    sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description='Server backend comparison')
+    parser.add_argument('--backends', default='eventlet,asyncio,asyncio-thread')
+    parser.add_argument('--rooms', default='5,10,20,40', help='comma separated room counts')
+    parser.add_argument('--players', type=int, default=5, help='players per room (3 to 10)')
+    parser.add_argument('--viewers', type=int, default=5, help='viewers per room')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds measured per step')
+    parser.add_argument('--tick-time', type=float, default=0.05)
+    parser.add_argument('--setup-timeout', type=float, default=30.0)
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--stop-on-failure', action='store_true',
+                        help='skip the remaining steps of a backend once it fails one')
+    parser.add_argument('--output', help='also write the results as json here')
+    args = parser.parse_args()
+    args.rooms = [int(rooms) for rooms in args.rooms.split(',')]
+
+    print('{:>15} {:>6} {:>12} {:>8} {:>7} {:>11} {:>11} {:>6} {:>7}'.format(
+        'backend', 'rooms', 'connections', 'started', 'errors', 'jitter p50', 'jitter p99', 'cpu',
+        'served'
+    ))
+    results = {}
+    for index, name in enumerate(args.backends.split(',')):
+        results[name] = run_backend(args, name, args.port + index)
+
+    print()
+    for name, steps in results.items():
+        served = [step['connections'] for step in steps if step['served']]
+        print('{}: capacity {} connections'.format(name, max(served) if served else 0))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
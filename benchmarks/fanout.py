@@ -0,0 +1,74 @@
+# Tick fan-out microbenchmark
+#
+# Compares broadcasting one json game tick to a room of viewers through Socket.IO emit, which
+# encodes the packet for every participant, against the Broadcaster, which encodes it once. Sockets
+# are not real, engine.io sends are counted and discarded. Run from the repository root:
+#
+#   python -m benchmarks.fanout
+
+import argparse
+import timeit
+from types import SimpleNamespace
+
+import socketio
+
+from broadcast import Broadcaster
+from game import Game
+from packets import TickEncoder
+
+NAMESPACE = '/viewer'
+ROOM = 'ROOM/json'
+VIEWER_COUNTS = (1, 10, 100, 1000)
+
+def build_server(num_viewers):
+    server = socketio.Server()
+    server.eio.send = lambda sid, data, binary=False: None
+    for i in range(num_viewers):
+        sid = 'viewer-{}'.format(i)
+        server.manager.connect(sid, NAMESPACE)
+        server.manager.enter_room(sid, NAMESPACE, ROOM)
+    return server
+
+def build_tick():
+    game = Game()
+    for i in range(8):
+        game.add_player('player-{}'.format(i))
+    game.start()
+    game.tick()
+    json_tick, _ = TickEncoder().encode(game)
+    packet = {'pkt_name': 'game_tick'}
+    packet.update(json_tick)
+    return packet
+
+def main():
+    parser = argparse.ArgumentParser(description='Tick fan-out microbenchmark')
+    parser.add_argument('--number', type=int, default=200, help='broadcasts per sample')
+    args = parser.parse_args()
+
+    packet = build_tick()
+    print('{:>8} {:>12} {:>12} {:>9} {:>9}'.format(
+        'viewers', 'emit (us)', 'batch (us)', 'ratio', 'encodes'
+    ))
+    for num_viewers in VIEWER_COUNTS:
+        server = build_server(num_viewers)
+        broadcaster = Broadcaster(SimpleNamespace(server=server))
+
+        def emit():
+            server.emit('game_tick', packet, room=ROOM, namespace=NAMESPACE)
+
+        def batch():
+            tick_batch = broadcaster.batch(NAMESPACE)
+            tick_batch.broadcast(ROOM, 'game_tick', packet)
+            tick_batch.flush()
+
+        emit_time = min(timeit.repeat(emit, number=args.number, repeat=5)) / args.number
+        batch_time = min(timeit.repeat(batch, number=args.number, repeat=5)) / args.number
+        encodes = broadcaster.encodes[NAMESPACE] / (args.number * 5)
+        print(
+            '{:>8} {:>12.1f} {:>12.1f} {:>8.2f}x {:>9.0f}'.format(
+                num_viewers, emit_time * 1e6, batch_time * 1e6, emit_time / batch_time, encodes
+            )
+        )
+
+if __name__ == '__main__':
+    main()
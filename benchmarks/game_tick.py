@@ -0,0 +1,174 @@
+# Game simulation microbenchmark
+#
+# Measures Game.tick throughput of a single room without any networking, for 3 to 10 players and
+# several input scenarios. Results are compared against the stored baseline in
+# benchmarks/baseline/game_tick.json (recorded on the machine noted in the file, so only compare
+# numbers from the same machine):
+#
+#   python -m benchmarks.game_tick                   # run and compare against the baseline
+#   python -m benchmarks.game_tick --save-baseline   # run and overwrite the baseline
+
+import argparse
+import json
+import platform
+import random
+import time
+from pathlib import Path
+
+from game import Game
+
+BASELINE_PATH = Path(__file__).parent / 'baseline' / 'game_tick.json'
+
+KEYS = ('up', 'down', 'left', 'right')
+
+class Driver:
+    def __init__(self, game, seed):
+        self.game = game
+        self.rng = random.Random(seed)
+        # Map player id to the key it is currently holding
+        self.held = {}
+
+    def hold(self, id, key):
+        current = self.held.get(id)
+        if current == key:
+            return
+        if current is not None:
+            self.game.input(id, current, 'released')
+        if key is not None:
+            self.game.input(id, key, 'pressed')
+        self.held[id] = key
+
+    def random_walk(self, change_probability=0.05):
+        for id in self.game.players:
+            if self.rng.random() < change_probability:
+                self.hold(id, self.rng.choice(KEYS))
+
+    def chase(self):
+        zombies = [p for p in self.game.players.values() if p.is_zombie()]
+        humans = [p for p in self.game.players.values() if not p.is_zombie()]
+        if not humans:
+            return
+
+        for zombie in zombies:
+            target = min(humans, key=lambda p: (p.body.position - zombie.body.position).length)
+            offset = target.body.position - zombie.body.position
+            self.hold(zombie.id, self.key_towards(offset))
+        for human in humans:
+            if self.rng.random() < 0.05:
+                self.hold(human.id, self.rng.choice(KEYS))
+
+    def key_towards(self, offset):
+        if abs(offset[0]) > abs(offset[1]):
+            return 'right' if offset[0] > 0 else 'left'
+        return 'down' if offset[1] > 0 else 'up'
+
+    def cast_spells(self):
+        god = self.game.god
+        if god is not None:
+            for code in list(god.possible_actions):
+                self.game.god_input(god.id, code)
+
+# Scenarios drive the room once per tick
+def idle(driver):
+    pass
+
+def random_walk(driver):
+    driver.random_walk()
+
+def god_spells(driver):
+    driver.random_walk()
+    driver.cast_spells()
+
+def infection_cascade(driver):
+    driver.chase()
+
+SCENARIOS = {
+    'idle': idle,
+    'random_walk': random_walk,
+    'god_spells': god_spells,
+    'infection_cascade': infection_cascade,
+}
+
+def new_game(num_players, seed):
+    game = Game()
+    for i in range(num_players):
+        game.add_player('player-{}'.format(i))
+    game.start()
+    return Driver(game, seed)
+
+def run_scenario(scenario, num_players, num_ticks, seed):
+    driver = new_game(num_players, seed)
+    games = 1
+    elapsed = 0.0
+    for tick in range(num_ticks):
+        scenario(driver)
+        start = time.perf_counter()
+        _, ended, _ = driver.game.tick()
+        elapsed += time.perf_counter() - start
+        if ended:
+            games += 1
+            driver = new_game(num_players, seed + games)
+
+    return {
+        'ticks_per_second': num_ticks / elapsed,
+        'steps_per_second': num_ticks * driver.game.steps_per_tick / elapsed,
+        'games': games,
+    }
+
+def run(num_ticks, seed, players, scenarios):
+    results = {}
+    for name in scenarios:
+        for num_players in players:
+            results['{}/{}'.format(name, num_players)] = run_scenario(
+                SCENARIOS[name], num_players, num_ticks, seed
+            )
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Game simulation microbenchmark')
+    parser.add_argument('--ticks', type=int, default=2000, help='ticks per measurement')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--players', type=int, nargs='+', default=list(range(3, 11)))
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    results = run(args.ticks, args.seed, args.players, args.scenarios)
+
+    baseline = {}
+    if args.baseline.exists() and not args.save_baseline:
+        with args.baseline.open() as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    print('{:<24} {:>12} {:>12} {:>9}'.format('scenario/players', 'ticks/s', 'baseline', 'ratio'))
+    for key, result in results.items():
+        ticks_per_second = result['ticks_per_second']
+        if key in baseline:
+            base = baseline[key]['ticks_per_second']
+            print(
+                '{:<24} {:>12.0f} {:>12.0f} {:>8.2f}x'.format(
+                    key, ticks_per_second, base, ticks_per_second / base
+                )
+            )
+        else:
+            print('{:<24} {:>12.0f} {:>12} {:>9}'.format(key, ticks_per_second, '-', '-'))
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with args.baseline.open('w') as baseline_file:
+            json.dump({
+                'machine': {
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'processor': platform.processor(),
+                },
+                'ticks': args.ticks,
+                'seed': args.seed,
+                'steps_per_tick': Game().steps_per_tick,
+                'results': results,
+            }, baseline_file, indent=2, sort_keys=True)
+        print('Saved baseline to {}'.format(args.baseline))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+# Headless load generator
+#
+# Runs simulated hosts, players and viewers against a running server through the real packet flow
+# (room_code, player_join_request, request_game_view, request_start_game, make_move) and writes a
+# json report with input to broadcast latency, tick interval/jitter, packet rates and server CPU.
+#
+#   python -m benchmarks.loadgen --port 8000 --rooms 20 --server-pid <pid> --output report.json
+#
+# Input latency is measured by the first viewer of every room: players alternate between holding
+# left and right, and a press counts as delivered on the first game_tick in which the player's
+# observed horizontal velocity moved towards the pressed direction. Its resolution is therefore one
+# network tick.
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+from socketIO_client import SocketIO, BaseNamespace
+
+# Smallest change in observed velocity (in quanta per tick) that counts as a reaction to input
+VELOCITY_EPSILON = 1
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.tick_intervals = []
+        self.received = Counter()
+        self.sent = Counter()
+        self.errors = Counter()
+
+    def record_received(self, event):
+        with self.lock:
+            self.received[event] += 1
+
+    def record_sent(self, event):
+        with self.lock:
+            self.sent[event] += 1
+
+    def record_latency(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def record_tick_interval(self, interval):
+        with self.lock:
+            self.tick_intervals.append(interval)
+
+    def record_error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+
+def percentiles(values, scale=1.0):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * scale
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered) * scale,
+        'p50': at(0.50),
+        'p90': at(0.90),
+        'p99': at(0.99),
+        'max': ordered[-1] * scale,
+    }
+
+def read_cpu_seconds(pid):
+    with open('/proc/{}/stat'.format(pid)) as stat_file:
+        # The command name can contain spaces, fields are counted after its closing paren
+        fields = stat_file.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+class Room:
+    def __init__(self, index):
+        self.index = index
+        self.room_code = None
+        self.joined = 0
+        self.started = False
+        self.over = False
+        # Map player id to (press time, direction sign, velocity at press time)
+        self.pending_presses = {}
+        self.lock = threading.Lock()
+
+class Client(threading.Thread):
+    path = None
+
+    def __init__(self, args, room, stats, stop):
+        super(Client, self).__init__(daemon=True)
+        self.args = args
+        self.room = room
+        self.stats = stats
+        self.stop = stop
+        self.io = None
+        self.namespace = None
+
+    def run(self):
+        try:
+            self.io = SocketIO(self.args.host, self.args.port, wait_for_connection=False)
+            self.namespace = self.io.define(BaseNamespace, self.path)
+            for event in self.events():
+                self.namespace.on(event, self.wrap(event, getattr(self, 'on_' + event)))
+            self.connected()
+
+            while not self.stop.is_set() and not self.room.over:
+                self.io.wait(seconds=0.005)
+                self.step()
+        except Exception as error:
+            self.stats.record_error(type(error).__name__)
+        finally:
+            if self.io is not None:
+                try:
+                    self.io.disconnect()
+                except Exception:
+                    pass
+
+    def wrap(self, event, handler):
+        def callback(*args):
+            self.stats.record_received(event)
+            handler(*args)
+        return callback
+
+    def emit(self, event, payload):
+        self.stats.record_sent(event)
+        self.namespace.emit(event, payload)
+
+    def session_id(self):
+        return self.io._engineIO_session.id
+
+    def events(self):
+        return ()
+
+    def connected(self):
+        pass
+
+    def step(self):
+        pass
+
+    def on_game_over(self, payload):
+        self.room.over = True
+
+class HostClient(Client):
+    path = '/host'
+
+    def events(self):
+        return ('room_code', 'player_joined', 'game_over')
+
+    def on_room_code(self, payload):
+        self.room.room_code = payload['room_code']
+
+    def on_player_joined(self, payload):
+        with self.room.lock:
+            self.room.joined = len(payload['players'])
+
+    def step(self):
+        if not self.room.started and self.room.joined >= self.args.players:
+            self.room.started = True
+            self.emit('request_start_game', {'pkt_name': 'request_start_game'})
+
+class PlayerClient(Client):
+    path = '/player'
+
+    def __init__(self, *args, **kwargs):
+        super(PlayerClient, self).__init__(*args, **kwargs)
+        self.is_god = False
+        self.in_game = False
+        self.current_key = None
+        self.next_move = 0.0
+        self.god_spells = []
+
+    def events(self):
+        return ('player_join_response', 'game_starting', 'god_spells', 'status_change', 'game_over')
+
+    def connected(self):
+        self.emit(
+            'player_join_request', {
+                'pkt_name': 'player_join_request',
+                'room_code': self.room.room_code,
+                'user_name': 'bot-{}-{}'.format(self.room.index, self.name)
+            }
+        )
+
+    def on_player_join_response(self, payload):
+        if payload['status'] != 'success':
+            self.stats.record_error('join_' + payload['status'])
+            self.stop.set()
+            return
+        self.is_god = payload['aux_data']['is_god'] == 'true'
+
+    def on_game_starting(self, payload):
+        self.in_game = True
+        self.next_move = time.time() + random.uniform(0, self.args.move_interval)
+
+    def on_god_spells(self, payload):
+        self.god_spells = payload['god_spells']['possible']
+
+    def on_status_change(self, payload):
+        pass
+
+    def step(self):
+        now = time.time()
+        if not self.in_game or now < self.next_move:
+            return
+        self.next_move = now + self.args.move_interval
+
+        if self.is_god:
+            if self.god_spells and random.random() < self.args.god_cast_probability:
+                self.emit(
+                    'make_move', {
+                        'pkt_name': 'make_move',
+                        'origin': 'god',
+                        'action': {'code': random.choice(self.god_spells)}
+                    }
+                )
+            return
+
+        if self.current_key is not None:
+            self.send_key(self.current_key, 'released')
+        self.current_key = 'left' if self.current_key == 'right' else 'right'
+
+        with self.room.lock:
+            self.room.pending_presses[self.session_id()] = (
+                time.time(), 1 if self.current_key == 'right' else -1, None
+            )
+        self.send_key(self.current_key, 'pressed')
+
+    def send_key(self, key, state):
+        self.emit(
+            'make_move', {
+                'pkt_name': 'make_move',
+                'origin': 'normal',
+                'action': {'key': key, 'state': state}
+            }
+        )
+
+class ViewerClient(Client):
+    path = '/viewer'
+
+    def __init__(self, args, room, stats, stop, observer=False):
+        super(ViewerClient, self).__init__(args, room, stats, stop)
+        self.observer = observer
+        self.keyframe = {}
+        self.positions = {}
+        self.velocities = {}
+        self.last_tick = None
+
+    def events(self):
+        return ('game_view_response', 'game_starting', 'game_tick', 'game_over')
+
+    def connected(self):
+        self.emit(
+            'request_game_view', {
+                'pkt_name': 'request_game_view',
+                'room_code': self.room.room_code
+            }
+        )
+
+    def on_game_view_response(self, payload):
+        if payload['view_status'] != 'success':
+            self.stats.record_error('view_' + payload['view_status'])
+
+    def on_game_starting(self, payload):
+        pass
+
+    def on_game_tick(self, payload):
+        now = time.time()
+        if self.last_tick is not None:
+            self.stats.record_tick_interval(now - self.last_tick)
+        self.last_tick = now
+
+        positions = self.decode(payload)
+        if positions is None:
+            return
+        for id, (x, y) in positions.items():
+            if id in self.positions:
+                self.velocities[id] = x - self.positions[id][0]
+        self.positions = positions
+
+        if self.observer:
+            self.match_presses(now)
+
+    def decode(self, payload):
+        if payload.get('keyframe', True):
+            scale = payload.get('scale', 1)
+            self.keyframe = {
+                id: (round(state['position']['x'] * scale), round(state['position']['y'] * scale))
+                for id, state in payload['player_pos_data'].items()
+                if id != 'god_spells'
+            }
+            return dict(self.keyframe)
+        if not self.keyframe:
+            return None
+
+        positions = dict(self.keyframe)
+        for id, (dx, dy) in payload['deltas'].items():
+            base_x, base_y = self.keyframe[id]
+            positions[id] = (base_x + dx, base_y + dy)
+        return positions
+
+    def match_presses(self, now):
+        with self.room.lock:
+            for id, (pressed_at, sign, base_velocity) in list(self.room.pending_presses.items()):
+                velocity = self.velocities.get(id)
+                if velocity is None:
+                    continue
+                if base_velocity is None:
+                    # First tick seen since the press, compare later ticks against it
+                    self.room.pending_presses[id] = (pressed_at, sign, velocity)
+                elif (velocity - base_velocity) * sign >= VELOCITY_EPSILON:
+                    self.stats.record_latency(now - pressed_at)
+                    del self.room.pending_presses[id]
+
+def wait_until(predicate, timeout):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def run(args):
+    stats = Stats()
+    stop = threading.Event()
+    rooms = [Room(i) for i in range(args.rooms)]
+    clients = []
+
+    for room in rooms:
+        host = HostClient(args, room, stats, stop)
+        host.start()
+        clients.append(host)
+        if not wait_until(lambda: room.room_code is not None, args.setup_timeout):
+            stats.record_error('room_code_timeout')
+            continue
+
+        for i in range(args.viewers):
+            viewer = ViewerClient(args, room, stats, stop, observer=(i == 0))
+            viewer.start()
+            clients.append(viewer)
+        for _ in range(args.players):
+            player = PlayerClient(args, room, stats, stop)
+            player.start()
+            clients.append(player)
+
+    wait_until(lambda: all(room.started for room in rooms), args.setup_timeout)
+
+    cpu_start = read_cpu_seconds(args.server_pid) if args.server_pid else None
+    start = time.time()
+    wait_until(lambda: stop.is_set() or all(room.over for room in rooms), args.duration)
+    elapsed = time.time() - start
+    cpu_end = read_cpu_seconds(args.server_pid) if args.server_pid else None
+
+    stop.set()
+    for client in clients:
+        client.join(timeout=5)
+
+    expected_interval = args.tick_time
+    jitter = [abs(interval - expected_interval) for interval in stats.tick_intervals]
+    report = {
+        'config': vars(args),
+        'elapsed_seconds': elapsed,
+        'rooms_started': sum(room.started for room in rooms),
+        'input_latency_ms': percentiles(stats.latencies, 1000.0),
+        'tick_interval_ms': percentiles(stats.tick_intervals, 1000.0),
+        'tick_jitter_ms': percentiles(jitter, 1000.0),
+        'packets_received_per_second': sum(stats.received.values()) / elapsed,
+        'packets_sent_per_second': sum(stats.sent.values()) / elapsed,
+        'packets_received': dict(stats.received),
+        'packets_sent': dict(stats.sent),
+        'errors': dict(stats.errors),
+    }
+    if cpu_start is not None:
+        report['server_cpu'] = {
+            'seconds': cpu_end - cpu_start,
+            'utilization': (cpu_end - cpu_start) / elapsed,
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless load generator')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--rooms', type=int, default=5)
+    parser.add_argument('--players', type=int, default=5, help='players per room (3 to 10)')
+    parser.add_argument('--viewers', type=int, default=1, help='viewers per room')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of play to measure')
+    parser.add_argument('--move-interval', type=float, default=0.3)
+    parser.add_argument('--god-cast-probability', type=float, default=0.1)
+    parser.add_argument(
+        '--tick-time', type=float, default=0.05, help='network tick period the server uses'
+    )
+    parser.add_argument('--setup-timeout', type=float, default=30.0)
+    parser.add_argument('--server-pid', type=int, help='pid to sample server CPU time from')
+    parser.add_argument('--output', help='write the json report here instead of stdout')
+    args = parser.parse_args()
+
+    report = run(args)
+    encoded = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(encoded)
+    else:
+        print(encoded)
+
+if __name__ == '__main__':
+    main()
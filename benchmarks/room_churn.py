@@ -0,0 +1,52 @@
+# Room churn benchmark
+#
+# Creates, plays a few ticks of and releases many short games in a row, with and without the
+# SpacePool, and reports the time per game and how much traced memory is left behind. Run from the
+# repository root:
+#
+#   python -m benchmarks.room_churn --games 5000
+
+import argparse
+import time
+import tracemalloc
+
+from game import Game
+from game.pool import SpacePool
+
+def play(num_games, num_players, num_ticks, space_pool):
+    for _ in range(num_games):
+        game = Game(space_pool=space_pool)
+        for i in range(num_players):
+            game.add_player('player-{}'.format(i))
+        game.start()
+        for _ in range(num_ticks):
+            game.advance()
+        game.release()
+
+def measure(args, space_pool):
+    # Warm up caches and the pool before measuring what is left behind
+    play(10, args.players, args.ticks, space_pool)
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    play(args.games, args.players, args.ticks, space_pool)
+    elapsed = time.perf_counter() - start
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / args.games, after - before
+
+def main():
+    parser = argparse.ArgumentParser(description='Room churn benchmark')
+    parser.add_argument('--games', type=int, default=2000)
+    parser.add_argument('--players', type=int, default=6)
+    parser.add_argument('--ticks', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>8} {:>14} {:>16}'.format('pool', 'game (us)', 'retained (KiB)'))
+    for name, space_pool in (('none', None), ('pooled', SpacePool())):
+        per_game, retained = measure(args, space_pool)
+        print('{:>8} {:>14.1f} {:>16.1f}'.format(name, per_game * 1e6, retained / 1024))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Room code lookup microbenchmark
+#
+# Compares the join path lookup through RoomRegistry against the linear scan over all hosts that
+# the server used previously. Run from the repository root:
+#
+#   python -m benchmarks.room_lookup
+
+import argparse
+import timeit
+from random import choice
+
+from rooms import RoomRegistry
+
+ROOM_COUNTS = (10, 100, 1000, 10000, 100000)
+
+def linear_lookup(hosts, room_code):
+    for host_id, host_data in hosts.items():
+        if host_data['room_code'] == room_code:
+            return host_id
+    return None
+
+def build_rooms(num_rooms):
+    registry = RoomRegistry()
+    hosts = {}
+    for i in range(num_rooms):
+        host_id = 'host-{}'.format(i)
+        hosts[host_id] = {'room_code': registry.allocate(host_id)}
+    return registry, hosts
+
+def time_per_call(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+def main():
+    parser = argparse.ArgumentParser(description='Room code lookup microbenchmark')
+    parser.add_argument('--number', type=int, default=2000, help='lookups per sample')
+    parser.add_argument('--skip-linear', action='store_true', help='only time the registry')
+    args = parser.parse_args()
+
+    print('{:>8} {:>14} {:>14}'.format('rooms', 'registry (us)', 'linear (us)'))
+    for num_rooms in ROOM_COUNTS:
+        registry, hosts = build_rooms(num_rooms)
+        codes = list(registry.hosts_by_code)
+
+        registry_time = time_per_call(lambda: registry.lookup(choice(codes)), args.number)
+        if args.skip_linear:
+            linear_time = float('nan')
+        else:
+            # The scan is O(rooms), keep the total work bounded for the large sizes
+            number = max(20, args.number * 10 // num_rooms)
+            linear_time = time_per_call(lambda: linear_lookup(hosts, choice(codes)), number)
+
+        print(
+            '{:>8} {:>14.3f} {:>14.3f}'.format(num_rooms, registry_time * 1e6, linear_time * 1e6)
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Session record memory benchmark
+#
+# Compares the memory held by idle connection records, the slotted sessions the server keeps now
+# against per connection dicts with the same fields, the layout it used previously. Run from the repository root:
+#
+#   python -m benchmarks.session_memory --connections 50000
+
+import argparse
+import tracemalloc
+from time import monotonic
+
+from ratelimit import TokenBucket
+from sessions import RoomSession, PlayerSession, ViewerSession
+
+ENCODINGS = ('json', 'binary')
+
+# The same records as plain dicts, the layout the server used before. Both layouts hold the same
+# fields, so the comparison only measures dicts against slots.
+def dict_bucket():
+    now = monotonic()
+    return {
+        'rate': 60, 'burst': 30, 'tokens': 30, 'clock': monotonic, 'updated': now, 'dropped': 0
+    }
+
+def dict_player(player_id):
+    return {
+        'player_id': player_id,
+        'user_name': None,
+        'character': None,
+        'state': 1,
+        'room': None,
+        'game': None,
+        'input_limit': dict_bucket(),
+        'resume_token': None,
+    }
+
+def dict_viewer(viewer_id):
+    return {'viewer_id': viewer_id, 'encoding': 'json', 'room': None}
+
+def dict_host(host_id):
+    return {
+        'host_id': host_id,
+        'room_code': host_id[-6:],
+        'game_state': 1,
+        'game': None,
+        'tick_encoder': None,
+        'players': [],
+        'viewers': [],
+        'viewer_encodings': {encoding: 0 for encoding in ENCODINGS},
+        'board_description': None,
+        'lobby_roster': [],
+        'viewer_roster': [],
+        'updated_at': monotonic(),
+        'resume_token': None,
+    }
+
+def session_player(player_id):
+    return PlayerSession(player_id, 1, TokenBucket(60, 30))
+
+def session_viewer(viewer_id):
+    return ViewerSession(viewer_id, 'json')
+
+def session_host(host_id):
+    return RoomSession(host_id, host_id[-6:], 1, None, None, ENCODINGS)
+
+KINDS = (
+    ('player', dict_player, session_player),
+    ('viewer', dict_viewer, session_viewer),
+    ('host', dict_host, session_host),
+)
+
+# Ids are built up front so only the records themselves are measured, games and encoders are left
+# out since both record layouts share them
+def measure(factory, ids):
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    records = {id: factory(id) for id in ids}
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return end - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Session record memory benchmark')
+    parser.add_argument('--connections', type=int, default=50000)
+    args = parser.parse_args()
+
+    ids = ['{:020x}'.format(i) for i in range(args.connections)]
+    # The dict holding the records is the same for both layouts
+    baseline = measure(lambda id: None, ids)
+
+    print('{:>8} {:>14} {:>14} {:>9}'.format('kind', 'dict (B/conn)', 'slots (B/conn)', 'ratio'))
+    for kind, dict_factory, session_factory in KINDS:
+        dict_bytes = (measure(dict_factory, ids) - baseline) / args.connections
+        session_bytes = (measure(session_factory, ids) - baseline) / args.connections
+        print(
+            '{:>8} {:>14.1f} {:>14.1f} {:>8.2f}x'.format(
+                kind, dict_bytes, session_bytes, dict_bytes / session_bytes
+            )
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Viewer tick encoding benchmark
+#
+# Compares bytes per tick and encode time of the legacy full json tick, the keyframe/delta json
+# tick and the binary tick for rooms of 3 to 10 players. The json sizes are those of json.dumps,
+# which is what Socket.IO uses to encode event payloads. Run from the repository root:
+#
+#   python -m benchmarks.tick_encoding
+
+import argparse
+import json
+import random
+import time
+
+from game import Game
+from packets import TickEncoder, encode_binary_tick
+
+DIRECTIONS = ('u', 'd', 'l', 'r')
+
+def build_game(num_players, seed):
+    rng = random.Random(seed)
+    game = Game()
+    for i in range(num_players):
+        game.add_player('player-{:020d}'.format(i))
+    game.start()
+
+    # Keep everybody moving so that deltas are not trivially empty
+    for id in game.players:
+        game.input(id, rng.choice(DIRECTIONS), 'pressed')
+    return game
+
+def measure(game, num_ticks, encode):
+    total_bytes = 0
+    total_time = 0.0
+    for _ in range(num_ticks):
+        game.advance()
+        start = time.perf_counter()
+        total_bytes += len(encode(game))
+        total_time += time.perf_counter() - start
+    return total_bytes / num_ticks, total_time / num_ticks
+
+def legacy_json(game):
+    return json.dumps({'pkt_name': 'game_tick', 'player_pos_data': game.tick_data()})
+
+def delta_json(encoder):
+    def encode(game):
+        packet, _ = encoder.encode(game)
+        return json.dumps(dict(pkt_name='game_tick', **packet))
+    return encode
+
+def binary():
+    seq = [0]
+    def encode(game):
+        seq[0] += 1
+        return encode_binary_tick(game, seq[0])
+    return encode
+
+def main():
+    parser = argparse.ArgumentParser(description='Viewer tick encoding benchmark')
+    parser.add_argument('--ticks', type=int, default=400, help='ticks per measurement')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        '{:>7} | {:>18} | {:>18} | {:>18}'.format(
+            'players', 'legacy json B/us', 'delta json B/us', 'binary B/us'
+        )
+    )
+    for num_players in range(3, 11):
+        results = []
+        for make_encoder in (lambda: legacy_json, lambda: delta_json(TickEncoder()),
+                             binary):
+            game = build_game(num_players, args.seed)
+            results.append(measure(game, args.ticks, make_encoder()))
+
+        print(
+            '{:>7} | '.format(num_players) + ' | '.join(
+                '{:>8.1f} / {:>7.2f}'.format(size, duration * 1e6) for size, duration in results
+            )
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+from collections import Counter, OrderedDict
+
+from socketio import packet
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Tick broadcasting:
+#   - Every packet sent to a room is encoded once into Socket.IO frames and the same frames are
+#     written to every participant through engine.io, instead of going through emit, which encodes
+#     again for each participant
+#   - Clients that opted in receive all their messages of one tick in a single tick_batch packet
+#   - Only reaches sockets connected to this process. Rooms never span workers in a sharded
+#     deployment, so this is every participant.
+#   - Flow control: droppable packets (ticks other than json keyframes) are not queued for a
+#     socket that already has max_queue packets waiting to be written. A slow client skips ticks
+#     until it catches up and then continues with the latest one instead of buffering every tick.
+#     Reliable packets are always queued. A client skipping ticks for more than max_behind sends in
+#     a row is disconnected.
+
+# Viewers receive ticks through a per encoding room, everything else goes to the room code
+def tick_room(room_code, encoding):
+    return '{}/{}'.format(room_code, encoding)
+
+class Broadcaster:
+    def __init__(self, socket_io, max_queue=None, max_behind=None):
+        # The python-socketio server behind Flask-SocketIO
+        self.server = socket_io.server
+        self.max_queue = max_queue
+        self.max_behind = max_behind
+        # Map connection id to the number of packets skipped for it in a row
+        self.behind = {}
+        # Connection ids that want their messages of a tick batched into one packet
+        self.batching = set()
+        # Totals by namespace
+        self.ticks = 0
+        self.encodes = Counter()
+        self.sends = Counter()
+        self.bytes_sent = Counter()
+        self.dropped = Counter()
+        self.disconnected = Counter()
+        # Send queue depth seen on every send, by namespace
+        self.queue_depth_total = Counter()
+        self.queue_depth_samples = Counter()
+        self.queue_depth_max = Counter()
+
+    def participants(self, namespace, room):
+        try:
+            return list(self.server.manager.get_participants(namespace, room))
+        except KeyError:
+            # Nobody ever joined the room
+            return []
+
+    def encode(self, namespace, event, data):
+        encoded = packet.Packet(packet.EVENT, data=[event, data], namespace=namespace).encode()
+        self.encodes[namespace] += 1
+        # Packets carrying binary data encode to the packet followed by its attachments
+        if not isinstance(encoded, list):
+            encoded = [encoded]
+        return encoded
+
+    # Number of packets engine.io has not written to the socket yet
+    def queued(self, sid):
+        socket = self.server.eio.sockets.get(sid)
+        return socket.queue.qsize() if socket is not None else 0
+
+    def send(self, namespace, sid, frames, droppable=False):
+        if self.max_queue is not None:
+            depth = self.queued(sid)
+            self.queue_depth_total[namespace] += depth
+            self.queue_depth_samples[namespace] += 1
+            self.queue_depth_max[namespace] = max(self.queue_depth_max[namespace], depth)
+
+            if depth < self.max_queue:
+                self.behind.pop(sid, None)
+            elif droppable:
+                self.dropped[namespace] += 1
+                behind = self.behind[sid] = self.behind.get(sid, 0) + 1
+                if self.max_behind is not None and behind == self.max_behind:
+                    self.disconnect(namespace, sid)
+                return
+
+        self.write(sid, frames)
+        self.bytes_sent[namespace] += sum(len(frame) for frame in frames)
+        self.sends[namespace] += 1
+
+    # Hands the frames of one packet to engine.io, the first one is the packet itself and the rest
+    # its binary attachments
+    def write(self, sid, frames):
+        binary = False
+        for frame in frames:
+            self.server.eio.send(sid, frame, binary=binary)
+            binary = True
+
+    def close(self, namespace, sid):
+        self.server.disconnect(sid, namespace=namespace)
+
+    def disconnect(self, namespace, sid):
+        logger.warning(
+            "Disconnecting client that stopped keeping up (id: {}, namespace: {}, queued: {})".format(
+                sid, namespace, self.queued(sid)
+            )
+        )
+        self.disconnected[namespace] += 1
+        self.close(namespace, sid)
+
+    # Drops everything kept about a connection once it is gone
+    def forget(self, sid):
+        self.batching.discard(sid)
+        self.behind.pop(sid, None)
+
+    def batch(self, namespace):
+        return TickBatch(self, namespace)
+
+    # Sends one reliable packet to a room right away
+    def emit(self, namespace, room, event, data):
+        batch = TickBatch(self, namespace)
+        batch.broadcast(room, event, data)
+        batch.flush()
+
+    def count_tick(self):
+        self.ticks += 1
+
+    def stats(self):
+        ticks = max(self.ticks, 1)
+        return {
+            'ticks': self.ticks,
+            'encodes_per_tick': sum(self.encodes.values()) / ticks,
+            'sends_per_tick': sum(self.sends.values()) / ticks,
+            'encodes': dict(self.encodes),
+            'sends': dict(self.sends),
+            'bytes_sent': dict(self.bytes_sent),
+            'dropped': dict(self.dropped),
+            'disconnected': dict(self.disconnected),
+            'queue_depth_mean': {
+                namespace: self.queue_depth_total[namespace] / samples
+                for namespace, samples in self.queue_depth_samples.items()
+            },
+            'queue_depth_max': dict(self.queue_depth_max),
+        }
+
+# Messages of one namespace for one tick, nothing is encoded or sent before flush
+class TickBatch:
+    def __init__(self, broadcaster, namespace):
+        self.broadcaster = broadcaster
+        self.namespace = namespace
+        # Map room to the (event, data, droppable) sent to all of it, and connection id to its own
+        # messages
+        self.room_messages = OrderedDict()
+        self.sid_messages = OrderedDict()
+
+    def broadcast(self, room, event, data, droppable=False):
+        self.room_messages.setdefault(room, []).append((event, data, droppable))
+
+    def send(self, sid, event, data, droppable=False):
+        self.sid_messages.setdefault(sid, []).append((event, data, droppable))
+
+    def flush(self):
+        broadcaster = self.broadcaster
+        namespace = self.namespace
+
+        # Every connection's messages in order, shared messages refer to frames encoded once
+        messages = OrderedDict()
+        for room, room_messages in self.room_messages.items():
+            participants = broadcaster.participants(namespace, room)
+            if not participants:
+                continue
+            for event, data, droppable in room_messages:
+                shared = (event, data, droppable, broadcaster.encode(namespace, event, data))
+                for sid in participants:
+                    messages.setdefault(sid, []).append(shared)
+        for sid, sid_messages in self.sid_messages.items():
+            messages.setdefault(sid, []).extend(
+                (event, data, droppable, None) for event, data, droppable in sid_messages
+            )
+
+        for sid, sid_messages in messages.items():
+            if len(sid_messages) > 1 and sid in broadcaster.batching:
+                frames = broadcaster.encode(
+                    namespace, 'tick_batch', {
+                        'pkt_name': 'tick_batch',
+                        'packets': [data for _, data, _, _ in sid_messages]
+                    }
+                )
+                droppable = all(droppable for _, _, droppable, _ in sid_messages)
+                broadcaster.send(namespace, sid, frames, droppable)
+                continue
+
+            for event, data, droppable, frames in sid_messages:
+                if frames is None:
+                    frames = broadcaster.encode(namespace, event, data)
+                broadcaster.send(namespace, sid, frames, droppable)
+
+        self.room_messages.clear()
+        self.sid_messages.clear()
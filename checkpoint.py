@@ -0,0 +1,70 @@
+import json
+import os
+import time
+import zlib
+
+from game.snapshot import snapshot_game
+
+# Room checkpoints:
+#   - Every open room is written to one file: its code, state, board, host and roster with their
+#     resume tokens, and a snapshot of its game (game/snapshot.py)
+#   - The file is zlib compressed json, written to a temporary file and renamed over the last one,
+#     so a crash while writing leaves the previous checkpoint intact
+#   - Encoding reads the live games and runs on the event loop, compressing and writing only
+#     touches the encoded bytes and runs in a worker thread, off the tick loop
+#   - A new process restores the rooms and resumes ticking them. Connection ids do not survive a
+#     restart: hosts and players reconnect and prove who they were with their resume token, viewers
+#     just ask for the room again.
+
+CHECKPOINT_VERSION = 1
+
+def snapshot_room(room):
+    return {
+        'host_id': room.host_id,
+        'room_code': room.room_code,
+        'game_state': room.game_state,
+        'board_description': room.board_description,
+        'resume_token': room.resume_token,
+        'players': [
+            {
+                'player_id': player.player_id,
+                'user_name': player.user_name,
+                'character': player.character,
+                'state': player.state,
+                'resume_token': player.resume_token,
+            }
+            for player in room.players
+        ],
+        'game': snapshot_game(room.game) if room.game is not None else None,
+    }
+
+def encode_checkpoint(rooms):
+    return json.dumps({
+        'version': CHECKPOINT_VERSION,
+        'saved_at': time.time(),
+        'rooms': [snapshot_room(room) for room in rooms],
+    }, separators=(',', ':')).encode('utf-8')
+
+# Writes an encoded checkpoint, returns the size of the file written. Writes running at the same
+# time must use different temporary paths.
+def write_checkpoint(path, encoded, temporary_path=None):
+    data = zlib.compress(encoded)
+    temporary_path = temporary_path or '{}.tmp'.format(path)
+    with open(temporary_path, 'wb') as checkpoint_file:
+        checkpoint_file.write(data)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temporary_path, path)
+    return len(data)
+
+# Returns the checkpoint as written, with 'saved_at' in seconds since the epoch and the rooms
+def read_checkpoint(path):
+    with open(path, 'rb') as checkpoint_file:
+        data = checkpoint_file.read()
+    try:
+        checkpoint = json.loads(zlib.decompress(data).decode('utf-8'))
+    except zlib.error as error:
+        raise ValueError("{} is not a checkpoint: {}".format(path, error))
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        raise ValueError("{} is not a version {} checkpoint".format(path, CHECKPOINT_VERSION))
+    return checkpoint
@@ -1,62 +1,226 @@
 import pymunk
+import numpy as np
+import random
+from collections import deque
 from enum import Enum
+from .movement import KEY_BITS, step_velocity
+
+# Collision handler left on a released space, so it does not keep the game that used it alive
+def ignore_collision(arbiter, space, data):
+    return True
+
 class Game:
 
     types = {"player": 1, "zombie": 2}
     MAX_VELOCITY = 100
     ACCELERATION = 1
+    # Physics step length and the period at which ticks are sent out to clients
     INTERNAL_TICK_TIME = 0.01
-    EXTERNAL_TICK_TIME = 0.01
+    EXTERNAL_TICK_TIME = 0.05
     MAX_TICKS = 60
 
-    def __init__(self, max_players = 8, min_players = 4, width = 1300.0, height = 700.0):
+    # Kinds of player state transitions reported through pop_events
+    EVENT_INFECTED = "infected"
+    EVENT_CURED = "cured"
+
+    WIDTH = 1300.0
+    HEIGHT = 700.0
+
+    # An arena.Arena sets the board size and player count and draws the spawn points from spawn_seed
+    def __init__(self, max_players = 8, min_players = 4, width = WIDTH, height = HEIGHT, tick_time = None, space_pool = None, arena = None, spawn_seed = 0):
 
-        self.starting_positions = [(100, 300), (50, 450), (600, 600), (1000, 500),
-                                   (1200, 50), (500, 200), (700, 100), (100, 300),
-                                   (500, 500), (100, 100)]
+        self.arena = arena
+        self.spawn_seed = spawn_seed
+        if arena is not None:
+            max_players = arena.max_players
+            width, height = arena.width, arena.height
+            # Indexed by character slot, slot 0 gets the first point drawn
+            self.starting_positions = arena.spawn_points(max_players, random.Random(spawn_seed))
+        else:
+            # At least Player.RADIUS away from every wall, so no body starts inside one
+            self.starting_positions = [(100, 100), (500, 500), (100, 300), (700, 100),
+                                       (500, 200), (1200, 70), (1000, 500), (600, 600),
+                                       (70, 450), (300, 600)]
         self.max_players = max_players
         self.min_players = min_players
         self.players = dict()
         self.width = width
         self.height = height
-        self.space = pymunk.Space()
-        self.add_static_scenery()
+        # Spaces come with their walls when taken from a pool that already used them
+        self.space_pool = space_pool
+        if space_pool is not None:
+            self.space, is_new_space = space_pool.acquire(width, height)
+        else:
+            self.space, is_new_space = pymunk.Space(), True
+        if is_new_space:
+            if arena is not None:
+                arena.configure_space(self.space)
+            self.add_static_scenery()
         self.zombie_collision_handler = self.space.add_collision_handler(Game.types["player"], Game.types["zombie"])
         self.started = False
         self.ended = False
         self.winner = None
-        self.space.damping = 0.3
         self.god = None
         self.time_left = Game.MAX_TICKS
         self.effects = set()
         self.player_count = 0
+        # Players with a body in the order of their movement slot, and the direction keys each holds
+        self.moving_players = []
+        self.input_dirs = np.zeros(0, dtype=np.uint8)
+        # Inputs received since the last tick, coalesced into the held keys and spells cast so far
+        # and applied all at once by apply_inputs
+        self.pending_dirs = np.zeros(0, dtype=np.uint8)
+        self.pending_spells = []
+        self.zombie_flags = np.zeros(0, dtype=bool)
+        # (body, dirs, acceleration, max velocity, stop first) of every body move_players changes,
+        # planned once and reused by every physics step until inputs, infections or god modifiers
+        # change
+        self.movement_plan = None
+        self.movement_modifiers = None
+        # Live infection bookkeeping, zombies are kept in the order they turned
+        self.human_count = 0
+        self.zombies = dict()
+        # (tick, kind, player id) transitions not yet consumed by pop_events
+        self.events = deque()
+        self.tick_count = 0
+        # Player id holding every character slot (None for a free one), and the replay.Recorder
+        # logging the game if any
+        self.slots = []
+        self.recorder = None
+        self.tick_time = tick_time if tick_time is not None else Game.EXTERNAL_TICK_TIME
+        self.steps_per_tick = max(1, int(round(self.tick_time / Game.INTERNAL_TICK_TIME)))
 
         def turn_zombie(arbiter, space, data):
             if self.god is not None and GodAction.IMMUNE in self.god.current_actions:
                 return True
 
-            player = self.players[arbiter.shapes[0].id]
-            player.shape.collision_type = Game.types["zombie"]
-            ended = True
-            for player in self.players.values():
-                if player.shape.collision_type == Game.types["player"]:
-                    ended = False
-            self.ended = ended
-            if ended:
+            self.set_zombie(self.players[arbiter.shapes[0].id], True)
+            if self.human_count == 0:
+                self.ended = True
                 self.winner = Game.types["zombie"]
             return True
 
         self.zombie_collision_handler.begin = turn_zombie
-        self.space.damping = 0.1
+        # Bodies keep their velocity between steps, acceleration is applied by move_players
+        self.space.damping = 1.0
 
-    def add_player(self, id):
-        if self.player_count == 0:
-            self.players[id] = Player(id, self.space, self.starting_positions.pop(), self, isZombie=True)
-        elif self.player_count == 1 and self.god is None:
+    # Players take the lowest free character slot unless given one, and keep it as their index in
+    # binary ticks and replays. Slot 0 is the first zombie, slot 1 the god, and every slot has its
+    # own spawn point. Returns the slot.
+    def add_player(self, id, index=None):
+        if index is None:
+            index = self.free_slot()
+        self.slots.extend([None] * (index + 1 - len(self.slots)))
+        self.slots[index] = id
+        if index == 1 and self.god is None:
             self.add_god(id)
         else:
-            self.players[id] = Player(id, self.space, self.starting_positions.pop(), self)
+            position = self.starting_positions[index]
+            self.add_moving_player(
+                Player(id, self.space, position, self, isZombie=index == 0, index=index)
+            )
         self.player_count += 1
+        return index
+
+    def free_slot(self):
+        for index, id in enumerate(self.slots):
+            if id is None:
+                return index
+        return len(self.slots)
+
+    # Frees the slot of a player leaving the lobby, the game must not have started
+    def remove_player(self, id):
+        index = self.slots.index(id)
+        self.slots[index] = None
+        while self.slots and self.slots[-1] is None:
+            self.slots.pop()
+        self.player_count -= 1
+        if self.god is not None and self.god.id == id:
+            self.god = None
+            return
+
+        player = self.players.pop(id)
+        self.space.remove(player.body, player.shape)
+        del self.moving_players[player.slot]
+        for slot, moving in enumerate(self.moving_players):
+            moving.slot = slot
+        self.input_dirs = np.delete(self.input_dirs, player.slot)
+        self.pending_dirs = np.delete(self.pending_dirs, player.slot)
+        self.zombie_flags = np.delete(self.zombie_flags, player.slot)
+        self.movement_plan = None
+        if player.is_zombie():
+            del self.zombies[id]
+        else:
+            self.human_count -= 1
+
+    def add_moving_player(self, player):
+        player.slot = len(self.moving_players)
+        self.players[player.id] = player
+        self.moving_players.append(player)
+        self.input_dirs = np.append(self.input_dirs, np.uint8(0))
+        self.pending_dirs = np.append(self.pending_dirs, np.uint8(0))
+        self.zombie_flags = np.append(self.zombie_flags, player.is_zombie())
+        self.movement_plan = None
+        if player.is_zombie():
+            self.zombies[player.id] = player
+        else:
+            self.human_count += 1
+
+    def set_zombie(self, player, is_zombie):
+        if player.is_zombie() == is_zombie:
+            return
+
+        player.shape.collision_type = Game.types["zombie" if is_zombie else "player"]
+        self.zombie_flags[player.slot] = is_zombie
+        self.movement_plan = None
+        if is_zombie:
+            self.zombies[player.id] = player
+            self.human_count -= 1
+            self.events.append((self.tick_count, Game.EVENT_INFECTED, player.id))
+        else:
+            del self.zombies[player.id]
+            self.human_count += 1
+            self.events.append((self.tick_count, Game.EVENT_CURED, player.id))
+
+    # Hands a player over to a new id (a client reconnecting), keeping its place in every ordering
+    def rebind_player(self, id, new_id):
+        if self.god is not None and self.god.id == id:
+            self.god.id = new_id
+        self.slots = [new_id if held == id else held for held in self.slots]
+        if self.recorder is not None and id in self.recorder.indexes:
+            self.recorder.indexes[new_id] = self.recorder.indexes.pop(id)
+
+        player = self.players.get(id)
+        if player is None:
+            return
+        player.id = new_id
+        player.shape.id = new_id
+        self.players = {new_id if key == id else key: value for key, value in self.players.items()}
+        self.zombies = {new_id if key == id else key: value for key, value in self.zombies.items()}
+
+    @property
+    def zombie_count(self):
+        return len(self.zombies)
+
+    def pop_events(self):
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+    # Gives the space back to the pool, the game cannot be used afterwards
+    def release(self):
+        if self.space is None:
+            return
+        if self.recorder is not None:
+            self.recorder.close()
+        self.zombie_collision_handler.begin = ignore_collision
+        if self.space_pool is not None:
+            self.space_pool.release(self.space, self.width, self.height)
+        self.space = None
+        self.players.clear()
+        self.moving_players = []
+        self.movement_plan = None
+        self.zombies.clear()
 
     def add_god(self, id):
         self.god = God(id)
@@ -76,35 +240,92 @@ class Game:
             line.friction = 0.9
         self.space.add(static_lines)
 
+    # Buffers a key press or release until the next tick, returns False if it was ignored. Releasing
+    # a key that is not held is ignored, releases are not rate limited by the server.
     def input(self, id, key, action):
+        player = self.players.get(id)
+        bit = KEY_BITS.get(key[:1])
+        if player is None or bit is None:
+            return False
         if action == "pressed":
-            self.players[id].current_accel_dirs.add(key[0])
+            self.pending_dirs[player.slot] |= bit
+        elif self.pending_dirs[player.slot] & bit:
+            self.pending_dirs[player.slot] &= 0xFF ^ bit
         else:
-            self.players[id].current_accel_dirs.remove(key[0])
+            return False
+        if self.recorder is not None:
+            self.recorder.record_input(self.tick_count, id, bit, action == "pressed")
+        return True
+
+    # Makes the inputs buffered since the last tick visible to the simulation. The spell list is
+    # swapped rather than cleared, the game may advance outside of the thread buffering inputs.
+    def apply_inputs(self):
+        self.input_dirs[:] = self.pending_dirs
+        self.movement_plan = None
+        spells, self.pending_spells = self.pending_spells, []
+        for code in spells:
+            self.cast_spell(code)
+
+    # Applies held directions and god modifiers to every moving body. Runs before every physics step
+    # like the per body velocity callbacks it replaced, so movement does not depend on how many
+    # steps a network tick holds.
+    def move_players(self):
+        current_actions = self.god.current_actions if self.god is not None else ()
+        modifiers = (GodAction.FREEZE in current_actions, GodAction.SPEED_UP in current_actions)
+        if self.movement_plan is None or modifiers != self.movement_modifiers:
+            self.movement_plan = self.plan_movement(*modifiers)
+            self.movement_modifiers = modifiers
+
+        for body, dirs, acceleration, max_velocity, stop in self.movement_plan:
+            vx, vy = (0.0, 0.0) if stop else body.velocity
+            new_vx, new_vy = step_velocity(vx, vy, dirs, acceleration, max_velocity)
+            if stop or new_vx != vx or new_vy != vy:
+                body.velocity = new_vx, new_vy
+
+    # Bodies without held keys keep their velocity, unless they are zombies frozen by the god. Sped
+    # up humans accelerate 1.5x faster up to twice the max velocity.
+    def plan_movement(self, frozen, sped_up):
+        plan = []
+        for player, dirs, zombie in zip(
+            self.moving_players, self.input_dirs.tolist(), self.zombie_flags.tolist()
+        ):
+            stop = frozen and zombie
+            if not dirs and not stop:
+                continue
+            if sped_up and not zombie:
+                acceleration, max_velocity = Game.ACCELERATION * 1.5, Game.MAX_VELOCITY * 2
+            else:
+                acceleration, max_velocity = Game.ACCELERATION, Game.MAX_VELOCITY
+            plan.append((player.body, dirs, acceleration, max_velocity, stop))
+        return plan
 
+    # Buffers a spell until the next tick, returns False if it was ignored
     def god_input(self, id, code):
-        if self.god is not None and id == self.god.id:
-            if code in self.god.possible_actions:
-                self.god.current_actions[code] = self.god.possible_actions[code]
-                self.god.cooldown_actions[code] = self.god.possible_actions[code]
-                del self.god.possible_actions[code]
+        if (
+            self.god is None or id != self.god.id or code not in GodAction.CODES
+            or code in self.pending_spells
+        ):
+            return False
+        self.pending_spells.append(code)
+        if self.recorder is not None:
+            self.recorder.record_spell(self.tick_count, code)
+        return True
 
+    def cast_spell(self, code):
+        if code in self.god.possible_actions:
+            self.god.current_actions[code] = self.god.possible_actions[code]
+            self.god.cooldown_actions[code] = self.god.possible_actions[code]
+            del self.god.possible_actions[code]
+
+    # Cures the most recently infected zombie, as long as it is not the last one
     def cure_player(self):
-        zombie_count = 0
-        zombie_obj = None
-        for obj in self.players.values():
-            if obj.shape.collision_type == Game.types["zombie"]:
-                print(obj.id)
-                zombie_count += 1
-                zombie_obj = obj
-        if zombie_count > 1:
-            zombie_obj.shape.collision_type = Game.types["player"]
+        if len(self.zombies) > 1:
+            self.set_zombie(next(reversed(self.zombies.values())), False)
         else:
             self.god.possible_actions[GodAction.CURE] = self.god.cooldown_actions[GodAction.CURE]
             del self.god.cooldown_actions[GodAction.CURE]
-    # [playerId:{position:point, velocity:point, isZombie:bool}]
 
-    def tick(self):
+    def step(self):
         self.space.step(Game.INTERNAL_TICK_TIME)
         if self.god is not None and GodAction.CURE in self.god.current_actions:
             self.cure_player()
@@ -114,20 +335,45 @@ class Game:
         if self.time_left <= 0:
             self.ended = True
             self.winner = Game.types["player"]
+
+    # Runs all physics steps that make up one external tick
+    def advance(self):
+        self.tick_count += 1
+        self.apply_inputs()
+        for _ in range(self.steps_per_tick):
+            self.move_players()
+            self.step()
+            if self.ended:
+                break
+        if self.recorder is not None:
+            self.recorder.record_tick(self.tick_count, self)
+            if self.ended:
+                self.recorder.finish(self.tick_count, self.winner)
+        return self.ended, self.winner
+
+    def god_spells(self):
+        if self.god is None:
+            return None
+        return {"possible": list(self.god.possible_actions.keys()),
+                "cooldown": {x.id : x.cooldown for x in self.god.cooldown_actions.values()}
+               }
+
+    # [playerId:{position:point, velocity:point, isZombie:bool}]
+    # Positions are read once per body and zombie flags from the movement arrays, this runs every
+    # tick for every player of the room
+    def tick_data(self):
         data = dict()
-        for player in self.players.items():
-            data[player[0]] = dict()
-            data[player[0]]["position"] = dict()
-            data[player[0]]["position"]["x"] = player[1].body.position[0]
-            data[player[0]]["position"]["y"] = player[1].body.position[1]
-            self.space.reindex_shapes_for_body(player[1].body)
-            data[player[0]]["isZombie"] = player[1].shape.collision_type == Game.types["zombie"]
+        zombie_flags = self.zombie_flags.tolist()
+        for id, player in self.players.items():
+            x, y = player.body.position
+            data[id] = {"position": {"x": x, "y": y}, "isZombie": zombie_flags[player.slot]}
         if self.god is not None:
-            data["god_spells"] = {"possible": list(self.god.possible_actions.keys()),
-                                  "cooldown": {x.id : x.cooldown for x in self.god.cooldown_actions.values()}
-                                 }
-        return data, self.ended, self.winner
+            data["god_spells"] = self.god_spells()
+        return data
 
+    def tick(self):
+        self.advance()
+        return self.tick_data(), self.ended, self.winner
 
     def start(self):
         self.started = True
@@ -137,8 +383,9 @@ class Game:
 class Player:
     RADIUS = 60.0
 
-    def __init__(self, id, space, pos, game, isZombie=False):
+    def __init__(self, id, space, pos, game, isZombie=False, index=0):
         self.id = id
+        self.index = index
         self.body = pymunk.Body(1)
         self.space = space
         self.body.position = pos
@@ -150,34 +397,13 @@ class Player:
             self.shape.collision_type = Game.types["zombie"]
         else:
             self.shape.collision_type = Game.types["player"]
-        self.current_accel_dirs = set()
         self.shape.id = id
         self.game = game
+        # Position in the game's movement arrays, assigned when added to the game
+        self.slot = None
 
-        def velocity_cb(body, gravity, damping, dt):
-            velocity_vector = [body.velocity[0], body.velocity[1]]
-            accel_modifier = 1
-            max_vel_mod = 1
-            if self.shape.collision_type == Game.types["zombie"] and \
-                self.game.god is not None and GodAction.FREEZE in self.game.god.current_actions:
-                body.velocity = [0, 0]
-            if self.shape.collision_type == Game.types["player"] and \
-                self.game.god is not None and \
-                GodAction.SPEED_UP in self.game.god.current_actions:
-                accel_modifier = 1.5
-                max_vel_mod = 2
-
-            if body.velocity[0] < Game.MAX_VELOCITY * max_vel_mod and "r" in self.current_accel_dirs:
-                velocity_vector[0] = min(Game.MAX_VELOCITY * max_vel_mod, body.velocity[0] + Game.ACCELERATION * accel_modifier )
-            if body.velocity[0] > -Game.MAX_VELOCITY * max_vel_mod and "l" in self.current_accel_dirs:
-                velocity_vector[0] = max(-Game.MAX_VELOCITY * max_vel_mod, body.velocity[0]-Game.ACCELERATION * accel_modifier)
-            if body.velocity[1] < Game.MAX_VELOCITY * max_vel_mod and "d" in self.current_accel_dirs:
-                velocity_vector[1] = min(Game.MAX_VELOCITY * max_vel_mod, body.velocity[1]+Game.ACCELERATION * accel_modifier)
-            if body.velocity[1] > -Game.MAX_VELOCITY * max_vel_mod and "u" in self.current_accel_dirs:
-                velocity_vector[1] = max(-Game.MAX_VELOCITY * max_vel_mod, body.velocity[1]-Game.ACCELERATION * accel_modifier)
-            body.velocity = velocity_vector
-
-        self.body.velocity_func = velocity_cb
+    def is_zombie(self):
+        return self.shape.collision_type == Game.types["zombie"]
 
 class God:
     def __init__(self, id):
@@ -218,6 +444,7 @@ class GodAction:
     SPEED_UP = 2
     IMMUNE = 3
     CURE = 4
+    CODES = (FREEZE, SPEED_UP, IMMUNE, CURE)
     def __init__(self, id, duration, cooldown):
         self.id = id
         self.full_duration = duration
@@ -0,0 +1,76 @@
+import math
+
+from . import Game, Player
+
+# Large arenas:
+#   - Rooms of hundreds of players play on a board sized for them, the default board only fits
+#     about ten players
+#   - Spawn points are drawn from a grid whose cells fit a player, a gap and some jitter, at most
+#     one per cell, so players never start overlapping whatever the draw
+#   - Spaces can use chipmunk's spatial hash instead of the default bounding box tree, with cells
+#     the size of a player. On boards half filled with players walking at random the tree is still
+#     as fast or faster (python -m benchmarks.arena_scaling), so the hash is opt in for crowded
+#     boards.
+
+# Largest coordinate the binary viewer packets can carry (int16 quarter pixels, see packets.py)
+MAX_COORDINATE = 32767 / 4
+
+class Arena:
+    # Free space kept between two spawned players, and how far a spawn point may be moved off the
+    # centre of its cell in each axis
+    SPAWN_GAP = 10.0
+    SPAWN_JITTER = 40.0
+    # Cells of the hash per shape in the space, chipmunk suggests about 10
+    HASH_CELLS_PER_SHAPE = 10
+
+    # The board is sized so that about fill of its spawn cells are used by max_players, keeping the
+    # aspect ratio and never shrinking below the default board
+    def __init__(self, max_players, width=None, height=None, fill=0.5, radius=None,
+                 spatial_hash=False):
+        self.max_players = max_players
+        self.spatial_hash = spatial_hash
+        self.radius = radius if radius is not None else Player.RADIUS
+        self.spacing = 2 * self.radius + Arena.SPAWN_GAP + Arena.SPAWN_JITTER
+
+        if width is None or height is None:
+            aspect = Game.WIDTH / Game.HEIGHT
+            rows = math.ceil(math.sqrt(max_players / fill / aspect))
+            columns = math.ceil(max_players / fill / rows)
+            width = max(Game.WIDTH, columns * self.spacing)
+            height = max(Game.HEIGHT, rows * self.spacing)
+        if width > MAX_COORDINATE or height > MAX_COORDINATE:
+            raise ValueError(
+                "A {}x{} arena does not fit in viewer packets, {} is the largest side".format(
+                    width, height, MAX_COORDINATE
+                )
+            )
+        self.width = float(width)
+        self.height = float(height)
+        self.columns = int(self.width // self.spacing)
+        self.rows = int(self.height // self.spacing)
+        if self.columns * self.rows < max_players:
+            raise ValueError("A {}x{} arena only fits {} players, not {}".format(
+                self.width, self.height, self.columns * self.rows, max_players
+            ))
+
+    # Returns count spawn points, rng is a random.Random
+    def spawn_points(self, count, rng):
+        if count > self.columns * self.rows:
+            raise ValueError("The arena only fits {} players".format(self.columns * self.rows))
+        jitter = Arena.SPAWN_JITTER / 2
+        points = []
+        for cell in rng.sample(range(self.columns * self.rows), count):
+            row, column = divmod(cell, self.columns)
+            points.append((
+                (column + 0.5) * self.spacing + rng.uniform(-jitter, jitter),
+                (row + 0.5) * self.spacing + rng.uniform(-jitter, jitter),
+            ))
+        return points
+
+    # Switches a space to a spatial hash with cells about the size of a player
+    def configure_space(self, space):
+        if not self.spatial_hash:
+            return
+        space.use_spatial_hash(
+            2 * self.radius, (self.max_players + 4) * Arena.HASH_CELLS_PER_SHAPE
+        )
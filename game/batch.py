@@ -0,0 +1,291 @@
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+import zipfile
+
+import numpy as np
+
+from . import Game, GodAction
+from .movement import DIR_UP, DIR_DOWN, DIR_LEFT, DIR_RIGHT
+
+# Batch simulation:
+#   - Plays many bot driven games headless, stepping each one as fast as the CPU allows, for
+#     balance testing of the game and the god spells
+#   - Games are handed out in chunks to a pool of worker processes, one per core by default. Every
+#     game is seeded from the batch seed and its index, so a batch gives the same outcomes however
+#     it is split up.
+#   - Outcomes are streamed to a columnar results file as chunks complete, see ResultsWriter
+#
+# Run from the repository root:
+#
+#   python -m game.batch --games 10000 --policy chase --god eager --out results.zip
+
+KEY_NAMES = ((DIR_UP, 'up'), (DIR_DOWN, 'down'), (DIR_LEFT, 'left'), (DIR_RIGHT, 'right'))
+
+# Timeline entry kinds
+TIMELINE_INFECTED = 1
+TIMELINE_CURED = 2
+TIMELINE_KINDS = {Game.EVENT_INFECTED: TIMELINE_INFECTED, Game.EVENT_CURED: TIMELINE_CURED}
+
+SPELL_NAMES = {
+    GodAction.FREEZE: 'freeze',
+    GodAction.SPEED_UP: 'speed_up',
+    GodAction.IMMUNE: 'immune',
+    GodAction.CURE: 'cure',
+}
+
+# Per game columns and their types, timeline columns hold one row per event of every game
+GAME_COLUMNS = (
+    ('game', np.int64),
+    ('winner', np.int8),
+    ('ticks', np.int32),
+    ('duration', np.float64),
+    ('players', np.int8),
+    ('infections', np.int16),
+    ('cures', np.int16),
+    ('timeline_length', np.int32),
+) + tuple(('spells_' + name, np.int16) for name in SPELL_NAMES.values())
+TIMELINE_COLUMNS = (
+    ('timeline_game', np.int64),
+    ('timeline_tick', np.int32),
+    ('timeline_kind', np.int8),
+)
+
+# Input policies, called every tick with the game, the ids of the players they drive, their held
+# direction bits and the game's random generator. They return the bits each player should hold.
+
+# Holds a new random set of keys now and then
+def random_policy(game, ids, held, rng, change=0.1):
+    return [
+        rng.randrange(16) if rng.random() < change else bits for bits in held
+    ]
+
+# Zombies head for the closest human and humans away from the closest zombie, each player is slow
+# to react now and then and keeps its keys for the tick
+def chase_policy(game, ids, held, rng, dead_zone=5.0, slow=0.2):
+    zombies = [player.body.position for player in game.zombies.values()]
+    humans = [
+        player.body.position for player in game.moving_players if not player.is_zombie()
+    ]
+    wanted = []
+    for id, bits in zip(ids, held):
+        if rng.random() < slow:
+            wanted.append(bits)
+            continue
+        player = game.players[id]
+        position = player.body.position
+        others = humans if player.is_zombie() else zombies
+        if not others:
+            wanted.append(0)
+            continue
+        target = min(others, key=position.get_dist_sqrd)
+        dx, dy = target - position
+        if not player.is_zombie():
+            dx, dy = -dx, -dy
+        bits = 0
+        if dx > dead_zone:
+            bits |= DIR_RIGHT
+        elif dx < -dead_zone:
+            bits |= DIR_LEFT
+        if dy > dead_zone:
+            bits |= DIR_DOWN
+        elif dy < -dead_zone:
+            bits |= DIR_UP
+        wanted.append(bits)
+    return wanted
+
+POLICIES = {'random': random_policy, 'chase': chase_policy}
+
+# God policies, called every tick with the god and the spells it may cast. They return the spells
+# to cast this tick.
+
+def idle_god(god, spells, rng):
+    return ()
+
+# Casts every spell as soon as it comes off cooldown
+def eager_god(god, spells, rng):
+    return [code for code in spells if code in god.possible_actions]
+
+# Casts one of the available spells now and then
+def random_god(god, spells, rng, chance=0.02):
+    available = [code for code in spells if code in god.possible_actions]
+    if available and rng.random() < chance:
+        return (rng.choice(available), )
+    return ()
+
+GOD_POLICIES = {'none': idle_god, 'eager': eager_god, 'random': random_god}
+
+class BatchConfig:
+    def __init__(self, seed=0, players=6, policy='random', god_policy='random',
+                 spells=GodAction.CODES, tick_time=Game.EXTERNAL_TICK_TIME):
+        self.seed = seed
+        self.players = players
+        self.policy = policy
+        self.god_policy = god_policy
+        self.spells = tuple(spells)
+        self.tick_time = tick_time
+
+# Plays one game to its end, returns its per game values and its timeline of (tick, kind) entries
+def play_game(index, config):
+    rng = random.Random(config.seed * 1000003 + index)
+    policy = POLICIES[config.policy]
+    god_policy = GOD_POLICIES[config.god_policy]
+
+    game = Game(tick_time=config.tick_time)
+    for i in range(config.players):
+        game.add_player('bot-{}'.format(i))
+    game.start()
+
+    ids = [player.id for player in game.moving_players]
+    held = [0] * len(ids)
+    spells_cast = dict.fromkeys(SPELL_NAMES, 0)
+    timeline = []
+
+    while not game.ended:
+        wanted = policy(game, ids, held, rng)
+        for i, (old, new) in enumerate(zip(held, wanted)):
+            changed = old ^ new
+            if not changed:
+                continue
+            for bit, key in KEY_NAMES:
+                if changed & bit:
+                    game.input(ids[i], key, 'pressed' if new & bit else 'released')
+        held = wanted
+
+        if game.god is not None:
+            for code in god_policy(game.god, config.spells, rng):
+                if code in game.god.possible_actions and game.god_input(game.god.id, code):
+                    spells_cast[code] += 1
+
+        game.advance()
+        for tick, event, _ in game.pop_events():
+            timeline.append((tick, TIMELINE_KINDS[event]))
+    game.release()
+
+    kinds = [kind for _, kind in timeline]
+    values = {
+        'game': index,
+        'winner': game.winner or 0,
+        'ticks': game.tick_count,
+        'duration': game.tick_count * config.tick_time,
+        'players': config.players,
+        'infections': kinds.count(TIMELINE_INFECTED),
+        'cures': kinds.count(TIMELINE_CURED),
+        'timeline_length': len(timeline),
+    }
+    for code, name in SPELL_NAMES.items():
+        values['spells_' + name] = spells_cast[code]
+    return values, timeline
+
+# Plays a chunk of games in a worker, returns the chunk's columns
+def play_chunk(task):
+    indexes, config = task
+    rows = []
+    timeline_rows = []
+    for index in indexes:
+        values, timeline = play_game(index, config)
+        rows.append(values)
+        timeline_rows.extend((index, tick, kind) for tick, kind in timeline)
+
+    columns = {
+        name: np.array([row[name] for row in rows], dtype=dtype) for name, dtype in GAME_COLUMNS
+    }
+    for position, (name, dtype) in enumerate(TIMELINE_COLUMNS):
+        columns[name] = np.array([row[position] for row in timeline_rows], dtype=dtype)
+    return columns
+
+# Results file:
+#   - A zip of .npy arrays, one per column per chunk, named '<column>/<chunk number>.npy'
+#   - Every chunk is appended and the file closed again as soon as it is done, so an interrupted
+#     batch still leaves the chunks completed so far readable
+#   - load_results concatenates the chunks into one array per column, rows of per game columns
+#     are in completion order, sort them by the game column if needed
+class ResultsWriter:
+    def __init__(self, path):
+        self.path = path
+        self.chunks = 0
+        # Start from an empty file
+        zipfile.ZipFile(path, 'w').close()
+
+    def write(self, columns):
+        with zipfile.ZipFile(self.path, 'a') as results_file:
+            for name, values in columns.items():
+                with results_file.open('{}/{:06d}.npy'.format(name, self.chunks), 'w') as entry:
+                    np.lib.format.write_array(entry, values, allow_pickle=False)
+        self.chunks += 1
+
+def load_results(path):
+    chunks = {}
+    with zipfile.ZipFile(path) as results_file:
+        for entry in sorted(results_file.namelist()):
+            name = entry.split('/')[0]
+            with results_file.open(entry) as data:
+                chunks.setdefault(name, []).append(np.lib.format.read_array(data))
+    return {name: np.concatenate(values) for name, values in chunks.items()}
+
+def run_batch(games, config, workers=None, chunk_size=50, on_chunk=None):
+    tasks = [
+        (range(start, min(start + chunk_size, games)), config)
+        for start in range(0, games, chunk_size)
+    ]
+    if workers == 1:
+        for task in tasks:
+            on_chunk(play_chunk(task))
+        return
+    with multiprocessing.Pool(workers) as pool:
+        for columns in pool.imap_unordered(play_chunk, tasks):
+            on_chunk(columns)
+
+def main():
+    parser = argparse.ArgumentParser(description='Play many bot driven games headless')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=6,
+                        help='players per game including the god, at most 10')
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='random')
+    parser.add_argument('--god', choices=sorted(GOD_POLICIES), default='random')
+    parser.add_argument('--spells', default=','.join(str(code) for code in GodAction.CODES),
+                        help='comma separated spell codes the god may cast')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=50)
+    parser.add_argument('--out', help='columnar results file, see ResultsWriter')
+    args = parser.parse_args()
+
+    if not 3 <= args.players <= 10:
+        parser.error('--players must be between 3 and 10')
+    spells = tuple(int(code) for code in args.spells.split(',') if code)
+    if any(code not in GodAction.CODES for code in spells):
+        parser.error('--spells must be codes out of {}'.format(GodAction.CODES))
+
+    config = BatchConfig(args.seed, args.players, args.policy, args.god, spells)
+    writer = ResultsWriter(args.out) if args.out else None
+    games = 0
+    winners = np.zeros(3, dtype=np.int64)
+    ticks = 0
+
+    def on_chunk(columns):
+        nonlocal games, ticks
+        games += len(columns['game'])
+        ticks += int(columns['ticks'].sum())
+        winners[:] += np.bincount(columns['winner'], minlength=3)
+        if writer is not None:
+            writer.write(columns)
+
+    start = time.perf_counter()
+    run_batch(args.games, config, args.workers, args.chunk_size, on_chunk)
+    elapsed = time.perf_counter() - start
+
+    print(
+        'games: {}, workers: {}, {:.1f} games/s, {:.0f} ticks/s, humans won: {}, zombies won: {}'
+        .format(
+            games, args.workers, games / elapsed, ticks / elapsed,
+            winners[Game.types['player']], winners[Game.types['zombie']]
+        ),
+        file=sys.stderr
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+# Held direction keys are kept as one bitmask per body
+DIR_UP = 1
+DIR_DOWN = 2
+DIR_LEFT = 4
+DIR_RIGHT = 8
+
+KEY_BITS = {"u": DIR_UP, "d": DIR_DOWN, "l": DIR_LEFT, "r": DIR_RIGHT}
+
+# Velocity of one body after one physics step with dirs held, left/up win over right/down when both
+# are held. Acceleration along an axis only applies while below max_velocity in that direction.
+# Called for every moving body before every physics step, so it sticks to plain floats: numpy's
+# per call overhead is far above the handful of comparisons for the few bodies of a room.
+def step_velocity(vx, vy, dirs, acceleration, max_velocity):
+    if dirs & DIR_LEFT and vx > -max_velocity:
+        vx = max(vx - acceleration, -max_velocity)
+    elif dirs & DIR_RIGHT and vx < max_velocity:
+        vx = min(vx + acceleration, max_velocity)
+    if dirs & DIR_UP and vy > -max_velocity:
+        vy = max(vy - acceleration, -max_velocity)
+    elif dirs & DIR_DOWN and vy < max_velocity:
+        vy = min(vy + acceleration, max_velocity)
+    return vx, vy
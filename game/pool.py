@@ -0,0 +1,41 @@
+import pymunk
+
+# Space pool:
+#   - Keeps the spaces of finished games, with their walls, so short games do not allocate and free
+#     a native space, its walls and its collision handler every time
+#   - Spaces are handed back empty of bodies, the game releasing a space detaches its collision
+#     handlers from it
+#   - Spaces are kept per board size, at most max_size of each
+
+class SpacePool:
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        # Map (width, height) to the idle spaces of that size
+        self.free_spaces = {}
+        self.created = 0
+        self.reused = 0
+
+    def __len__(self):
+        return sum(len(spaces) for spaces in self.free_spaces.values())
+
+    # Returns (space, is_new), the walls of a new space are still to be added
+    def acquire(self, width, height):
+        spaces = self.free_spaces.get((width, height))
+        if spaces:
+            self.reused += 1
+            return spaces.pop(), False
+        self.created += 1
+        return pymunk.Space(), True
+
+    def release(self, space, width, height):
+        reset_space(space)
+        spaces = self.free_spaces.setdefault((width, height), [])
+        if len(spaces) < self.max_size:
+            spaces.append(space)
+
+# Removes every body and the shapes attached to them, keeping the walls on the static body
+def reset_space(space):
+    shapes = [shape for shape in space.shapes if shape.body is not space.static_body]
+    bodies = list(space.bodies)
+    if shapes or bodies:
+        space.remove(*(shapes + bodies))
@@ -0,0 +1,235 @@
+import argparse
+import json
+import struct
+import sys
+import time
+import zlib
+
+from . import Game
+from .arena import Arena
+from .movement import KEY_BITS
+
+# Replays:
+#   - A recorder attached to a game logs everything needed to simulate the match again: the players
+#     by character slot, then every accepted input and spell with the tick it is applied at, and a crc
+#     of the state after every tick
+#   - Files are append only so that a crashed server still leaves a usable prefix
+#   - Re-simulating feeds the same inputs before the same ticks of a fresh game and checks every
+#     tick against the recorded crc, which makes recordings a regression oracle for the simulation
+#
+# Format (little endian):
+#   - header: b'ZBRP', uint16 version, float64 tick time, float64 width, float64 height,
+#     uint16 player count, uint16 arena players (0 without an arena), uint8 arena uses the spatial
+#     hash, uint32 spawn seed, then per character slot uint8 id length and the utf-8 id (empty for a
+#     slot left free). Version 1 headers have a uint8 player count and nothing about the arena.
+#     Files written before slots could be freed list the players in join order, which were their
+#     slots.
+#   - records: uint8 type, uint32 tick, then
+#       - input: uint16 player index (character slot), uint8 direction bit, uint8 pressed (uint8 index
+#         in version 1)
+#       - spell: uint8 spell code
+#       - tick: uint32 crc of the state after the tick
+#       - end: uint8 winner (0 when nobody won)
+
+MAGIC = b'ZBRP'
+VERSION = 2
+
+HEADER = struct.Struct('<4sHdddHHBI')
+HEADER_V1 = struct.Struct('<4sHdddB')
+RECORD = struct.Struct('<BI')
+INPUT = struct.Struct('<HBB')
+INPUT_V1 = struct.Struct('<BBB')
+SPELL = struct.Struct('<B')
+TICK = struct.Struct('<I')
+END = struct.Struct('<B')
+
+RECORD_INPUT = 1
+RECORD_SPELL = 2
+RECORD_TICK = 3
+RECORD_END = 4
+
+KEY_NAMES = {bit: key for key, bit in KEY_BITS.items()}
+
+def state_crc(game):
+    values = []
+    for player in game.players.values():
+        values.extend(player.body.position)
+        values.extend(player.body.velocity)
+        values.append(player.is_zombie())
+    return zlib.crc32(struct.pack('<{}d'.format(len(values)), *values))
+
+class Recorder:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        # Map player id to its character slot
+        self.indexes = {}
+
+    # Writes the header once every player has joined, the game must not have ticked yet
+    def start(self, game):
+        self.file = open(self.path, 'wb')
+        ids = [str(id).encode('utf-8') if id is not None else b'' for id in game.slots]
+        self.indexes = {id: index for index, id in enumerate(game.slots) if id is not None}
+
+        arena = game.arena
+        self.file.write(HEADER.pack(
+            MAGIC, VERSION, game.tick_time, game.width, game.height, len(ids),
+            arena.max_players if arena is not None else 0,
+            arena is not None and arena.spatial_hash, game.spawn_seed
+        ))
+        for id in ids:
+            self.file.write(struct.pack('<B', len(id)) + id)
+        game.recorder = self
+
+    def record_input(self, tick, id, bit, pressed):
+        self.file.write(RECORD.pack(RECORD_INPUT, tick) + INPUT.pack(self.indexes[id], bit, pressed))
+
+    def record_spell(self, tick, code):
+        self.file.write(RECORD.pack(RECORD_SPELL, tick) + SPELL.pack(code))
+
+    def record_tick(self, tick, game):
+        self.file.write(RECORD.pack(RECORD_TICK, tick) + TICK.pack(state_crc(game)))
+
+    def finish(self, tick, winner):
+        self.file.write(RECORD.pack(RECORD_END, tick) + END.pack(winner or 0))
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class Recording:
+    def __init__(self, tick_time, width, height, player_ids, records, arena_players=0,
+                 spatial_hash=False, spawn_seed=0):
+        self.tick_time = tick_time
+        self.width = width
+        self.height = height
+        self.player_ids = player_ids
+        self.arena_players = arena_players
+        self.spatial_hash = spatial_hash
+        self.spawn_seed = spawn_seed
+        # (type, tick, values) in file order
+        self.records = records
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as replay_file:
+            data = replay_file.read()
+
+        magic, version = struct.unpack_from('<4sH', data)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError("{} is not a version 1 to {} replay".format(path, VERSION))
+        if version == 1:
+            _, _, tick_time, width, height, count = HEADER_V1.unpack_from(data)
+            arena_players, spatial_hash, spawn_seed = 0, False, 0
+            offset = HEADER_V1.size
+        else:
+            (
+                _, _, tick_time, width, height, count, arena_players, spatial_hash, spawn_seed
+            ) = HEADER.unpack_from(data)
+            offset = HEADER.size
+        player_ids = []
+        for _ in range(count):
+            length = data[offset]
+            player_ids.append(data[offset + 1:offset + 1 + length].decode('utf-8'))
+            offset += 1 + length
+
+        payloads = {
+            RECORD_INPUT: INPUT if version > 1 else INPUT_V1, RECORD_SPELL: SPELL, RECORD_TICK: TICK,
+            RECORD_END: END
+        }
+        records = []
+        while offset + RECORD.size <= len(data):
+            record_type, tick = RECORD.unpack_from(data, offset)
+            payload = payloads[record_type]
+            if offset + RECORD.size + payload.size > len(data):
+                # Cut short by a crash, the prefix is still usable
+                break
+            records.append((record_type, tick, payload.unpack_from(data, offset + RECORD.size)))
+            offset += RECORD.size + payload.size
+        return cls(
+            tick_time, width, height, player_ids, records, arena_players, bool(spatial_hash),
+            spawn_seed
+        )
+
+    # The arena is rebuilt at the recorded size, its spawn points then only depend on the seed
+    def new_game(self):
+        if self.arena_players:
+            arena = Arena(
+                self.arena_players, width=self.width, height=self.height,
+                spatial_hash=self.spatial_hash
+            )
+            game = Game(tick_time=self.tick_time, arena=arena, spawn_seed=self.spawn_seed)
+        else:
+            game = Game(width=self.width, height=self.height, tick_time=self.tick_time)
+        for index, id in enumerate(self.player_ids):
+            if id:
+                game.add_player(id, index)
+        game.start()
+        return game
+
+    # Simulates the match again, yielding (tick, game, crc matches) after every recorded tick. The
+    # crc check is None when nothing was recorded for the tick.
+    def simulate(self, check=True):
+        game = self.new_game()
+        # Inputs are recorded with the tick the game was at and apply from the next one. When the
+        # game advances off the event loop (see TickScheduler) an input can be written before the
+        # record of the tick it arrived during, so inputs wait for their tick instead of going by
+        # file order.
+        pending = []
+        for record_type, tick, values in self.records:
+            if record_type in (RECORD_INPUT, RECORD_SPELL):
+                pending.append((record_type, tick, values))
+            elif record_type == RECORD_TICK:
+                ready = [record for record in pending if record[1] < tick]
+                pending = [record for record in pending if record[1] >= tick]
+                for input_type, _, input_values in ready:
+                    self.apply(game, input_type, input_values)
+                game.advance()
+                matches = state_crc(game) == values[0] if check else None
+                yield tick, game, matches
+            elif record_type == RECORD_END:
+                break
+
+    def apply(self, game, record_type, values):
+        if record_type == RECORD_INPUT:
+            index, bit, pressed = values
+            game.input(self.player_ids[index], KEY_NAMES[bit], "pressed" if pressed else "released")
+        else:
+            game.god_input(game.god.id, values[0])
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-simulate a recorded match')
+    parser.add_argument('path')
+    parser.add_argument('--dump', action='store_true', help='print tick() data of every tick as json')
+    parser.add_argument('--repeat', type=int, default=1, help='simulate the match this many times')
+    args = parser.parse_args()
+
+    recording = Recording.load(args.path)
+    game = None
+    ticks = 0
+    mismatches = 0
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for tick, game, matches in recording.simulate():
+            ticks += 1
+            if matches is False:
+                if mismatches == 0:
+                    print('State diverged from the recording at tick {}'.format(tick), file=sys.stderr)
+                mismatches += 1
+            if args.dump:
+                print(json.dumps({'tick': tick, 'data': game.tick_data()}, sort_keys=True))
+    elapsed = time.perf_counter() - start
+
+    print(
+        'players: {}, ticks: {}, mismatched ticks: {}, {:.0f} ticks/s, winner: {}'.format(
+            len(recording.player_ids), ticks, mismatches, ticks / elapsed if elapsed else 0,
+            game.winner
+        ),
+        file=sys.stderr
+    )
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
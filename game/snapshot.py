@@ -0,0 +1,127 @@
+from . import Game, God, GodAction, Player
+from .arena import Arena
+
+# Game snapshots:
+#   - A snapshot is a plain dict of json types holding everything a game needs to go on ticking:
+#     board and arena settings, the character slots, every body's position, velocity and
+#     rotation with its collision type and held keys, zombies in the order they turned, the god's
+#     spells with their timers, and the time left
+#   - Restoring builds a new game and space from it. Contacts cached by the physics solver are not
+#     kept, so a restored game goes on close to, but not bit for bit like, the original. A game
+#     being recorded for replays is not recorded any further once restored.
+#   - Events not yet consumed by pop_events are not kept, snapshots are taken between ticks
+
+SNAPSHOT_VERSION = 1
+
+def snapshot_game(game):
+    arena = game.arena
+    return {
+        'version': SNAPSHOT_VERSION,
+        'width': game.width,
+        'height': game.height,
+        'tick_time': game.tick_time,
+        'max_players': game.max_players,
+        'min_players': game.min_players,
+        'arena': {
+            'max_players': arena.max_players,
+            'spatial_hash': arena.spatial_hash,
+        } if arena is not None else None,
+        'spawn_seed': game.spawn_seed,
+        'started': game.started,
+        'ended': game.ended,
+        'winner': game.winner,
+        'time_left': game.time_left,
+        'tick_count': game.tick_count,
+        'player_count': game.player_count,
+        'slots': list(game.slots),
+        # Moving players in slot order
+        'players': [
+            {
+                'id': player.id,
+                'index': player.index,
+                'position': list(player.body.position),
+                'velocity': list(player.body.velocity),
+                'angle': player.body.angle,
+                'angular_velocity': player.body.angular_velocity,
+                'zombie': player.is_zombie(),
+                'dirs': int(game.input_dirs[player.slot]),
+                'pending_dirs': int(game.pending_dirs[player.slot]),
+            }
+            for player in game.moving_players
+        ],
+        'zombies': list(game.zombies),
+        'pending_spells': list(game.pending_spells),
+        'god': snapshot_god(game.god) if game.god is not None else None,
+    }
+
+def snapshot_god(god):
+    return {
+        'id': god.id,
+        'possible': snapshot_actions(god.possible_actions),
+        'current': snapshot_actions(god.current_actions),
+        'cooldown': snapshot_actions(god.cooldown_actions),
+    }
+
+def snapshot_actions(actions):
+    return [
+        [action.id, action.full_duration, action.full_cooldown, action.duration, action.cooldown]
+        for action in actions.values()
+    ]
+
+def restore_game(data, space_pool=None):
+    if data['version'] != SNAPSHOT_VERSION:
+        raise ValueError("Unknown game snapshot version {}".format(data['version']))
+
+    arena = None
+    if data['arena'] is not None:
+        arena = Arena(
+            data['arena']['max_players'], width=data['width'], height=data['height'],
+            spatial_hash=data['arena']['spatial_hash']
+        )
+    game = Game(
+        max_players=data['max_players'], min_players=data['min_players'], width=data['width'],
+        height=data['height'], tick_time=data['tick_time'], space_pool=space_pool, arena=arena,
+        spawn_seed=data['spawn_seed']
+    )
+    game.started = data['started']
+    game.ended = data['ended']
+    game.winner = data['winner']
+    game.time_left = data['time_left']
+    game.tick_count = data['tick_count']
+    game.player_count = data['player_count']
+    # Snapshots taken before slots could be freed hold the ids in join order, which were the slots
+    game.slots = list(data['slots'] if 'slots' in data else data['join_order'])
+
+    for state in data['players']:
+        player = Player(
+            state['id'], game.space, tuple(state['position']), game, isZombie=state['zombie'],
+            index=state['index']
+        )
+        player.body.velocity = tuple(state['velocity'])
+        player.body.angle = state['angle']
+        player.body.angular_velocity = state['angular_velocity']
+        game.add_moving_player(player)
+        game.input_dirs[player.slot] = state['dirs']
+        game.pending_dirs[player.slot] = state['pending_dirs']
+    # The most recently infected zombie is the one cured first
+    game.zombies = {id: game.players[id] for id in data['zombies']}
+    game.pending_spells = list(data['pending_spells'])
+
+    if data['god'] is not None:
+        game.god = restore_god(data['god'])
+    return game
+
+def restore_god(data):
+    god = God(data['id'])
+    god.possible_actions = restore_actions(data['possible'])
+    god.current_actions = restore_actions(data['current'])
+    god.cooldown_actions = restore_actions(data['cooldown'])
+    return god
+
+def restore_actions(actions):
+    restored = {}
+    for code, full_duration, full_cooldown, duration, cooldown in actions:
+        action = restored[code] = GodAction(code, full_duration, full_cooldown)
+        action.duration = duration
+        action.cooldown = cooldown
+    return restored
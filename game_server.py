@@ -0,0 +1,1075 @@
+from os import getenv
+from pathlib import Path
+import logging
+import os
+import random
+import secrets
+import signal
+import time
+from collections import Counter
+import pymunk
+from game import Game, God, Player
+from game.arena import Arena
+from game.pool import SpacePool
+from game.replay import Recorder
+from game.snapshot import restore_game
+from checkpoint import encode_checkpoint, write_checkpoint, read_checkpoint
+from timer import TickScheduler, PeriodicTimer, start_timer, start_timer_async, OVERRUN_CATCH_UP
+from rooms import RoomRegistry
+from packets import TickEncoder, ENCODING_JSON, ENCODING_BINARY, ENCODINGS
+from sharding import HashRing, shard_from_env
+from sessions import RoomSession, PlayerSession, ViewerSession
+from ratelimit import TokenBucket
+from broadcast import Broadcaster, TickBatch, tick_room
+from profiler import SamplingProfiler
+from metrics import Registry, labelled
+from time import perf_counter, monotonic, strftime
+from relay import (
+    RelayPublisher, room_info, MESSAGE_ROOM_INFO, MESSAGE_ROOM_CLOSED, MESSAGE_GAME_STARTING,
+    MESSAGE_GAME_OVER, MESSAGE_TICK_JSON, MESSAGE_TICK_BINARY
+)
+
+# Game server logic, shared by the eventlet server (server.py) and the asyncio one (aio_server.py).
+# Handlers and ticks never block, the backend provides sleeping, background tasks and namespaces.
+
+MIN_PLAYERS_PER_ROOM = 3
+MAX_PLAYERS_PER_ROOM = 10
+
+PLAYER_NS_ENDPOINT = '/player'
+HOST_NS_ENDPOINT = '/host'
+VIEWER_NS_ENDPOINT = '/viewer'
+
+# create logger with '__name__'
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Period at which game ticks are sent to clients, physics always steps at Game.INTERNAL_TICK_TIME
+NETWORK_TICK_TIME = float(getenv("ZOMBEANS_NETWORK_TICK_TIME", default=Game.EXTERNAL_TICK_TIME))
+# Sustained make_move messages per second and burst size allowed for each player connection
+INPUT_RATE = float(getenv("ZOMBEANS_INPUT_RATE", default=60))
+INPUT_BURST = float(getenv("ZOMBEANS_INPUT_BURST", default=30))
+# Address viewer streams are published on for relay processes (relay_server.py), and the public
+# urls of those relays viewers are sent to
+RELAY_LISTEN = getenv("ZOMBEANS_RELAY_LISTEN")
+RELAY_URLS = [url for url in getenv("ZOMBEANS_RELAY_URLS", default='').split(',') if url]
+# What the tick loop does after falling behind, see timer.py, and how many missed ticks it catches
+# up on in a row
+TICK_OVERRUN_POLICY = getenv("ZOMBEANS_TICK_OVERRUN_POLICY", default=OVERRUN_CATCH_UP)
+TICK_MAX_CATCH_UP = int(getenv("ZOMBEANS_TICK_MAX_CATCH_UP", default=3))
+# Seconds a lobby may wait for its game to start and a finished room may stay open before their host
+# is disconnected, how often rooms are checked for it, and how many idle physics spaces are kept
+LOBBY_TTL = float(getenv("ZOMBEANS_LOBBY_TTL", default=1800))
+FINISHED_ROOM_TTL = float(getenv("ZOMBEANS_FINISHED_ROOM_TTL", default=300))
+ROOM_SWEEP_INTERVAL = float(getenv("ZOMBEANS_ROOM_SWEEP_INTERVAL", default=30))
+SPACE_POOL_SIZE = int(getenv("ZOMBEANS_SPACE_POOL_SIZE", default=64))
+# Packets waiting to be written to a client before its ticks are skipped, and seconds of skipped
+# ticks after which it is disconnected
+MAX_SEND_QUEUE = int(getenv("ZOMBEANS_MAX_SEND_QUEUE", default=16))
+SLOW_CLIENT_TIMEOUT = float(getenv("ZOMBEANS_SLOW_CLIENT_TIMEOUT", default=10))
+# Directory every game is recorded to for replays (python -m game.replay), not recorded when unset
+REPLAY_DIR = getenv("ZOMBEANS_REPLAY_DIR")
+# Players per room in large arena mode (game/arena.py), rooms keep the default board when 0, and
+# whether arena spaces use the spatial hash
+ARENA_PLAYERS = int(getenv("ZOMBEANS_ARENA_PLAYERS", default=0))
+ARENA_SPATIAL_HASH = getenv("ZOMBEANS_ARENA_SPATIAL_HASH", default='0') == '1'
+ARENA = Arena(ARENA_PLAYERS, spatial_hash=ARENA_SPATIAL_HASH) if ARENA_PLAYERS else None
+ROOM_MAX_PLAYERS = ARENA.max_players if ARENA is not None else MAX_PLAYERS_PER_ROOM
+# File open rooms are checkpointed to (checkpoint.py) every ZOMBEANS_CHECKPOINT_INTERVAL seconds and
+# on shutdown, and restored from on start unless older than ZOMBEANS_CHECKPOINT_MAX_AGE seconds.
+# Restored rooms whose host does not come back within ZOMBEANS_RESUME_TIMEOUT seconds are closed.
+CHECKPOINT_PATH = getenv("ZOMBEANS_CHECKPOINT_PATH") or None
+CHECKPOINT_INTERVAL = float(getenv("ZOMBEANS_CHECKPOINT_INTERVAL", default=5))
+CHECKPOINT_MAX_AGE = float(getenv("ZOMBEANS_CHECKPOINT_MAX_AGE", default=300))
+RESUME_TIMEOUT = float(getenv("ZOMBEANS_RESUME_TIMEOUT", default=60))
+# Bearer token for the admin endpoints (/admin/profile), which are off when unset
+ADMIN_TOKEN = getenv("ZOMBEANS_ADMIN_TOKEN") or None
+
+# Game States
+GAME_STATE_LOBBY_WAITING = 1
+GAME_STATE_RUNNING = 2
+GAME_STATE_FINISHED = 3
+GAME_STATE_NAMES = {
+    GAME_STATE_LOBBY_WAITING: 'lobby_waiting',
+    GAME_STATE_RUNNING: 'running',
+    GAME_STATE_FINISHED: 'finished',
+}
+
+# Player States
+PLAYER_STATE_NOTHING = 1
+PLAYER_STATE_WAITING_GAME_START = 2
+PLAYER_STATE_IN_GAME = 3
+
+# Viewer tick encodings
+VIEWER_ENCODING_JSON = ENCODING_JSON
+VIEWER_ENCODING_BINARY = ENCODING_BINARY
+VIEWER_ENCODINGS = ENCODINGS
+
+# Types of clients:
+#   - Player: is served controls and joins a room and plays a game
+#   - Host: is allowed to control a game starting, is required for a game to exist
+#   - Viewer: is served render events
+
+class Server:
+    def __init__(
+        self, host_namespace_class, viewer_namespace_class, player_namespace_class, shard=None
+    ):
+        self.host_namespace_class = host_namespace_class
+        self.viewer_namespace_class = viewer_namespace_class
+        self.player_namespace_class = player_namespace_class
+
+        # Map player connection ids to their PlayerSession
+        self.players = {}
+        # Map game connection id to the RoomSession it hosts
+        self.hosts = {}
+        # Map viewer connection id to their ViewerSession
+        self.viewers = {}
+        # make_move messages over the lifetime of the server, by outcome
+        self.input_counts = Counter()
+        # Worker this server runs as in a sharded deployment, a lone worker owns every room
+        self.shard = shard if shard is not None else shard_from_env(getenv)
+        # Map room codes to the host connection id owning the room
+        self.rooms = RoomRegistry(owns=self.shard.owns)
+        # Relays serving the viewers of a room, chosen by room code so a room's viewers share one
+        self.relay_urls = list(RELAY_URLS)
+        self.relay_ring = HashRing(self.relay_urls) if self.relay_urls else None
+        self.relay = None
+        # Physics spaces of finished games, reused by the next ones
+        self.space_pool = SpacePool(SPACE_POOL_SIZE)
+        self.evicted_rooms = Counter()
+        # Map game to the (ended, winner) of the advance run for it in the simulation executor
+        self.advanced_games = {}
+        # Rooms restored from a checkpoint until their host resumes them, as a map of the host
+        # connection id they were saved with to the monotonic time they are closed at, and the
+        # restored players not back yet by resume token
+        self.resuming_rooms = {}
+        self.resuming_players = {}
+        self.checkpoint_timer = None
+        self.checkpoint_writing = False
+        self.offload = None
+        self.shut_down = False
+        self.profiler = None
+        self.register_metrics()
+
+    def register_metrics(self):
+        self.metrics = Registry()
+        self.metrics.gauge(
+            'zombeans_rooms', 'Rooms by game state', ('game_state', ), function=self.count_rooms
+        )
+        self.metrics.gauge(
+            'zombeans_connections', 'Connected clients by namespace', ('namespace', ),
+            function=lambda: {
+                (PLAYER_NS_ENDPOINT, ): len(self.players),
+                (HOST_NS_ENDPOINT, ): len(self.hosts),
+                (VIEWER_NS_ENDPOINT, ): len(self.viewers),
+            }
+        )
+        self.game_tick_seconds = self.metrics.histogram(
+            'zombeans_game_tick_seconds', 'Time spent simulating one network tick of a room'
+        )
+        self.tick_loop_seconds = self.metrics.histogram(
+            'zombeans_tick_loop_seconds', 'Time spent ticking every running room once'
+        )
+        self.timer_lateness_seconds = self.metrics.histogram(
+            'zombeans_timer_lateness_seconds', 'Delay between a tick being due and it starting'
+        )
+        self.handler_latency = self.metrics.histogram(
+            'zombeans_handler_seconds', 'Time spent in a socket event handler',
+            ('namespace', 'event')
+        )
+        self.metrics.counter(
+            'zombeans_tick_overruns_total', 'Ticks that took longer than their period',
+            function=lambda: self.scheduler.overruns
+        )
+        self.metrics.counter(
+            'zombeans_missed_ticks_total', 'Ticks started after the next one was due, by resolution',
+            ('resolution', ),
+            function=lambda: {
+                ('caught_up', ): self.scheduler.timer_stats.caught_up,
+                ('skipped', ): self.scheduler.timer_stats.skipped,
+                ('stretched', ): self.scheduler.timer_stats.stretched,
+            }
+        )
+        self.metrics.counter(
+            'zombeans_inputs_total', 'make_move messages by outcome', ('outcome', ),
+            function=lambda: labelled(self.input_counts)
+        )
+        for name, help, attribute in (
+            ('zombeans_sent_packets_total', 'Packets sent by namespace', 'sends'),
+            ('zombeans_sent_bytes_total', 'Bytes sent by namespace', 'bytes_sent'),
+            ('zombeans_encoded_packets_total', 'Packets encoded by namespace', 'encodes'),
+            ('zombeans_dropped_packets_total', 'Ticks skipped for slow clients', 'dropped'),
+            ('zombeans_slow_disconnects_total', 'Clients disconnected for falling behind',
+             'disconnected'),
+        ):
+            self.metrics.counter(
+                name, help, ('namespace', ),
+                function=lambda attribute=attribute: labelled(getattr(self.broadcaster, attribute))
+            )
+        self.metrics.counter(
+            'zombeans_evicted_rooms_total', 'Rooms closed for staying idle, by game state',
+            ('game_state', ), function=lambda: labelled(self.evicted_rooms)
+        )
+        self.metrics.gauge(
+            'zombeans_space_pool_size', 'Idle physics spaces kept for reuse',
+            function=lambda: len(self.space_pool)
+        )
+        self.metrics.counter(
+            'zombeans_spaces_total', 'Physics spaces handed to games, by origin', ('origin', ),
+            function=lambda: {
+                ('created', ): self.space_pool.created,
+                ('reused', ): self.space_pool.reused,
+            }
+        )
+        self.checkpoint_seconds = self.metrics.histogram(
+            'zombeans_checkpoint_seconds', 'Time spent writing a checkpoint of every open room'
+        )
+        self.metrics.gauge(
+            'zombeans_resuming_rooms', 'Restored rooms whose host has not resumed them yet',
+            function=lambda: len(self.resuming_rooms)
+        )
+        self.metrics.gauge(
+            'zombeans_send_queue_depth_max', 'Deepest client send queue seen by namespace',
+            ('namespace', ), function=lambda: labelled(self.broadcaster.queue_depth_max)
+        )
+
+    # Phases of a tick the profiler attributes samples to, see profiler.py
+    def create_profiler(self, broadcaster_class):
+        phases = {
+            Server.tick_game: 'tick',
+            Server.advance_games: 'tick',
+            self.host_namespace_class.trigger_event: 'handler',
+            pymunk.Space.step: 'physics',
+            Game.move_players: 'physics',
+            God.tick: 'god',
+            Game.cure_player: 'god',
+            Game.cast_spell: 'god',
+            Game.pop_events: 'payload',
+            Game.god_spells: 'payload',
+            Game.tick_data: 'payload',
+            TickEncoder.encode: 'payload',
+        }
+        for function in (
+            broadcaster_class.emit, broadcaster_class.send, broadcaster_class.write,
+            getattr(broadcaster_class, 'write_pending', None), TickBatch.broadcast, TickBatch.send,
+            TickBatch.flush
+        ):
+            if function is not None:
+                phases[function] = 'broadcast'
+        return SamplingProfiler(
+            phases=phases, rooms={Server.tick_game: 'room', Server.advance_games: 'room'}
+        )
+
+    # Checks the Authorization header of an admin request
+    def is_admin(self, authorization):
+        if ADMIN_TOKEN is None or not authorization:
+            return False
+        scheme, _, token = authorization.partition(' ')
+        return scheme.lower() == 'bearer' and secrets.compare_digest(token.strip(), ADMIN_TOKEN)
+
+    def count_rooms(self):
+        counts = {(name, ): 0 for name in GAME_STATE_NAMES.values()}
+        for room in self.hosts.values():
+            counts[(GAME_STATE_NAMES[room.game_state], )] += 1
+        return counts
+
+    # socket_io is Flask-SocketIO, or aio.AsyncSocketIO with asynchronous set. An asynchronous
+    # server can simulate in an executor, see advance_games. offload(function, args, done) runs
+    # blocking file work in a worker thread and calls done(result, error) back on the event loop,
+    # without it checkpoints are written in place.
+    def register(
+        self, socket_io, broadcaster_class=Broadcaster, asynchronous=False, executor=None,
+        offload=None
+    ):
+        self.socket_io = socket_io
+        self.offload = offload
+        self.scheduler = TickScheduler(
+            NETWORK_TICK_TIME, self.socket_io.sleep, self.socket_io.start_background_task,
+            on_late=self.timer_lateness_seconds.observe, on_tick=self.tick_loop_seconds.observe,
+            overrun_policy=TICK_OVERRUN_POLICY, max_catch_up=TICK_MAX_CATCH_UP,
+            asynchronous=asynchronous, executor=executor, prepare=self.advance_games
+        )
+        self.profiler = self.create_profiler(broadcaster_class)
+        self.broadcaster = broadcaster_class(
+            self.socket_io,
+            max_queue=MAX_SEND_QUEUE,
+            max_behind=max(1, int(SLOW_CLIENT_TIMEOUT / NETWORK_TICK_TIME))
+        )
+        if RELAY_LISTEN and asynchronous:
+            raise ValueError("Publishing to relays is only supported on eventlet")
+        if RELAY_LISTEN:
+            self.relay = RelayPublisher(
+                RELAY_LISTEN, self.socket_io.start_background_task, self.relay_snapshot
+            )
+            self.relay.start()
+
+        self.host_namespace = self.host_namespace_class(HOST_NS_ENDPOINT, parent=self)
+        self.viewer_namespace = self.viewer_namespace_class(VIEWER_NS_ENDPOINT, parent=self)
+        self.player_namespace = self.player_namespace_class(PLAYER_NS_ENDPOINT, parent=self)
+
+        self.socket_io.on_namespace(self.host_namespace)
+        self.socket_io.on_namespace(self.viewer_namespace)
+        self.socket_io.on_namespace(self.player_namespace)
+
+        sweep_timer = PeriodicTimer(ROOM_SWEEP_INTERVAL, self.socket_io.sleep, self.sweep_rooms)
+        self.socket_io.start_background_task(
+            start_timer_async if asynchronous else start_timer, sweep_timer
+        )
+
+        if CHECKPOINT_PATH is not None:
+            self.restore_checkpoint()
+            self.checkpoint_timer = PeriodicTimer(
+                CHECKPOINT_INTERVAL, self.socket_io.sleep, self.checkpoint_rooms
+            )
+            self.socket_io.start_background_task(
+                start_timer_async if asynchronous else start_timer, self.checkpoint_timer
+            )
+
+    def register_host_connect(self, host_id):
+        logger.info("New host connected (id: {})".format(host_id))
+        room_code = self.rooms.allocate(host_id)
+
+        # The game is only created once the first player joins
+        room = self.hosts[host_id] = RoomSession(
+            host_id, room_code, GAME_STATE_LOBBY_WAITING, None, TickEncoder(), VIEWER_ENCODINGS,
+            board_description={
+                'width': ARENA.width if ARENA is not None else Game.WIDTH,
+                'height': ARENA.height if ARENA is not None else Game.HEIGHT,
+                'player_radius': Player.RADIUS,
+            },
+            resume_token=secrets.token_urlsafe(16)
+        )
+
+        self.publish_room_info(room)
+        self.host_namespace.send_room_code(host_id, room_code, room.resume_token)
+
+    def register_host_disconnect(self, host_id):
+        room = self.hosts.get(host_id)
+        if room is None:
+            # Already closed by sweep_rooms, the asyncio server disconnects hosts after it
+            return
+        game_state = room.game_state
+        room_code = room.room_code
+
+        if (game_state == GAME_STATE_LOBBY_WAITING) or (game_state == GAME_STATE_RUNNING):
+            # Sent while everyone is still in the room
+            self.player_namespace.broadcast_game_over(room_code, self.lookup_winner_name(None))
+            self.viewer_namespace.broadcast_game_over(room_code, self.lookup_winner_name(None))
+            self.publish(room, MESSAGE_ROOM_CLOSED, {'winner': self.lookup_winner_name(None)})
+            logger.warning(
+                "Host disconnected while attending to game (id: {}, room: {})".format(
+                    host_id, room_code
+                )
+            )
+        else:
+            self.publish(room, MESSAGE_ROOM_CLOSED, {'winner': None})
+            logger.info("Host disconnected (id: {}, state: {})".format(host_id, game_state))
+
+        # The code is handed out again once released, nobody may be left in its rooms by then
+        for player in room.players:
+            player.room = None
+            player.game = None
+            player.state = PLAYER_STATE_NOTHING
+
+            self.leave_room(room_code, player.player_id, PLAYER_NS_ENDPOINT)
+
+        for viewer in room.viewers:
+            viewer.room = None
+
+            self.leave_room(room_code, viewer.viewer_id, VIEWER_NS_ENDPOINT)
+            self.leave_room(
+                self.tick_room(room_code, viewer.encoding), viewer.viewer_id, VIEWER_NS_ENDPOINT
+            )
+
+        self.rooms.release(room_code)
+        self.scheduler.remove(host_id)
+        self.release_game(room)
+        self.resuming_rooms.pop(host_id, None)
+        for player in room.players:
+            self.resuming_players.pop(player.resume_token, None)
+        del self.hosts[host_id]
+
+    def register_viewer_connect(self, viewer_id):
+        logger.info("New viewer connected (id: {})".format(viewer_id))
+
+        self.viewers[viewer_id] = ViewerSession(viewer_id, VIEWER_ENCODING_JSON)
+
+    def register_viewer_disconnect(self, viewer_id):
+        viewer = self.viewers[viewer_id]
+        room = viewer.room
+        if room is not None:
+            room.viewers.remove(viewer)
+            room.viewer_encodings[viewer.encoding] -= 1
+
+            self.leave_room(room.room_code, viewer_id, VIEWER_NS_ENDPOINT)
+            self.leave_room(
+                self.tick_room(room.room_code, viewer.encoding), viewer_id, VIEWER_NS_ENDPOINT
+            )
+            logger.info(
+                "New viewer disconnected and left room (id: {}, room: {})".format(
+                    viewer_id, room.room_code
+                )
+            )
+        else:
+            logger.info("Viewer disconnected (id: {})".format(viewer_id))
+        self.broadcaster.forget(viewer_id)
+        del self.viewers[viewer_id]
+
+    def register_player_connect(self, player_id):
+        logger.info("New player connected (id: {})".format(player_id))
+
+        self.players[player_id] = PlayerSession(
+            player_id, PLAYER_STATE_NOTHING, TokenBucket(INPUT_RATE, INPUT_BURST)
+        )
+
+    def register_player_disconnect(self, player_id):
+        player = self.players[player_id]
+        player_state = player.state
+        room = player.room
+
+        if (player_state == PLAYER_STATE_WAITING_GAME_START) or (
+                player_state == PLAYER_STATE_IN_GAME):
+            room.remove_player(player)
+            # Frees the player's character slot for the next one to join
+            if room.game is not None and not room.game.started:
+                room.game.remove_player(player_id)
+            self.publish_room_info(room)
+            self.leave_room(room.room_code, player_id, PLAYER_NS_ENDPOINT)
+
+            logger.warning(
+                "Player disconnected while game was running (id: {}, game: {})".format(
+                    player_id, room.host_id
+                )
+            )
+        else:
+            logger.info("Player disconnected (id: {}, state: {})".format(player_id, player_state))
+
+        if player.input_limit.dropped:
+            logger.info(
+                "Player exceeded the input rate limit (id: {}, dropped: {})".format(
+                    player_id, player.input_limit.dropped
+                )
+            )
+        self.broadcaster.forget(player_id)
+        del self.players[player_id]
+
+    def register_request_game_view(self, viewer_id, room_code, encoding=VIEWER_ENCODING_JSON):
+        if not self.shard.owns(room_code):
+            self.viewer_namespace.send_game_view_response(
+                viewer_id, 'redirect', self.redirect_data(room_code)
+            )
+            return
+        if self.relay_ring is not None:
+            self.viewer_namespace.send_game_view_response(
+                viewer_id, 'redirect', {
+                    'room_code': room_code,
+                    'worker': self.relay_ring.node_for(room_code)
+                }
+            )
+            return
+
+        host_id = self.lookup_host_by_room_code(room_code)
+        if host_id is None:
+            logger.info(
+                "Viewer attempted to view non-existent room (id: {}, room: {})".format(
+                    viewer_id, room_code
+                )
+            )
+
+            self.viewer_namespace.send_game_view_response(
+                viewer_id, 'failure', 'Room {} does not exist.'.format(room_code)
+            )
+            return
+
+        if encoding not in VIEWER_ENCODINGS:
+            logger.info(
+                "Viewer requested unknown encoding, using json (id: {}, encoding: {})".format(
+                    viewer_id, encoding
+                )
+            )
+            encoding = VIEWER_ENCODING_JSON
+
+        room = self.hosts[host_id]
+        viewer = self.viewers[viewer_id]
+        viewer.room = room
+        viewer.encoding = encoding
+        room.viewers.append(viewer)
+        room.viewer_encodings[encoding] += 1
+
+        self.join_room(room_code, viewer_id, VIEWER_NS_ENDPOINT)
+        self.join_room(self.tick_room(room_code, encoding), viewer_id, VIEWER_NS_ENDPOINT)
+        # The new viewer cannot decode deltas until it has seen a keyframe
+        room.tick_encoder.request_keyframe()
+
+        _, viewer_roster = room.rosters()
+        aux_data = {
+            'current_players': viewer_roster,
+            'board_description': room.board_description
+        }
+        self.viewer_namespace.send_game_view_response(viewer_id, 'success', aux_data)
+
+        logger.info("Viewer joined room (id: {}, room: {})".format(viewer_id, room_code))
+
+    def register_player_join_request(self, player_id, room_code, user_name, batch=False):
+        player = self.players[player_id]
+        if not self.shard.owns(room_code):
+            self.player_namespace.send_player_join_response(
+                player_id, 'redirect', self.redirect_data(room_code)
+            )
+            return
+
+        host_id = self.lookup_host_by_room_code(room_code)
+
+        if host_id is None:
+            logger.info(
+                "Player attempted to access non-existent room (id: {}, room: {})".format(
+                    player_id, room_code
+                )
+            )
+
+            self.player_namespace.send_player_join_response(
+                player_id, 'failure', 'Room {} does not exist'.format(room_code)
+            )
+            return
+
+        room = self.hosts[host_id]
+        if room.game_state != GAME_STATE_LOBBY_WAITING:
+            logger.info(
+                "Player attempted to join a game that was not in the lobby state (id: {}, room: {})"
+                .format(player_id, room_code)
+            )
+
+            self.player_namespace.send_player_join_response(
+                player_id, 'failure', 'Room {} is not in open state'.format(room_code)
+            )
+            return
+
+        if len(room.players) >= ROOM_MAX_PLAYERS:
+            logger.info(
+                "Player attempted to join a room that was full (id: {}, room: {})".format(
+                    player_id, room_code
+                )
+            )
+
+            self.player_namespace.send_player_join_response(
+                player_id, 'failure', 'Room {} is full'.format(room_code)
+            )
+            return
+
+        player.state = PLAYER_STATE_WAITING_GAME_START
+        player.room = room
+        player.user_name = user_name
+        player.resume_token = secrets.token_urlsafe(16)
+
+        if room.game is None:
+            # A reused space does not step bit for bit like the fresh one a replay starts from
+            room.game = Game(
+                tick_time=NETWORK_TICK_TIME,
+                space_pool=self.space_pool if REPLAY_DIR is None else None,
+                arena=ARENA,
+                spawn_seed=random.getrandbits(32)
+            )
+        player.game = room.game
+        # The game hands out the lowest free slot, which binary ticks index players by
+        character = player.character = room.game.add_player(player_id)
+
+        room.add_player(player)
+        self.publish_room_info(room)
+        if batch:
+            self.broadcaster.batching.add(player_id)
+
+        self.join_room(room_code, player_id, PLAYER_NS_ENDPOINT)
+
+        lobby_roster, _ = room.rosters()
+        self.host_namespace.send_player_joined(host_id, lobby_roster, user_name)
+        self.player_namespace.send_player_join_response(
+            player_id, 'success', {
+                'room_code': room_code,
+                'character': character,
+                'is_god': "true" if character == 1 else "false",
+                'resume_token': player.resume_token
+            }
+        )
+        logger.info(
+            'Player joined room (id: {}, room: {}, user_name: {}, character: {})'.format(
+                player_id, room_code, user_name, character
+            )
+        )
+
+    # A host reconnecting after a restart takes back the room restored from a checkpoint, giving up
+    # the one allocated when it connected
+    def register_host_resume_request(self, host_id, room_code, resume_token):
+        old_host_id = self.rooms.lookup(room_code)
+        room = self.hosts.get(old_host_id) if old_host_id in self.resuming_rooms else None
+        if room is None or not secrets.compare_digest(room.resume_token, str(resume_token)):
+            logger.info(
+                "Host attempted to resume a room it cannot (id: {}, room: {})".format(
+                    host_id, room_code
+                )
+            )
+
+            self.host_namespace.send_resume_response(
+                host_id, 'failure', 'Room {} cannot be resumed'.format(room_code)
+            )
+            return
+
+        allocated = self.hosts.pop(host_id)
+        self.rooms.release(allocated.room_code)
+        self.publish(allocated, MESSAGE_ROOM_CLOSED, {'winner': None})
+
+        del self.resuming_rooms[old_host_id]
+        del self.hosts[old_host_id]
+        self.rooms.claim(room_code, host_id, replaces=old_host_id)
+        room.host_id = host_id
+        room.touch()
+        self.hosts[host_id] = room
+        if room.game_state == GAME_STATE_RUNNING:
+            self.scheduler.remove(old_host_id)
+            self.scheduler.add(host_id, self.tick_game, args=(room, ))
+
+        lobby_roster, _ = room.rosters()
+        self.host_namespace.send_resume_response(
+            host_id, 'success', {
+                'room_code': room_code,
+                'game_state': GAME_STATE_NAMES[room.game_state],
+                'players': lobby_roster
+            }
+        )
+        logger.info("Host resumed room (id: {}, room: {})".format(host_id, room_code))
+
+    # A player reconnecting after a restart takes back its place in a room restored from a
+    # checkpoint, with its character and body
+    def register_player_rejoin_request(self, player_id, room_code, resume_token):
+        player = self.players[player_id]
+        restored = self.resuming_players.get(str(resume_token))
+        if (
+            player.room is not None or restored is None or restored.room is None
+            or restored.room.room_code != room_code
+        ):
+            logger.info(
+                "Player attempted to rejoin a room it cannot (id: {}, room: {})".format(
+                    player_id, room_code
+                )
+            )
+
+            self.player_namespace.send_player_join_response(
+                player_id, 'failure', 'Room {} cannot be rejoined'.format(room_code)
+            )
+            return
+
+        del self.resuming_players[restored.resume_token]
+        room = restored.room
+        old_player_id = restored.player_id
+        room.rebind_player(restored, player_id)
+        if restored.game is not None:
+            # Not while the simulation executor steps the game
+            self.scheduler.call_when_idle(restored.game.rebind_player, old_player_id, player_id)
+        restored.input_limit = player.input_limit
+        self.players[player_id] = restored
+        self.publish_room_info(room)
+
+        self.join_room(room_code, player_id, PLAYER_NS_ENDPOINT)
+
+        self.player_namespace.send_player_join_response(
+            player_id, 'success', {
+                'room_code': room_code,
+                'character': restored.character,
+                'is_god': "true" if restored.character == 1 else "false",
+                'resume_token': restored.resume_token,
+                'game_state': GAME_STATE_NAMES[room.game_state]
+            }
+        )
+        logger.info(
+            'Player rejoined room (id: {}, room: {}, user_name: {}, character: {})'.format(
+                player_id, room_code, restored.user_name, restored.character
+            )
+        )
+
+    # Games are released once they end, a finished room cannot be started again
+    def register_request_start_game(self, host_id):
+        room = self.hosts[host_id]
+        room_code = room.room_code
+        if room.game_state != GAME_STATE_LOBBY_WAITING or room.game is None:
+            logger.warning(
+                "Host attempted to start a game that is not waiting in the lobby (id: {}, room: {}, "
+                "state: {})".format(host_id, room_code, GAME_STATE_NAMES[room.game_state])
+            )
+        elif len(room.players) >= MIN_PLAYERS_PER_ROOM:
+            room.game_state = GAME_STATE_RUNNING
+
+            for player in room.players:
+                player.state = PLAYER_STATE_IN_GAME
+
+            room.game.start()
+            if REPLAY_DIR is not None:
+                self.record_game(room)
+            room.touch()
+            self.viewer_namespace.broadcast_game_starting(room_code)
+            self.player_namespace.broadcast_game_starting(room_code)
+            self.publish(room, MESSAGE_GAME_STARTING, {})
+
+            self.scheduler.add(host_id, self.tick_game, args=(room, ))
+
+            logger.info("Host started game. (id: {}, room: {})".format(host_id, room_code))
+        else:
+            logger.warning(
+                "Host attempted to start game with insufficient player (id: {}, room: {}, num players: {})"
+                .format(host_id, room_code, len(room.players))
+            )
+
+    # Ticks catching up after the loop fell behind only simulate, viewers and the god get the state
+    # of the next regular tick instead of a burst of packets
+    def tick_game(self, room, catching_up=False):
+        room_code = room.room_code
+        game_obj = room.game
+
+        advanced = self.advanced_games.pop(game_obj, None)
+        if advanced is not None:
+            game_ended, winner = advanced
+        else:
+            start = perf_counter()
+            game_ended, winner = game_obj.advance()
+            self.game_tick_seconds.observe(perf_counter() - start)
+        self.broadcaster.count_tick()
+        player_batch = self.broadcaster.batch(PLAYER_NS_ENDPOINT)
+
+        for _, event, player_id in game_obj.pop_events():
+            if event == Game.EVENT_INFECTED:
+                new_state = 'zombie'
+            else:
+                new_state = 'normal'
+            self.player_namespace.send_status_change(
+                player_batch, player_id, 'zombie-change', {"new-state": new_state}
+            )
+
+        if game_ended:
+            player_batch.flush()
+            self.player_namespace.broadcast_game_over(room_code, self.lookup_winner_name(winner))
+            self.viewer_namespace.broadcast_game_over(room_code, self.lookup_winner_name(winner))
+            self.publish(room, MESSAGE_GAME_OVER, {'winner': self.lookup_winner_name(winner)})
+            room.game_state = GAME_STATE_FINISHED
+            room.touch()
+            self.release_game(room)
+            return True
+        if catching_up:
+            player_batch.flush()
+            return False
+        god_spells = game_obj.god_spells()
+        if god_spells is not None:
+            self.player_namespace.broadcast_game_tick(player_batch, room_code, god_spells)
+        player_batch.flush()
+
+        viewer_encodings = room.viewer_encodings
+        relayed = self.relay is not None and self.relay.subscribed
+        json_tick, binary_tick = room.tick_encoder.encode(
+            game_obj,
+            json=relayed or viewer_encodings[VIEWER_ENCODING_JSON] > 0,
+            binary=relayed or viewer_encodings[VIEWER_ENCODING_BINARY] > 0
+        )
+        if relayed:
+            self.publish(room, MESSAGE_TICK_JSON, json_tick)
+            self.publish(room, MESSAGE_TICK_BINARY, binary_tick)
+        viewer_batch = self.broadcaster.batch(VIEWER_NS_ENDPOINT)
+        if json_tick is not None:
+            self.viewer_namespace.broadcast_game_tick(
+                viewer_batch, self.tick_room(room_code, VIEWER_ENCODING_JSON), json_tick
+            )
+        if binary_tick is not None:
+            self.viewer_namespace.broadcast_game_tick_binary(
+                viewer_batch, self.tick_room(room_code, VIEWER_ENCODING_BINARY), binary_tick
+            )
+        viewer_batch.flush()
+        return False
+
+    # Moves are buffered in the game and applied at the start of its next tick, so a flood of
+    # messages costs at most one token bucket check each and nothing on the tick itself. Releases
+    # are not charged: keys stay held until released, so a dropped release would keep the player
+    # moving until the key is pressed and released again.
+    def register_make_move(self, player_id, origin, action):
+        player = self.players[player_id]
+        is_release = origin == 'normal' and action.get('state', 'pressed') != 'pressed'
+        if not is_release and not player.input_limit.take():
+            self.input_counts['dropped'] += 1
+            if player.input_limit.dropped == 1:
+                logger.warning(
+                    'Player exceeded the input rate limit, dropping moves (id: {})'.format(
+                        player_id
+                    )
+                )
+            return
+
+        room = player.room
+        if room is None:
+            logger.warning(
+                'Player attempted to move while not in any game (id: {})'.format(player_id)
+            )
+            self.input_counts['rejected'] += 1
+            return
+
+        if room.game_state != GAME_STATE_RUNNING:
+            logger.warning(
+                'Player attempted to move while game was not running (id: {}, room: {}, state: {})'
+                .format(player_id, room.room_code, room.game_state)
+            )
+            self.input_counts['rejected'] += 1
+            return
+        if origin == 'god':
+            accepted = player.game.god_input(player_id, action['code'])
+        elif origin == 'normal':
+            direction = action['key']
+            state = action['state']
+            accepted = player.game.input(player_id, direction, state)
+        else:
+            logger.warning(
+                'Player attempted to move from an invalid origin (either "god" or "normal") (id: {}, origin: {})'
+                .format(player_id, origin)
+            )
+            accepted = False
+        self.input_counts['accepted' if accepted else 'rejected'] += 1
+
+    def record_game(self, room):
+        path = Path(REPLAY_DIR) / '{}-{}.zbr'.format(room.room_code, strftime('%Y%m%d-%H%M%S'))
+        try:
+            Recorder(path).start(room.game)
+        except OSError as error:
+            logger.warning("Could not record game (room: {}, error: {})".format(room.room_code, error))
+            return
+        logger.info("Recording game (room: {}, path: {})".format(room.room_code, path))
+
+    # Runs in the simulation executor before every tick of an asynchronous server given one, while
+    # the event loop goes on serving connections. Only steps physics, tick_game sends the results.
+    # Games stepped here are only released once it is done, see release_game.
+    def advance_games(self, entry_args):
+        for room, in entry_args:
+            game = room.game
+            if game is None or game.ended:
+                continue
+            start = perf_counter()
+            self.advanced_games[game] = game.advance()
+            self.game_tick_seconds.observe(perf_counter() - start)
+
+    def release_game(self, room):
+        if room.game is None:
+            return
+        self.scheduler.call_when_idle(self.drop_game, room.game)
+        room.game = None
+        for player in room.players:
+            player.game = None
+
+    def drop_game(self, game):
+        self.advanced_games.pop(game, None)
+        game.release()
+
+    # Disconnects the hosts of lobbies that never started and of finished rooms left open, which
+    # closes their rooms like any host leaving, and closes restored rooms their host did not resume.
+    # Called every ROOM_SWEEP_INTERVAL.
+    def sweep_rooms(self):
+        now = monotonic()
+        for host_id, room in list(self.hosts.items()):
+            resume_deadline = self.resuming_rooms.get(host_id)
+            if resume_deadline is not None:
+                if now >= resume_deadline:
+                    logger.info(
+                        "Closing restored room that was not resumed (id: {}, room: {})".format(
+                            host_id, room.room_code
+                        )
+                    )
+                    self.register_host_disconnect(host_id)
+                continue
+
+            if room.game_state == GAME_STATE_LOBBY_WAITING:
+                ttl = LOBBY_TTL
+            elif room.game_state == GAME_STATE_FINISHED:
+                ttl = FINISHED_ROOM_TTL
+            else:
+                continue
+            if now - room.updated_at < ttl:
+                continue
+
+            logger.info(
+                "Evicting idle room (id: {}, room: {}, state: {})".format(
+                    host_id, room.room_code, GAME_STATE_NAMES[room.game_state]
+                )
+            )
+            self.evicted_rooms[GAME_STATE_NAMES[room.game_state]] += 1
+            self.broadcaster.close(HOST_NS_ENDPOINT, host_id)
+            # The host may already have been gone from the socket layer
+            if host_id in self.hosts:
+                self.register_host_disconnect(host_id)
+
+    # Called every CHECKPOINT_INTERVAL, games stepped in the simulation executor are only read once
+    # it is done
+    def checkpoint_rooms(self):
+        self.scheduler.call_when_idle(self.save_checkpoint)
+
+    # The rooms are encoded here, the file is written by offload unless blocking. A checkpoint
+    # still being written when the next one is due makes that one skip.
+    def save_checkpoint(self, blocking=False):
+        if self.shut_down:
+            return
+        if self.checkpoint_writing and not blocking:
+            logger.warning(
+                "Skipping checkpoint, the last one is still being written (path: {})".format(
+                    CHECKPOINT_PATH
+                )
+            )
+            return
+        start = perf_counter()
+        rooms = [room for room in self.hosts.values() if room.game_state != GAME_STATE_FINISHED]
+        encoded = encode_checkpoint(rooms)
+
+        def done(size, error):
+            self.checkpoint_writing = False
+            self.checkpoint_written(len(rooms), start, size, error)
+
+        if blocking or self.offload is None:
+            # Not the temporary file of a write that may still be running in the background
+            try:
+                size = write_checkpoint(
+                    CHECKPOINT_PATH, encoded, '{}.blocking.tmp'.format(CHECKPOINT_PATH)
+                )
+            except OSError as error:
+                self.checkpoint_written(len(rooms), start, None, error)
+                return
+            self.checkpoint_written(len(rooms), start, size, None)
+        else:
+            self.checkpoint_writing = True
+            self.offload(write_checkpoint, (CHECKPOINT_PATH, encoded), done)
+
+    def checkpoint_written(self, room_count, start, size, error):
+        if error is not None:
+            logger.warning(
+                "Could not write checkpoint (path: {}, error: {})".format(CHECKPOINT_PATH, error)
+            )
+            return
+        self.checkpoint_seconds.observe(perf_counter() - start)
+        logger.debug("Wrote checkpoint (rooms: {}, bytes: {})".format(room_count, size))
+
+    def restore_checkpoint(self):
+        try:
+            checkpoint = read_checkpoint(CHECKPOINT_PATH)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as error:
+            logger.warning(
+                "Could not read checkpoint (path: {}, error: {})".format(CHECKPOINT_PATH, error)
+            )
+            return
+        age = time.time() - checkpoint['saved_at']
+        if age > CHECKPOINT_MAX_AGE:
+            logger.info(
+                "Ignoring stale checkpoint (path: {}, age: {:.0f}s)".format(CHECKPOINT_PATH, age)
+            )
+            return
+
+        start = perf_counter()
+        for room_data in checkpoint['rooms']:
+            self.restore_room(room_data)
+        logger.info(
+            "Restored checkpoint (path: {}, rooms: {}, age: {:.1f}s, duration: {:.3f}s)".format(
+                CHECKPOINT_PATH, len(self.resuming_rooms), age, perf_counter() - start
+            )
+        )
+
+    # The room keeps the connection ids it was saved with until its clients come back
+    def restore_room(self, data):
+        host_id = data['host_id']
+        room_code = data['room_code']
+        if not self.shard.owns(room_code) or not self.rooms.claim(room_code, host_id):
+            logger.warning("Could not restore room (id: {}, room: {})".format(host_id, room_code))
+            return
+
+        game = None
+        if data['game'] is not None:
+            game = restore_game(
+                data['game'], space_pool=self.space_pool if REPLAY_DIR is None else None
+            )
+        room = RoomSession(
+            host_id, room_code, data['game_state'], game, TickEncoder(), VIEWER_ENCODINGS,
+            board_description=data['board_description'], resume_token=data['resume_token']
+        )
+        for player_data in data['players']:
+            player = PlayerSession(
+                player_data['player_id'], player_data['state'], TokenBucket(INPUT_RATE, INPUT_BURST)
+            )
+            player.user_name = player_data['user_name']
+            player.character = player_data['character']
+            player.resume_token = player_data['resume_token']
+            player.room = room
+            player.game = game
+            room.add_player(player)
+            self.resuming_players[player.resume_token] = player
+
+        self.hosts[host_id] = room
+        self.resuming_rooms[host_id] = monotonic() + RESUME_TIMEOUT
+        if room.game_state == GAME_STATE_RUNNING:
+            self.scheduler.add(host_id, self.tick_game, args=(room, ))
+        self.publish_room_info(room)
+
+    # Writes a last checkpoint before the server stops, later changes (clients disconnecting as it
+    # goes down) are not written
+    def shutdown(self):
+        if self.shut_down:
+            return
+        if self.checkpoint_timer is not None:
+            self.checkpoint_timer.stop()
+            self.save_checkpoint(blocking=True)
+        self.shut_down = True
+
+    def publish(self, room, message_type, payload):
+        if self.relay is not None:
+            self.relay.publish(message_type, room.room_code, payload)
+
+    def publish_room_info(self, room):
+        self.publish(room, MESSAGE_ROOM_INFO, room_info(room, room.game_state == GAME_STATE_RUNNING))
+
+    # Messages bringing a newly subscribed relay up to date with every room
+    def relay_snapshot(self):
+        messages = []
+        for room in self.hosts.values():
+            messages.append(
+                (MESSAGE_ROOM_INFO, room.room_code, room_info(room, room.game_state == GAME_STATE_RUNNING))
+            )
+            # The relay cannot decode deltas until it has seen a keyframe
+            room.tick_encoder.request_keyframe()
+        return messages
+
+    def lookup_host_by_room_code(self, room_code):
+        return self.rooms.lookup(room_code)
+
+    def redirect_data(self, room_code):
+        return {'room_code': room_code, 'worker': self.shard.url_for(room_code)}
+
+    def lookup_winner_name(self, winner_val):
+        if winner_val == Game.types['player']:
+            return 'normal'
+        elif winner_val == Game.types['zombie']:
+            return 'zombies'
+        else:
+            return 'none'
+
+    def tick_room(self, room_code, encoding):
+        return tick_room(room_code, encoding)
+
+    # Go through the Socket.IO server directly, rooms are also left from background tasks where
+    # there is no Flask request
+    def join_room(self, room, sid, namespace):
+        self.socket_io.server.enter_room(sid, room, namespace=namespace)
+
+    def leave_room(self, room, sid, namespace):
+        self.socket_io.server.leave_room(sid, room, namespace=namespace)
+
+# Runs server.shutdown on the given signals before whatever handled them so far (gunicorn stopping
+# its worker, or the default)
+def shutdown_on_signals(server, signums=(signal.SIGTERM, signal.SIGINT)):
+    for signum in signums:
+        previous = signal.getsignal(signum)
+
+        def handle(signum, frame, previous=previous):
+            server.shutdown()
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                signal.signal(signum, previous if previous is not None else signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+
+        signal.signal(signum, handle)
@@ -0,0 +1,140 @@
+from bisect import bisect_left
+from collections import OrderedDict
+
+# Runtime metrics in the Prometheus text format:
+#   - Counters, gauges and histograms keep their values per tuple of label values, updating one is a
+#     dict lookup (and a bisect for histograms), cheap enough for the tick loop and every handler
+#   - Values that other parts of the server already keep are not copied on every update, a metric
+#     created with a function reads them when scraped. The function returns a value, or a dict
+#     mapping tuples of label values to values.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from a fraction of a physics step to several network ticks
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0
+)
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, escape_label_value(value)) for name, value in pairs
+    ) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name, help, labelnames=(), function=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        # Map tuple of label values to value
+        self.values = {}
+
+    def samples(self):
+        if self.function is None:
+            return self.values.items()
+        values = self.function()
+        if not isinstance(values, dict):
+            return [((), values)]
+        return values.items()
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        for labels, value in sorted(self.samples(), key=lambda sample: sample[0]):
+            lines.append(
+                '{}{} {}'.format(self.name, format_labels(self.labelnames, labels), format_value(value))
+            )
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        state = self.values.get(labels)
+        if state is None:
+            # Per bucket counts (the last one is +Inf), then the sum
+            state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        bounds = self.buckets + (float('inf'), )
+        for labels, state in sorted(self.values.items(), key=lambda sample: sample[0]):
+            cumulative = 0
+            for bound, count in zip(bounds, state):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(self.labelnames, labels, [('le', format_value(float(bound)))]),
+                    cumulative
+                ))
+            label_text = format_labels(self.labelnames, labels)
+            lines.append('{}_sum{} {}'.format(self.name, label_text, format_value(state[-1])))
+            lines.append('{}_count{} {}'.format(self.name, label_text, cumulative))
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Metric {} is already registered".format(metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=(), function=None):
+        return self.add(Counter(name, help, labelnames, function))
+
+    def gauge(self, name, help, labelnames=(), function=None):
+        return self.add(Gauge(name, help, labelnames, function))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+# Turns a Counter of plain keys into samples of a single label metric
+def labelled(counts):
+    return {(key, ): value for key, value in counts.items()}
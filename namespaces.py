@@ -1,5 +1,6 @@
 from flask import request
 from flask_socketio import Namespace, emit
+from time import perf_counter
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,45 +12,61 @@ logger.setLevel(logging.DEBUG)
 #       - on_"event type": this type of function is used to receive message/events
 #       - send_"event type": this type of function is used to send messages/events to a single entity
 #       - broadcast_"event type": this type of function is used to send messages/events to a group of entities
+#   - send_ and broadcast_ functions live in the *Messages classes, which only need emit and are
+#     shared with the asyncio namespaces in aio.py
+
+# Times every on_* handler into the parent's handler_latency histogram, and sends packets for a
+# room through the parent's broadcaster so they are encoded once and counted
+class MeteredNamespace(Namespace):
+    def trigger_event(self, event, *args):
+        if not hasattr(self, 'on_' + event):
+            return super(MeteredNamespace, self).trigger_event(event, *args)
+
+        start = perf_counter()
+        try:
+            return super(MeteredNamespace, self).trigger_event(event, *args)
+        finally:
+            self.parent.handler_latency.observe(perf_counter() - start, (self.namespace, event))
+
+    def emit(self, event, data=None, room=None, **kwargs):
+        if room is None or kwargs:
+            return super(MeteredNamespace, self).emit(event, data, room=room, **kwargs)
+        self.parent.broadcaster.emit(self.namespace, room, event, data)
+
+class HostMessages:
+    def send_room_code(self, host_id, room_code, resume_token):
+        self.emit(
+            'room_code', {
+                'pkt_name': 'room_code',
+                'room_code': room_code,
+                'resume_token': resume_token
+            },
+            room=host_id
+        )
 
-class HostNamespace(Namespace):
-    def __init__(self, *args, **kwargs):
-        super(HostNamespace,
-              self).__init__(*args, **{key: kwargs[key]
-                                       for key in kwargs
-                                       if key != 'parent'})
-
-        if 'parent' not in kwargs:
-            raise ValueError("'parent' keyword not found in namespace init")
-
-        self.parent = kwargs['parent']
-
-    def on_connect(self):
-        self.parent.register_host_connect(request.sid)
-
-    def on_disconnect(self):
-        self.parent.register_host_disconnect(request.sid)
-
-    def send_room_code(self, host_id, room_code):
-        self.emit('room_code', {'pkt_name': 'room_code', 'room_code': room_code}, room=host_id)
+    def send_resume_response(self, host_id, status, aux_data):
+        self.emit(
+            'resume_response', {
+                'pkt_name': 'resume_response',
+                'status': status,
+                'aux_data': aux_data
+            },
+            room=host_id
+        )
 
     def send_player_joined(self, host_id, players, new_player_name):
         self.emit(
             'player_joined', {
                 'pkt_name': 'player_joined',
-                'players': list(players),
+                'players': players,
                 'new_player_name': new_player_name
             },
             room=host_id
         )
 
-    def on_request_start_game(self, data):
-        host_id = request.sid
-        self.parent.register_request_start_game(host_id)
-
-class ViewerNamespace(Namespace):
+class HostNamespace(HostMessages, MeteredNamespace):
     def __init__(self, *args, **kwargs):
-        super(ViewerNamespace,
+        super(HostNamespace,
               self).__init__(*args, **{key: kwargs[key]
                                        for key in kwargs
                                        if key != 'parent'})
@@ -60,11 +77,23 @@ class ViewerNamespace(Namespace):
         self.parent = kwargs['parent']
 
     def on_connect(self):
-        self.parent.register_viewer_connect(request.sid)
+        self.parent.register_host_connect(request.sid)
 
     def on_disconnect(self):
-        self.parent.register_viewer_disconnect(request.sid)
+        self.parent.register_host_disconnect(request.sid)
+
+    def on_request_start_game(self, data):
+        host_id = request.sid
+        self.parent.register_request_start_game(host_id)
+
+    def on_request_resume_room(self, payload):
+        host_id = request.sid
+        room_code = payload['room_code']
+        resume_token = payload['resume_token']
 
+        self.parent.register_host_resume_request(host_id, room_code, resume_token)
+
+class ViewerMessages:
     def broadcast_game_starting(self, room_id):
         self.emit(
             'game_starting', {
@@ -75,14 +104,14 @@ class ViewerNamespace(Namespace):
     def broadcast_game_over(self, room_id, winner):
         self.emit('game_over', {'pkt_name': 'game_over', 'winner': winner}, room=room_id)
 
-    def broadcast_game_tick(self, room_id, player_pos_data):
-        self.emit(
-            'game_tick', {
-                'pkt_name': 'game_tick',
-                'player_pos_data': player_pos_data
-            },
-            room=room_id
-        )
+    def broadcast_game_tick(self, batch, room_id, tick_data):
+        packet = {'pkt_name': 'game_tick'}
+        packet.update(tick_data)
+        # Deltas refer to the last keyframe, a client must never miss one
+        batch.broadcast(room_id, 'game_tick', packet, droppable=not tick_data['keyframe'])
+
+    def broadcast_game_tick_binary(self, batch, room_id, tick_data):
+        batch.broadcast(room_id, 'game_tick_bin', tick_data, droppable=True)
 
     def send_game_view_response(self, viewer_id, view_status, aux_data):
         self.emit(
@@ -94,15 +123,9 @@ class ViewerNamespace(Namespace):
             room=viewer_id
         )
 
-    def on_request_game_view(self, payload):
-        viewer_id = request.sid
-        room_code = payload['room_code']
-
-        self.parent.register_request_game_view(viewer_id, room_code)
-
-class PlayerNamespace(Namespace):
+class ViewerNamespace(ViewerMessages, MeteredNamespace):
     def __init__(self, *args, **kwargs):
-        super(PlayerNamespace,
+        super(ViewerNamespace,
               self).__init__(*args, **{key: kwargs[key]
                                        for key in kwargs
                                        if key != 'parent'})
@@ -113,11 +136,19 @@ class PlayerNamespace(Namespace):
         self.parent = kwargs['parent']
 
     def on_connect(self):
-        self.parent.register_player_connect(request.sid)
+        self.parent.register_viewer_connect(request.sid)
 
     def on_disconnect(self):
-        self.parent.register_player_disconnect(request.sid)
+        self.parent.register_viewer_disconnect(request.sid)
 
+    def on_request_game_view(self, payload):
+        viewer_id = request.sid
+        room_code = payload['room_code']
+        encoding = payload.get('encoding', 'json')
+
+        self.parent.register_request_game_view(viewer_id, room_code, encoding)
+
+class PlayerMessages:
     def send_player_join_response(self, player_id, status, aux_data):
         self.emit(
             'player_join_response', {
@@ -134,28 +165,51 @@ class PlayerNamespace(Namespace):
     def broadcast_game_over(self, room_id, winner):
         self.emit('game_over', {'pkt_name': 'game_over', 'winner': winner}, room=room_id)
 
-    def broadcast_game_tick(self, room_id, god_spells):
-        self.emit(
-            'god_spells', {
-                'pkt_name': 'god_spells',
-                'god_spells': god_spells
-            },
-            room=room_id
+    def broadcast_game_tick(self, batch, room_id, god_spells):
+        batch.broadcast(
+            room_id, 'god_spells', {'pkt_name': 'god_spells', 'god_spells': god_spells},
+            droppable=True
         )
 
-    def send_status_change(self, player_id, type, data):
-        self.emit('status_change', {
+    def send_status_change(self, batch, player_id, type, data):
+        batch.send(player_id, 'status_change', {
                 'pkt_name': 'status_change',
                 'type': type,
                 type: data
-            }, room=player_id)
+            })
+
+class PlayerNamespace(PlayerMessages, MeteredNamespace):
+    def __init__(self, *args, **kwargs):
+        super(PlayerNamespace,
+              self).__init__(*args, **{key: kwargs[key]
+                                       for key in kwargs
+                                       if key != 'parent'})
+
+        if 'parent' not in kwargs:
+            raise ValueError("'parent' keyword not found in namespace init")
+
+        self.parent = kwargs['parent']
+
+    def on_connect(self):
+        self.parent.register_player_connect(request.sid)
+
+    def on_disconnect(self):
+        self.parent.register_player_disconnect(request.sid)
 
     def on_player_join_request(self, payload):
         room_code = payload['room_code']
         user_name = payload['user_name']
+        batch = payload.get('batch', False)
+        player_id = request.sid
+
+        self.parent.register_player_join_request(player_id, room_code, user_name, batch)
+
+    def on_player_rejoin_request(self, payload):
+        room_code = payload['room_code']
+        resume_token = payload['resume_token']
         player_id = request.sid
 
-        self.parent.register_player_join_request(player_id, room_code, user_name)
+        self.parent.register_player_rejoin_request(player_id, room_code, resume_token)
 
     def on_make_move(self, payload):
         player_id = request.sid
@@ -0,0 +1,134 @@
+# Viewer tick packets:
+#   - A keyframe carries the full state of every player, with positions rounded to the quantum
+#   - Every other packet only carries the players whose quantized position or zombie flag differs
+#     from the last keyframe, as integer offsets in quanta. Deltas are always relative to the
+#     keyframe (never to each other), so a lost or skipped delta does not corrupt later ones
+#   - A keyframe is sent every KEYFRAME_INTERVAL packets, whenever the player set changes and
+#     whenever one is requested (e.g. a new viewer joined)
+#
+# Binary viewer tick packets (little endian), every packet is a full snapshot:
+#   - header: uint32 seq, uint8 position scale, uint16 player count
+#   - per player: uint16 character slot, int16 x, int16 y (fixed point, in quanta)
+#   - zombie bitmask: ceil(count / 8) bytes, bit i is set if the i-th player listed is a zombie
+
+import struct
+
+# Encodings viewers can ask ticks in
+ENCODING_JSON = 'json'
+ENCODING_BINARY = 'binary'
+ENCODINGS = (ENCODING_JSON, ENCODING_BINARY)
+
+# Number of quanta per world unit, positions are sent in quarter pixels
+POSITION_SCALE = 4
+KEYFRAME_INTERVAL = 20
+
+BINARY_HEADER_FORMAT = '<IBH'
+BINARY_PLAYER_FORMAT = 'Hhh'
+
+def quantize(value):
+    return int(round(value * POSITION_SCALE))
+
+def zombie_mask_len(count):
+    return (count + 7) // 8
+
+def binary_tick_struct(count, cache={}):
+    packer = cache.get(count)
+    if packer is None:
+        packer = cache[count] = struct.Struct(
+            BINARY_HEADER_FORMAT + BINARY_PLAYER_FORMAT * count
+            + '{}s'.format(zombie_mask_len(count))
+        )
+    return packer
+
+def encode_binary_tick(game, seq):
+    count = len(game.players)
+    values = [seq & 0xFFFFFFFF, POSITION_SCALE, count]
+    zombie_mask = 0
+    for i, player in enumerate(game.players.values()):
+        position = player.body.position
+        values.append(player.index)
+        values.append(quantize(position[0]))
+        values.append(quantize(position[1]))
+        if player.is_zombie():
+            zombie_mask |= 1 << i
+    values.append(zombie_mask.to_bytes(zombie_mask_len(count), 'little'))
+
+    return binary_tick_struct(count).pack(*values)
+
+class TickEncoder:
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+
+        self.seq = -1
+        self.keyframe_seq = None
+        self.force_keyframe = True
+        # Map player id to (x, y, is_zombie) as sent in the last keyframe
+        self.keyframe_states = {}
+
+    def request_keyframe(self):
+        self.force_keyframe = True
+
+    # Encodes one tick in the formats that currently have subscribers, either may be None
+    def encode(self, game, json=True, binary=False):
+        self.seq += 1
+
+        json_packet = self.encode_json(game) if json else None
+        binary_packet = encode_binary_tick(game, self.seq) if binary else None
+        return json_packet, binary_packet
+
+    def encode_json(self, game):
+        states = {}
+        for id, player in game.players.items():
+            position = player.body.position
+            states[id] = (quantize(position[0]), quantize(position[1]), player.is_zombie())
+
+        if (
+            self.force_keyframe or self.seq - self.keyframe_seq >= self.keyframe_interval
+            or states.keys() != self.keyframe_states.keys()
+        ):
+            return self.encode_keyframe(game, states)
+        return self.encode_delta(states)
+
+    def encode_keyframe(self, game, states):
+        self.force_keyframe = False
+        self.keyframe_seq = self.seq
+        self.keyframe_states = states
+
+        player_pos_data = {
+            id: {
+                'position': {
+                    'x': x / POSITION_SCALE,
+                    'y': y / POSITION_SCALE
+                },
+                'isZombie': is_zombie
+            }
+            for id, (x, y, is_zombie) in states.items()
+        }
+        god_spells = game.god_spells()
+        if god_spells is not None:
+            player_pos_data['god_spells'] = god_spells
+
+        return {
+            'seq': self.seq,
+            'keyframe': True,
+            'scale': POSITION_SCALE,
+            'player_pos_data': player_pos_data
+        }
+
+    def encode_delta(self, states):
+        deltas = {}
+        zombies = {}
+        for id, (x, y, is_zombie) in states.items():
+            base_x, base_y, base_is_zombie = self.keyframe_states[id]
+            if x != base_x or y != base_y:
+                deltas[id] = [x - base_x, y - base_y]
+            if is_zombie != base_is_zombie:
+                zombies[id] = is_zombie
+
+        return {
+            'seq': self.seq,
+            'keyframe': False,
+            'base_seq': self.keyframe_seq,
+            'deltas': deltas,
+            'zombies': zombies
+        }
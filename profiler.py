@@ -0,0 +1,163 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+# Under eventlet handlers run in green threads, which the patched threading module reports as
+# threads of their own. Signals are tied to the OS thread, so that is the one compared against.
+try:
+    from eventlet.patcher import original
+except ImportError:
+    import _thread as os_thread
+else:
+    os_thread = original('_thread')
+
+# Sampling profiler:
+#   - Samples the stack on SIGPROF from an ITIMER_PROF interval timer, so samples follow the CPU
+#     time of the process and an idle server is barely sampled. Nothing is instrumented, the
+#     server runs exactly the same code while it is off.
+#   - Handlers run in the main thread between bytecodes, where eventlet and asyncio run all
+#     handlers and ticks. A thread stepping games for the asyncio server's simulation executor is
+#     sampled alongside the main thread whenever it is inside a tick.
+#   - Samples are attributed to the room and phase of the tick they were taken in, both found by
+#     walking the sampled stack: the innermost function listed in phases names the phase, and the
+#     innermost function listed in rooms names the local holding the room. Time spent in native
+#     code (chipmunk) is attributed to the python frame that called it.
+#   - Results come as folded stacks ("frame;frame;frame count" lines, for flamegraph.pl or
+#     speedscope) with the room and phase as the two outermost frames, or as a summary of samples
+#     by room and phase
+
+NO_ROOM = '-'
+PHASE_OTHER = 'other'
+
+MIN_INTERVAL = 0.001
+MAX_SECONDS = 60.0
+
+def frame_name(code):
+    return '{} ({}:{})'.format(
+        code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+    )
+
+class Profile:
+    def __init__(self, samples, interval, duration):
+        # Map (room code, phase, code objects root first) to the number of samples
+        self.samples = samples
+        self.interval = interval
+        self.duration = duration
+
+    def folded(self):
+        names = {}
+        lines = []
+        for (room, phase, codes), count in sorted(
+            self.samples.items(), key=lambda item: (item[0][0], item[0][1], -item[1])
+        ):
+            frames = ['room {}'.format(room), 'phase {}'.format(phase)]
+            for code in codes:
+                name = names.get(code)
+                if name is None:
+                    name = names[code] = frame_name(code)
+                frames.append(name)
+            lines.append('{} {}'.format(';'.join(frames), count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        rooms = {}
+        for (room, phase, _), count in self.samples.items():
+            phases = rooms.setdefault(room, {})
+            phases[phase] = phases.get(phase, 0) + count
+        return {
+            'samples': sum(self.samples.values()),
+            'interval': self.interval,
+            'duration': self.duration,
+            'rooms': rooms,
+        }
+
+class SamplingProfiler:
+    # phases maps functions to the phase samples taken inside them belong to, rooms maps functions
+    # to the name of their local variable holding the room (anything with a room_code)
+    def __init__(self, phases=None, rooms=None):
+        self.phases = {function.__code__: phase for function, phase in (phases or {}).items()}
+        self.rooms = {function.__code__: local for function, local in (rooms or {}).items()}
+        self.running = False
+        self.samples = Counter()
+        self.interval = None
+        self.started_at = None
+        self.previous_handler = None
+        self.main_thread_id = threading.main_thread().ident
+
+    # Must be called from the main OS thread (any green thread running on it), raises RuntimeError
+    # if a profile is already running
+    def start(self, interval):
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        if os_thread.get_ident() != self.main_thread_id:
+            raise RuntimeError("The profiler can only be started from the main thread")
+
+        self.samples = Counter()
+        self.interval = max(interval, MIN_INTERVAL)
+        self.started_at = time.monotonic()
+        self.running = True
+        self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        if not self.running:
+            return None
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+        self.running = False
+        return Profile(self.samples, self.interval, time.monotonic() - self.started_at)
+
+    def sample(self, signum, frame):
+        if frame is not None:
+            self.record(frame, False)
+        for thread_id, thread_frame in sys._current_frames().items():
+            if thread_id != self.main_thread_id:
+                self.record(thread_frame, True)
+
+    # Other threads are only sampled inside a room's tick, they spend the rest of their time
+    # waiting for work
+    def record(self, frame, only_rooms):
+        phase = None
+        room = None
+        codes = []
+        while frame is not None:
+            code = frame.f_code
+            codes.append(code)
+            if phase is None:
+                phase = self.phases.get(code)
+            if room is None:
+                local = self.rooms.get(code)
+                if local is not None:
+                    room = getattr(frame.f_locals.get(local), 'room_code', None)
+            frame = frame.f_back
+        if room is None and only_rooms:
+            return
+        codes.reverse()
+        self.samples[(room or NO_ROOM, phase or PHASE_OTHER, tuple(codes))] += 1
+
+# Returns (seconds, interval, output format) of a profile request's query arguments, raises
+# ValueError for invalid ones
+def profile_arguments(arguments):
+    try:
+        seconds = float(arguments.get('seconds', 10))
+        interval = float(arguments.get('interval', 0.005))
+    except ValueError:
+        raise ValueError("seconds and interval must be numbers")
+    output = arguments.get('format', 'folded')
+    if not 0 < seconds <= MAX_SECONDS:
+        raise ValueError("seconds must be between 0 and {}".format(MAX_SECONDS))
+    if interval < MIN_INTERVAL:
+        raise ValueError("interval must be at least {}".format(MIN_INTERVAL))
+    if output not in ('folded', 'summary'):
+        raise ValueError("format must be folded or summary")
+    return seconds, interval, output
+
+# Returns (body, content type) of a finished profile
+def render_profile(profile, output):
+    if output == 'summary':
+        return json.dumps(profile.summary(), indent=2, sort_keys=True), 'application/json'
+    return profile.folded(), 'text/plain; charset=utf-8'
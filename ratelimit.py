@@ -0,0 +1,26 @@
+from time import monotonic
+
+# Token bucket:
+#   - Holds up to burst tokens and refills at rate tokens per second
+#   - Every accepted event takes one token, events arriving with an empty bucket are dropped and
+#     counted
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'dropped', 'clock')
+
+    def __init__(self, rate, burst, clock=monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.clock = clock
+        self.updated = clock()
+        self.dropped = 0
+
+    def take(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.dropped += 1
+            return False
+        self.tokens -= 1
+        return True
@@ -0,0 +1,351 @@
+from queue import Queue, Full, Empty
+import json
+import logging
+import socket
+import struct
+
+from broadcast import tick_room
+from metrics import Registry, labelled
+from packets import ENCODING_JSON, ENCODING_BINARY, ENCODINGS
+from sessions import ViewerSession
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Viewer relay tier:
+#   - The simulation process publishes every room's viewer stream once over a local TCP
+#     connection to each subscribed relay process, and no longer fans out to viewers itself
+#   - Relay processes serve /viewer, keep the last room info and keyframe of every room and fan
+#     ticks out to their viewers through a Broadcaster, skipping ticks for slow viewers
+#   - Every subscriber has a bounded queue in the simulation process, a relay that falls behind
+#     loses binary ticks and json deltas. If it cannot even keep up with room updates and json
+#     keyframes, which later deltas refer to, it is disconnected, and it resyncs from a snapshot of
+#     every room when it reconnects.
+#
+# Messages (little endian): uint32 payload length, uint8 type, uint8 room code length, the room
+# code, then the payload. Payloads are json except for binary ticks, which are sent as encoded by
+# packets.encode_binary_tick.
+
+MESSAGE_HEADER = struct.Struct('<IBB')
+
+MESSAGE_ROOM_INFO = 1
+MESSAGE_ROOM_CLOSED = 2
+MESSAGE_GAME_STARTING = 3
+MESSAGE_GAME_OVER = 4
+MESSAGE_TICK_JSON = 5
+MESSAGE_TICK_BINARY = 6
+
+TICK_MESSAGES = (MESSAGE_TICK_JSON, MESSAGE_TICK_BINARY)
+
+# Json deltas refer to the last keyframe, a relay must never miss one
+def is_droppable(message_type, payload):
+    if message_type == MESSAGE_TICK_BINARY:
+        return True
+    return message_type == MESSAGE_TICK_JSON and not payload['keyframe']
+
+# Messages queued for a relay before ticks are dropped
+MAX_SUBSCRIBER_QUEUE = 256
+
+def encode_message(message_type, room_code, payload):
+    if message_type != MESSAGE_TICK_BINARY:
+        payload = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    code = room_code.encode('utf-8')
+    return MESSAGE_HEADER.pack(len(payload), message_type, len(code)) + code + payload
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError("Relay connection closed")
+    return data
+
+def read_message(stream):
+    length, message_type, code_length = MESSAGE_HEADER.unpack(
+        read_exactly(stream, MESSAGE_HEADER.size)
+    )
+    room_code = read_exactly(stream, code_length).decode('utf-8')
+    payload = read_exactly(stream, length)
+    if message_type != MESSAGE_TICK_BINARY:
+        payload = json.loads(payload.decode('utf-8'))
+    return message_type, room_code, payload
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+class RelaySubscriber:
+    def __init__(self, connection, max_queue):
+        self.connection = connection
+        self.queue = Queue(max_queue)
+        self.closed = False
+        self.dropped = 0
+        # Encoded snapshot of every room, written ahead of the queue
+        self.snapshot = None
+
+class RelayPublisher:
+    def __init__(self, address, start_task, snapshot, max_queue=MAX_SUBSCRIBER_QUEUE):
+        self.address = parse_address(address)
+        self.start_task = start_task
+        # Returns the (type, room code, payload) messages recreating every current room
+        self.snapshot = snapshot
+        self.max_queue = max_queue
+        self.subscribers = []
+
+    def start(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(self.address)
+        listener.listen(16)
+        logger.info("Publishing viewer streams to relays on {}:{}".format(*self.address))
+        self.start_task(self.accept, listener)
+
+    @property
+    def subscribed(self):
+        return len(self.subscribers) > 0
+
+    def accept(self, listener):
+        while True:
+            connection, address = listener.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            logger.info("Relay subscribed (address: {})".format(address))
+
+            self.subscribe(connection)
+
+    # The snapshot is taken before the subscriber can see any later update. Its writer sends it
+    # ahead of the queue, so it is not bound by the queue however many rooms there are.
+    def subscribe(self, connection):
+        subscriber = RelaySubscriber(connection, self.max_queue)
+        subscriber.snapshot = b''.join(
+            encode_message(message_type, room_code, payload)
+            for message_type, room_code, payload in self.snapshot()
+        )
+        self.subscribers.append(subscriber)
+        self.start_task(self.write, subscriber)
+        return subscriber
+
+    def write(self, subscriber):
+        try:
+            snapshot, subscriber.snapshot = subscriber.snapshot, None
+            if snapshot:
+                subscriber.connection.sendall(snapshot)
+            while not subscriber.closed:
+                data = subscriber.queue.get()
+                if data is None:
+                    break
+                subscriber.connection.sendall(data)
+        except OSError as error:
+            logger.warning("Relay connection failed ({})".format(error))
+        finally:
+            self.close(subscriber)
+
+    def close(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+        if subscriber.closed:
+            return
+        subscriber.closed = True
+        subscriber.connection.close()
+        # Wake the writer up in case it is waiting for data
+        try:
+            subscriber.queue.get_nowait()
+        except Empty:
+            pass
+        subscriber.queue.put_nowait(None)
+        logger.info("Relay unsubscribed (dropped ticks: {})".format(subscriber.dropped))
+
+    def queue(self, subscriber, data, droppable):
+        try:
+            subscriber.queue.put_nowait(data)
+        except Full:
+            if droppable:
+                subscriber.dropped += 1
+                return
+            logger.warning("Relay fell behind on room updates, disconnecting it")
+            self.close(subscriber)
+
+    def publish(self, message_type, room_code, payload):
+        if not self.subscribers:
+            return
+        data = encode_message(message_type, room_code, payload)
+        droppable = is_droppable(message_type, payload)
+        for subscriber in list(self.subscribers):
+            self.queue(subscriber, data, droppable)
+
+class RelayRoom:
+    __slots__ = ('room_code', 'source', 'aux_data', 'running', 'keyframe', 'viewers')
+
+    def __init__(self, room_code, source):
+        self.room_code = room_code
+        # Address of the simulation process publishing the room
+        self.source = source
+        self.aux_data = None
+        self.running = False
+        # Last json keyframe, new viewers start from it
+        self.keyframe = None
+        # Viewer sessions watching the room
+        self.viewers = []
+
+# Stands in for the simulation Server behind ViewerNamespace in a relay process
+class RelayServer:
+    def __init__(self, viewer_namespace_class, sources, endpoint='/viewer'):
+        self.viewer_namespace_class = viewer_namespace_class
+        self.sources = list(sources)
+        self.endpoint = endpoint
+
+        # Map viewer connection id to its ViewerSession
+        self.viewers = {}
+        # Map room code to its RelayRoom
+        self.rooms = {}
+
+        self.metrics = Registry()
+        self.metrics.gauge(
+            'zombeans_relay_rooms', 'Rooms known to the relay', function=lambda: len(self.rooms)
+        )
+        self.metrics.gauge(
+            'zombeans_connections', 'Connected clients by namespace', ('namespace', ),
+            function=lambda: {(self.endpoint, ): len(self.viewers)}
+        )
+        self.handler_latency = self.metrics.histogram(
+            'zombeans_handler_seconds', 'Time spent in a socket event handler',
+            ('namespace', 'event')
+        )
+        for name, help, attribute in (
+            ('zombeans_sent_packets_total', 'Packets sent by namespace', 'sends'),
+            ('zombeans_sent_bytes_total', 'Bytes sent by namespace', 'bytes_sent'),
+            ('zombeans_dropped_packets_total', 'Ticks skipped for slow clients', 'dropped'),
+        ):
+            self.metrics.counter(
+                name, help, ('namespace', ),
+                function=lambda attribute=attribute: labelled(getattr(self.broadcaster, attribute))
+            )
+
+    def register(self, socket_io, broadcaster):
+        self.socket_io = socket_io
+        self.broadcaster = broadcaster
+
+        self.viewer_namespace = self.viewer_namespace_class(self.endpoint, parent=self)
+        self.socket_io.on_namespace(self.viewer_namespace)
+
+        for source in self.sources:
+            self.socket_io.start_background_task(self.subscribe, source)
+
+    def subscribe(self, source, retry_time=1.0):
+        while True:
+            connection = None
+            try:
+                connection = socket.create_connection(parse_address(source))
+                logger.info("Subscribed to simulation (source: {})".format(source))
+                stream = connection.makefile('rb')
+                while True:
+                    self.handle(source, *read_message(stream))
+            except (OSError, EOFError) as error:
+                logger.warning(
+                    "Lost simulation stream, retrying (source: {}, error: {})".format(source, error)
+                )
+            finally:
+                if connection is not None:
+                    connection.close()
+            self.close_source(source)
+            self.socket_io.sleep(retry_time)
+
+    def close_source(self, source):
+        for room_code, room in list(self.rooms.items()):
+            if room.source == source:
+                self.close_room(room, 'none')
+
+    def close_room(self, room, winner):
+        if winner is not None:
+            self.viewer_namespace.broadcast_game_over(room.room_code, winner)
+        for viewer in room.viewers:
+            viewer.room = None
+            self.leave_rooms(viewer, room.room_code)
+        del self.rooms[room.room_code]
+
+    def handle(self, source, message_type, room_code, payload):
+        room = self.rooms.get(room_code)
+        if message_type == MESSAGE_ROOM_INFO:
+            if room is None:
+                room = self.rooms[room_code] = RelayRoom(room_code, source)
+            room.aux_data = payload['aux_data']
+            room.running = payload['running']
+        elif room is None:
+            return
+        elif message_type == MESSAGE_ROOM_CLOSED:
+            self.close_room(room, payload['winner'])
+        elif message_type == MESSAGE_GAME_STARTING:
+            room.running = True
+            self.viewer_namespace.broadcast_game_starting(room_code)
+        elif message_type == MESSAGE_GAME_OVER:
+            room.running = False
+            self.viewer_namespace.broadcast_game_over(room_code, payload['winner'])
+        elif message_type in TICK_MESSAGES:
+            self.broadcaster.count_tick()
+            batch = self.broadcaster.batch(self.endpoint)
+            if message_type == MESSAGE_TICK_JSON:
+                if payload['keyframe']:
+                    room.keyframe = payload
+                self.viewer_namespace.broadcast_game_tick(
+                    batch, tick_room(room_code, ENCODING_JSON), payload
+                )
+            else:
+                self.viewer_namespace.broadcast_game_tick_binary(
+                    batch, tick_room(room_code, ENCODING_BINARY), payload
+                )
+            batch.flush()
+
+    def register_viewer_connect(self, viewer_id):
+        logger.info("New viewer connected to relay (id: {})".format(viewer_id))
+        self.viewers[viewer_id] = ViewerSession(viewer_id, ENCODING_JSON)
+
+    def register_viewer_disconnect(self, viewer_id):
+        viewer = self.viewers.pop(viewer_id)
+        self.broadcaster.forget(viewer_id)
+        if viewer.room is not None:
+            viewer.room.viewers.remove(viewer)
+            self.leave_rooms(viewer, viewer.room.room_code)
+
+    def register_request_game_view(self, viewer_id, room_code, encoding=ENCODING_JSON):
+        room = self.rooms.get(room_code)
+        if room is None or room.aux_data is None:
+            self.viewer_namespace.send_game_view_response(
+                viewer_id, 'failure', 'Room {} does not exist.'.format(room_code)
+            )
+            return
+        if encoding not in ENCODINGS:
+            encoding = ENCODING_JSON
+
+        viewer = self.viewers[viewer_id]
+        viewer.room = room
+        viewer.encoding = encoding
+        room.viewers.append(viewer)
+
+        self.join_room(room_code, viewer_id)
+        self.join_room(tick_room(room_code, encoding), viewer_id)
+        self.viewer_namespace.send_game_view_response(viewer_id, 'success', room.aux_data)
+
+        # Deltas are relative to the last keyframe, hand it over instead of waiting for the next
+        if encoding == ENCODING_JSON and room.running and room.keyframe is not None:
+            batch = self.broadcaster.batch(self.endpoint)
+            self.viewer_namespace.broadcast_game_tick(batch, viewer_id, room.keyframe)
+            batch.flush()
+
+        logger.info("Viewer joined relayed room (id: {}, room: {})".format(viewer_id, room_code))
+
+    def leave_rooms(self, viewer, room_code):
+        self.leave_room(room_code, viewer.viewer_id)
+        self.leave_room(tick_room(room_code, viewer.encoding), viewer.viewer_id)
+
+    def join_room(self, room, sid):
+        self.socket_io.server.enter_room(sid, room, namespace=self.endpoint)
+
+    def leave_room(self, room, sid):
+        self.socket_io.server.leave_room(sid, room, namespace=self.endpoint)
+
+def room_info(room, running):
+    _, viewer_roster = room.rosters()
+    return {
+        'aux_data': {
+            'current_players': viewer_roster,
+            'board_description': room.board_description
+        },
+        'running': running
+    }
@@ -0,0 +1,40 @@
+from flask import Flask, Response
+from flask_socketio import SocketIO
+from os import getenv
+import logging
+from namespaces import ViewerNamespace
+from broadcast import Broadcaster
+from relay import RelayServer
+from metrics import CONTENT_TYPE
+
+# Viewer relay process, see relay.py. Run it like the game server:
+#   ZOMBEANS_RELAY_SOURCES=localhost:9000 gunicorn --worker-class eventlet -w 1 relay_server:app
+
+VIEWER_NS_ENDPOINT = '/viewer'
+
+# create logger with '__name__'
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Comma separated ZOMBEANS_RELAY_LISTEN addresses of every simulation process
+RELAY_SOURCES = [
+    source for source in getenv("ZOMBEANS_RELAY_SOURCES", default='localhost:9000').split(',')
+    if source
+]
+# Packets waiting to be written to a viewer before ticks are skipped for it
+VIEWER_MAX_QUEUE = int(getenv("ZOMBEANS_VIEWER_MAX_QUEUE", default=8))
+
+app = Flask(__name__)
+app.config['SECRET_KEY'] = "hey you! don't you dare say anything. Snitches get stitches"
+socketio = SocketIO(app, logger=logger)
+
+relay = RelayServer(ViewerNamespace, RELAY_SOURCES, VIEWER_NS_ENDPOINT)
+relay.register(socketio, Broadcaster(socketio, max_queue=VIEWER_MAX_QUEUE))
+
+# Runtime metrics in the Prometheus text format
+@app.route('/metrics')
+def metrics():
+    return Response(relay.metrics.render(), mimetype=CONTENT_TYPE)
+
+if __name__ == '__main__':
+    socketio.run(app)
@@ -0,0 +1,78 @@
+from collections import deque
+from random import choices
+from string import ascii_uppercase
+
+IDENTIFIER_LEN = 6
+
+# Room registry:
+#   - Owns the mapping from room codes to the host connection that owns the room
+#   - Guarantees that no two live rooms share a code
+#   - Freed codes are parked in a pool and handed out again (oldest first) before new codes are
+#     generated, so long running servers do not keep growing the set of codes in circulation
+#   - When sharded, only codes accepted by 'owns' (the codes hashing onto this worker) are generated
+
+class RoomRegistry:
+    def __init__(
+        self, code_len=IDENTIFIER_LEN, alphabet=ascii_uppercase, max_pool_size=4096, owns=None
+    ):
+        self.code_len = code_len
+        self.alphabet = alphabet
+        self.max_pool_size = max_pool_size
+        self.owns = owns
+
+        # Map room code to host id
+        self.hosts_by_code = {}
+        # Codes that were released and can be handed out again
+        self.free_codes = deque()
+
+    def __len__(self):
+        return len(self.hosts_by_code)
+
+    def __contains__(self, room_code):
+        return room_code in self.hosts_by_code
+
+    def allocate(self, host_id):
+        room_code = self._take_free_code()
+        if room_code is None:
+            room_code = self._generate_unused_code()
+
+        self.hosts_by_code[room_code] = host_id
+        return room_code
+
+    def release(self, room_code):
+        if self.hosts_by_code.pop(room_code, None) is None:
+            return
+
+        if len(self.free_codes) < self.max_pool_size:
+            self.free_codes.append(room_code)
+
+    # Binds a given code to host_id, for rooms restored from a checkpoint and handed over to the
+    # reconnecting host. Returns False if another host holds the code.
+    def claim(self, room_code, host_id, replaces=None):
+        current = self.hosts_by_code.get(room_code)
+        if current is not None and current != replaces:
+            return False
+
+        if current is None:
+            try:
+                self.free_codes.remove(room_code)
+            except ValueError:
+                pass
+        self.hosts_by_code[room_code] = host_id
+        return True
+
+    def lookup(self, room_code):
+        return self.hosts_by_code.get(room_code)
+
+    def _take_free_code(self):
+        if self.free_codes:
+            return self.free_codes.popleft()
+        return None
+
+    def _generate_unused_code(self):
+        while True:
+            room_code = ''.join(choices(self.alphabet, k=self.code_len))
+            if room_code in self.hosts_by_code:
+                continue
+            if self.owns is None or self.owns(room_code):
+                return room_code
@@ -0,0 +1,26 @@
+#!/usr/bin/env bash
+set -euo pipefail
+IFS=$'\n\t'
+
+# Runs one single worker gunicorn per core, every process owns the rooms hashing onto it.
+# ZOMBEANS_PUBLIC_HOST is what clients are redirected to, worker i listens on BASE_PORT + i.
+WORKERS=${ZOMBEANS_WORKERS:-$(nproc)}
+BASE_PORT=${ZOMBEANS_BASE_PORT:-8000}
+PUBLIC_HOST=${ZOMBEANS_PUBLIC_HOST:-http://localhost}
+
+URLS=""
+for ((i = 0; i < WORKERS; i++)); do
+    URLS="${URLS:+${URLS},}${PUBLIC_HOST}:$((BASE_PORT + i))"
+done
+
+PIDS=()
+for ((i = 0; i < WORKERS; i++)); do
+    # Every worker checkpoints its own rooms
+    ZOMBEANS_WORKER_INDEX=$i ZOMBEANS_WORKER_URLS=$URLS \
+        ZOMBEANS_CHECKPOINT_PATH=${ZOMBEANS_CHECKPOINT_PATH:+${ZOMBEANS_CHECKPOINT_PATH}.$i} \
+        gunicorn --log-level info --worker-class eventlet -w 1 -b "0.0.0.0:$((BASE_PORT + i))" server:app &
+    PIDS+=($!)
+done
+
+trap 'kill ${PIDS[@]}' INT TERM
+wait
@@ -1,22 +1,19 @@
-from flask import Flask, send_from_directory, request
-from flask_socketio import SocketIO, Namespace, emit, join_room, leave_room
+from flask import Flask, Response, request, abort, jsonify
+from flask_socketio import SocketIO
+from eventlet import tpool
 from os import getenv
 from pathlib import Path
 import logging
 from namespaces import HostNamespace, ViewerNamespace, PlayerNamespace
-from string import ascii_lowercase
-from random import choices
-from game import Game, Player
-from timer import PeriodicTimer, start_timer
+from sharding import socketio_queue_options
+from metrics import CONTENT_TYPE
+from assets import AssetCache
+from profiler import profile_arguments, render_profile
+from game_server import Server, shutdown_on_signals
 
-IDENTIFIER_LEN = 6
-
-MIN_PLAYERS_PER_ROOM = 3
-MAX_PLAYERS_PER_ROOM = 10
-
-PLAYER_NS_ENDPOINT = '/player'
-HOST_NS_ENDPOINT = '/host'
-VIEWER_NS_ENDPOINT = '/viewer'
+# Game server on eventlet, run with
+#   gunicorn --worker-class eventlet -w 1 server:app
+# aio_server.py serves the same game on asyncio.
 
 # create logger with '__name__'
 logger = logging.getLogger(__name__)
@@ -24,371 +21,84 @@ logger.setLevel(logging.DEBUG)
 
 STATIC_FOLDER = getenv("ZOMBEANS_STATIC_FOLDER", default='static')
 
+# Message queue used for emits across worker processes, see sharding.py
+MESSAGE_QUEUE = getenv("ZOMBEANS_MESSAGE_QUEUE")
+
 app = Flask(__name__, static_folder=STATIC_FOLDER)
 app.config['STATIC_FOLDER'] = Path(STATIC_FOLDER)
 app.config['SECRET_KEY'] = "hey you! don't you dare say anything. Snitches get stitches"
-socketio = SocketIO(app, logger=logger)
+socketio = SocketIO(app, logger=logger, **socketio_queue_options(MESSAGE_QUEUE))
+# The website is served from memory, see assets.py
+assets = AssetCache(STATIC_FOLDER).load()
+
+def asset_response(path):
+    response = assets.respond(
+        path, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match')
+    )
+    if response is None:
+        abort(404)
+    status, headers, body = response
+    return Response(body, status=status, headers=headers)
 
 # Handle first page
 @app.route('/')
 def main_page():
-    return send_from_directory(app.config['STATIC_FOLDER'], 'index.html')
+    return asset_response('index.html')
+
+# Tell clients (or a routing proxy) which worker owns a room
+@app.route('/route/<room_code>')
+def route_room(room_code):
+    return jsonify({'room_code': room_code, 'worker': server.shard.url_for(room_code)})
+
+# Runtime metrics in the Prometheus text format
+@app.route('/metrics')
+def metrics():
+    return Response(server.metrics.render(), mimetype=CONTENT_TYPE)
+
+# Samples the server for the given seconds and returns the profile, see profiler.py. Only answers
+# with ZOMBEANS_ADMIN_TOKEN as bearer token.
+@app.route('/admin/profile')
+def admin_profile():
+    if not server.is_admin(request.headers.get('Authorization')):
+        abort(404)
+    try:
+        seconds, interval, output = profile_arguments(request.args)
+    except ValueError as error:
+        return Response(str(error), status=400, mimetype='text/plain')
+    try:
+        server.profiler.start(interval)
+    except RuntimeError as error:
+        return Response(str(error), status=409, mimetype='text/plain')
+    logger.info("Profiling (seconds: {}, interval: {})".format(seconds, interval))
+    try:
+        socketio.sleep(seconds)
+    finally:
+        profile = server.profiler.stop()
+    body, content_type = render_profile(profile, output)
+    return Response(body, content_type=content_type)
 
 # Handle all static resources
 @app.route('/<path:subpath>')
 def static_content(subpath):
-    return send_from_directory(app.config['STATIC_FOLDER'], subpath)
-
-# Game States
-GAME_STATE_LOBBY_WAITING = 1
-GAME_STATE_RUNNING = 2
-GAME_STATE_FINISHED = 3
-
-# Player States
-PLAYER_STATE_NOTHING = 1
-PLAYER_STATE_WAITING_GAME_START = 2
-PLAYER_STATE_IN_GAME = 3
-
-# Types of clients:
-#   - Player: is served controls and joins a room and plays a game
-#   - Host: is allowed to control a game starting, is required for a game to exist
-#   - Viewer: is served render events
-
-class Server:
-    def __init__(self, host_namespace_class, viewer_namespace_class, player_namespace_class):
-        self.host_namespace_class = host_namespace_class
-        self.viewer_namespace_class = viewer_namespace_class
-        self.player_namespace_class = player_namespace_class
-
-        # Map player connection ids to all player data
-        self.players = {}
-        # Map game connection id to all game data
-        self.hosts = {}
-        # Map viewer connection id to all viewer data
-        self.viewers = {}
-
-    def register(self, socket_io):
-        self.socket_io = socket_io
-
-        self.host_namespace = self.host_namespace_class(HOST_NS_ENDPOINT, parent=self)
-        self.viewer_namespace = self.viewer_namespace_class(VIEWER_NS_ENDPOINT, parent=self)
-        self.player_namespace = self.player_namespace_class(PLAYER_NS_ENDPOINT, parent=self)
-
-        self.socket_io.on_namespace(self.host_namespace)
-        self.socket_io.on_namespace(self.viewer_namespace)
-        self.socket_io.on_namespace(self.player_namespace)
-
-    def register_host_connect(self, host_id):
-        logger.info("New host connected (id: {})".format(host_id))
-        room_code = self.generate_room_code()
-
-        self.hosts[host_id] = {
-            'players': [],
-            'viewers': [],
-            'room_code': room_code,
-            'game_state': GAME_STATE_LOBBY_WAITING,
-            'game_obj': Game(),
-            'game_timer_thread': None,
-            'previous_player_states': {}
-        }
-
-        self.host_namespace.send_room_code(host_id, room_code)
-
-    def register_host_disconnect(self, host_id):
-        host = self.hosts[host_id]
-        game_state = host['game_state']
-        players = host['players']
-        viewers = host['viewers']
-        room_code = host['room_code']
-
-        if (game_state == GAME_STATE_LOBBY_WAITING) or (game_state == GAME_STATE_RUNNING):
-            for player_id in players:
-                self.players[player_id]['game_host'] = None
-                self.players[player_id]['state'] = PLAYER_STATE_NOTHING
-
-                self.leave_room(room_code, player_id, PLAYER_NS_ENDPOINT)
-
-            for viewer_id in viewers:
-                self.viewers[viewer_id]['room_code'] = None
-
-                self.leave_room(room_code, viewer_id, VIEWER_NS_ENDPOINT)
-
-            self.player_namespace.broadcast_game_over(room_code, self.lookup_winner_name(None))
-            self.viewer_namespace.broadcast_game_over(room_code, self.lookup_winner_name(None))
-            logger.warning(
-                "Host disconnected while attending to game (id: {}, room: {})".format(
-                    host_id, room_code
-                )
-            )
+    return asset_response(subpath)
+
+# Runs function(*args) in eventlet's pool of OS threads, so file writes do not block the hub, and
+# calls done(result, error) back in a green thread
+def offload(function, args, done):
+    def run():
+        try:
+            result = tpool.execute(function, *args)
+        except Exception as error:
+            done(None, error)
         else:
-            logger.info("Host disconnected (id: {}, state: {})".format(host_id, game_state))
-
-        del self.hosts[host_id]
-
-    def register_viewer_connect(self, viewer_id):
-        logger.info("New viewer connected (id: {})".format(viewer_id))
-
-        self.viewers[viewer_id] = {'room_code': None}
-
-    def register_viewer_disconnect(self, viewer_id):
-        room_code = self.viewers[viewer_id]['room_code']
-        if room_code is not None:
-            self.leave_room(room_code, viewer_id, VIEWER_NS_ENDPOINT)
-            logger.info(
-                "New viewer disconnected and left room (id: {}, room: {})".format(
-                    viewer_id, room_code
-                )
-            )
-        else:
-            logger.info("Viewer disconnected (id: {})".format(viewer_id))
-        del self.viewers[viewer_id]
-
-    def register_player_connect(self, player_id):
-        logger.info("New player connected (id: {})".format(player_id))
-
-        self.players[player_id] = {
-            'user_name': None,
-            'character': None,
-            'state': PLAYER_STATE_NOTHING,
-            'game_host': None,
-        }
-
-    def register_player_disconnect(self, player_id):
-        player = self.players[player_id]
-        player_state = player['state']
-        game_host = player['game_host']
-
-        if (player_state == PLAYER_STATE_WAITING_GAME_START) or (
-                player_state == PLAYER_STATE_IN_GAME):
-            self.hosts[game_host]['players'].remove(player_id)
-            self.leave_room(self.hosts[game_host]['room_code'], player_id, PLAYER_NS_ENDPOINT)
-
-            logger.warning(
-                "Player disconnected while game was running (id: {}, game: {})".format(
-                    player_id, game_host
-                )
-            )
-        else:
-            logger.info("Player disconnected (id: {}, state: {})".format(player_id, player_state))
-
-        del self.players[player_id]
-
-    def register_request_game_view(self, viewer_id, room_code):
-        host_id = self.lookup_host_by_room_code(room_code)
-        if host_id is None:
-            logger.info(
-                "Viewer attempted to view non-existent room (id: {}, room: {})".format(
-                    viewer_id, room_code
-                )
-            )
-
-            self.viewer_namespace.send_game_view_response(
-                viewer_id, 'failure', 'Room {} does not exist.'.format(room_code)
-            )
-            return
-
-        viewer = self.viewers[viewer_id]
-        viewer['room_code'] = host_id
-        host = self.hosts[host_id]
-        host['viewers'].append(viewer_id)
-        game_obj = host['game_obj']
-
-        self.join_room(room_code, viewer_id, VIEWER_NS_ENDPOINT)
-
-        full_player_list = self.generate_player_name_character_list(host, fields=('player_id', 'user_name', 'character'))
-        aux_data = {
-            'current_players': full_player_list,
-            'board_description': {
-                'width': game_obj.width,
-                'height': game_obj.height,
-                'player_radius': Player.RADIUS,
-            }
-        }
-        self.viewer_namespace.send_game_view_response(viewer_id, 'success', aux_data)
-
-        logger.info("Viewer joined room (id: {}, room: {})".format(viewer_id, room_code))
-
-    def register_player_join_request(self, player_id, room_code, user_name):
-        player = self.players[player_id]
-        host_id = self.lookup_host_by_room_code(room_code)
-
-        if host_id is None:
-            logger.info(
-                "Player attempted to access non-existent room (id: {}, room: {})".format(
-                    player_id, room_code
-                )
-            )
-
-            self.player_namespace.send_player_join_response(
-                player_id, 'failure', 'Room {} does not exist'.format(room_code)
-            )
-            return
-
-        host = self.hosts[host_id]
-        if host['game_state'] != GAME_STATE_LOBBY_WAITING:
-            logger.info(
-                "Player attempted to join a game that was not in the lobby state (id: {}, room: {})"
-                .format(player_id, room_code)
-            )
-
-            self.player_namespace.send_player_join_response(
-                player_id, 'failure', 'Room {} is not in open state'.format(room_code)
-            )
-            return
-
-        if len(host['players']) >= MAX_PLAYERS_PER_ROOM:
-            logger.info(
-                "Player attempted to join a room that was full (id: {}, room: {})".format(
-                    player_id, room_code
-                )
-            )
-
-            self.player_namespace.send_player_join_response(
-                player_id, 'failure', 'Room {} is full'.format(room_code)
-            )
-            return
-
-        host['players'].append(player_id)
-        host['game_obj'].add_player(player_id)
-
-        player['state'] = PLAYER_STATE_WAITING_GAME_START
-        player['game_host'] = host_id
-        player['user_name'] = user_name
-        character = player['character'] = len(host['players']) - 1
-
-        self.join_room(room_code, player_id, PLAYER_NS_ENDPOINT)
-
-        full_player_list = self.generate_player_name_character_list(host)
-        self.host_namespace.send_player_joined(host_id, full_player_list, user_name)
-        self.player_namespace.send_player_join_response(
-            player_id, 'success', {
-                'room_code': room_code,
-                'character': character,
-                'is_god': "true" if character == 1 else "false"
-            }
-        )
-        logger.info(
-            'Player joined room (id: {}, room: {}, user_name: {}, character: {})'.format(
-                player_id, room_code, user_name, character
-            )
-        )
-
-    def register_request_start_game(self, host_id):
-        host = self.hosts[host_id]
-        room_code = host['room_code']
-        if len(host['players']) >= MIN_PLAYERS_PER_ROOM:
-            host['game_state'] = GAME_STATE_RUNNING
-
-            for player_id in host['players']:
-                self.players[player_id]['state'] = PLAYER_STATE_IN_GAME
-
-            host['game_obj'].start()
-            self.viewer_namespace.broadcast_game_starting(room_code)
-            self.player_namespace.broadcast_game_starting(room_code)
-
-            def tick_callback(game_obj, room_code):
-                tick_data, game_ended, winner = game_obj.tick()
-                if game_ended:
-                    self.player_namespace.broadcast_game_over(room_code, self.lookup_winner_name(winner))
-                    self.viewer_namespace.broadcast_game_over(room_code, self.lookup_winner_name(winner))
-                    return True
-                if "god_spells" in tick_data:
-                    self.player_namespace.broadcast_game_tick(room_code, tick_data['god_spells'])
-                self.viewer_namespace.broadcast_game_tick(room_code, tick_data)
-
-                previous_data = host['previous_player_states']
-                difference = { tick_data[p]['isZombie'] for p in (set(previous_data) & set(tick_data)) if previous_data[p] != tick_data[p]['isZombie'] }
-                host['previous_player_states'] = { tick_data[p]['isZombie'] for p in tick_data if p != 'god_spells'  }
-
-                for p in difference:
-                    if difference[p]:
-                        new_state = 'zombie'
-                    else:
-                        new_state = 'normal'
-                    self.player_namespace.send_status_change(p, 'zombie-change', { "new-state": new_state })
-                return False
-
-            timer = PeriodicTimer(
-                Game.EXTERNAL_TICK_TIME,
-                self.socket_io.sleep,
-                tick_callback,
-                args=(host['game_obj'], room_code)
-            )
-            host['game_timer_thread'] = self.socket_io.start_background_task(start_timer, timer)
-
-            logger.info("Host started game. (id: {}, room: {})".format(host_id, room_code))
-        else:
-            logger.warning(
-                "Host attempted to start game with insufficient player (id: {}, room: {}, num players: {})"
-                .format(host_id, host['room_code'], len(host['players']))
-            )
-
-    def register_make_move(self, player_id, origin, action):
-        player = self.players[player_id]
-        host_id = player['game_host']
-        if host_id is None:
-            logger.warning(
-                'Player attempted to move while not in any game (id: {})'.format(player_id)
-            )
-            return
-
-        host = self.hosts[host_id]
-        if host['game_state'] != GAME_STATE_RUNNING:
-            logger.warning(
-                'Player attempted to move while game was not running (id: {}, room: {}, state: {})'
-                .format(player_id, host['room_code'], host['game_state'])
-            )
-            return
-        if origin == 'god':
-            host['game_obj'].god_input(player_id, action['code'])
-        elif origin == 'normal':
-            direction = action['key']
-            state = action['state']
-            host['game_obj'].input(player_id, direction, state)
-        else:
-            logger.warning(
-                'Player attempted to move from an invalid origin (either "god" or "normal") (id: {}, origin: {})'
-                .format(player_id, origin)
-            )
-
-    def lookup_host_by_room_code(self, room_code):
-        for host_id, host_data in self.hosts.items():
-            if host_data['room_code'] == room_code:
-                return host_id
-        return None
-
-    def lookup_winner_name(self, winner_val):
-        if winner_val == Game.types['player']:
-            return 'normal'
-        elif winner_val == Game.types['zombie']:
-            return 'zombies'
-        else:
-            return 'none'
-
-    def generate_player_name_character_list(self, host, fields=('user_name', 'character')):
-        full_player_list = []
-        for other_player_id in host['players']:
-            full_player_list.append({
-                k: self.players[other_player_id].get(k, None)
-                for k in fields
-            })
-
-            if 'player_id' in fields:
-                full_player_list[-1]['player_id'] = other_player_id
-
-        return full_player_list
-
-    def generate_room_code(self):
-        return ''.join(choices(ascii_lowercase, k=IDENTIFIER_LEN)).upper()
-
-    def join_room(self, room, sid, namespace):
-        join_room(room, sid=sid, namespace=namespace)
+            done(result, None)
 
-    def leave_room(self, room, sid, namespace):
-        leave_room(room, sid=sid, namespace=namespace)
+    socketio.start_background_task(run)
 
 server = Server(HostNamespace, ViewerNamespace, PlayerNamespace)
-server.register(socketio)
+server.register(socketio, offload=offload)
+# Checkpoint rooms before gunicorn starts closing connections
+shutdown_on_signals(server)
 
 if __name__ == '__main__':
     socketio.run(app)
@@ -0,0 +1,98 @@
+from time import monotonic
+
+# Connection sessions:
+#   - One record per connected socket, slotted to keep idle connections small
+#   - Players and viewers reference the room they joined directly, and players its game, so
+#     handling their messages does not need any lookups by id
+
+class RoomSession:
+    __slots__ = (
+        'host_id', 'room_code', 'game_state', 'game', 'players', 'viewers', 'viewer_encodings',
+        'tick_encoder', 'board_description', 'lobby_roster', 'viewer_roster', 'updated_at',
+        'resume_token'
+    )
+
+    def __init__(
+        self, host_id, room_code, game_state, game, tick_encoder, viewer_encodings,
+        board_description=None, resume_token=None
+    ):
+        self.host_id = host_id
+        self.room_code = room_code
+        self.game_state = game_state
+        self.game = game
+        self.tick_encoder = tick_encoder
+        # Player and viewer sessions in the order they joined
+        self.players = []
+        self.viewers = []
+        # Map viewer encoding to the number of viewers using it
+        self.viewer_encodings = {encoding: 0 for encoding in viewer_encodings}
+        # Payloads sent on every join, shared between all sends and never mutated. The rosters
+        # are extended as players join and rebuilt lazily after one leaves.
+        self.board_description = board_description
+        self.lobby_roster = []
+        self.viewer_roster = []
+        # Monotonic time of the last change of state or membership, rooms idle for too long are
+        # evicted
+        self.updated_at = monotonic()
+        # Secret a host reconnecting to a room restored from a checkpoint proves it owns it with
+        self.resume_token = resume_token
+
+    def touch(self):
+        self.updated_at = monotonic()
+
+    def add_player(self, player):
+        self.players.append(player)
+        self.touch()
+        if self.lobby_roster is not None:
+            self.lobby_roster = self.lobby_roster + [player.lobby_entry()]
+            self.viewer_roster = self.viewer_roster + [player.viewer_entry()]
+
+    def remove_player(self, player):
+        self.players.remove(player)
+        self.touch()
+        self.lobby_roster = None
+        self.viewer_roster = None
+
+    # The player reconnected under a new connection id
+    def rebind_player(self, player, player_id):
+        player.player_id = player_id
+        self.touch()
+        self.lobby_roster = None
+        self.viewer_roster = None
+
+    def rosters(self):
+        if self.lobby_roster is None:
+            self.lobby_roster = [player.lobby_entry() for player in self.players]
+            self.viewer_roster = [player.viewer_entry() for player in self.players]
+        return self.lobby_roster, self.viewer_roster
+
+class PlayerSession:
+    __slots__ = (
+        'player_id', 'user_name', 'character', 'state', 'room', 'game', 'input_limit', 'resume_token'
+    )
+
+    def __init__(self, player_id, state, input_limit):
+        self.player_id = player_id
+        self.user_name = None
+        self.character = None
+        self.state = state
+        self.room = None
+        self.game = None
+        # TokenBucket bounding the make_move rate of the connection
+        self.input_limit = input_limit
+        # Secret handed out on joining a room, for rejoining it after a server restart
+        self.resume_token = None
+
+    def lobby_entry(self):
+        return {'user_name': self.user_name, 'character': self.character}
+
+    def viewer_entry(self):
+        return {'player_id': self.player_id, 'user_name': self.user_name, 'character': self.character}
+
+class ViewerSession:
+    __slots__ = ('viewer_id', 'encoding', 'room')
+
+    def __init__(self, viewer_id, encoding):
+        self.viewer_id = viewer_id
+        self.encoding = encoding
+        self.room = None
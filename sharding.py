@@ -0,0 +1,105 @@
+from bisect import bisect
+from hashlib import md5
+from queue import Queue
+import logging
+
+import socketio
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Sharded deployment:
+#   - Every worker process owns the rooms whose code hashes onto it in a consistent hash ring, so
+#     the whole simulation and fan out of a room stays inside one process
+#   - Workers only hand out codes they own, connections asking for a room owned by another worker
+#     are redirected to it
+#   - Emits that have to cross workers go through a Socket.IO client manager, either a message
+#     queue url understood by Flask-SocketIO (redis://, zmq+tcp://, amqp://...) or local:// for the
+#     in-process stand-in below
+
+LOCAL_QUEUE_URL = 'local://'
+
+class HashRing:
+    def __init__(self, nodes, replicas=128):
+        self.nodes = list(nodes)
+        self.points = []
+        self.point_nodes = []
+
+        points = sorted(
+            (self.hash_key('{}#{}'.format(node, replica)), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        for point, node in points:
+            self.points.append(point)
+            self.point_nodes.append(node)
+
+    # The builtin hash is salted per process, every worker has to agree on the ring
+    @staticmethod
+    def hash_key(key):
+        return int.from_bytes(md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def node_for(self, key):
+        index = bisect(self.points, self.hash_key(key)) % len(self.points)
+        return self.point_nodes[index]
+
+class Shard:
+    def __init__(self, index=0, worker_urls=None):
+        self.index = index
+        self.worker_urls = list(worker_urls) if worker_urls else [None]
+
+        if not (0 <= self.index < len(self.worker_urls)):
+            raise ValueError(
+                "Worker index {} out of range for {} workers".format(
+                    self.index, len(self.worker_urls)
+                )
+            )
+
+        self.ring = HashRing(range(len(self.worker_urls)))
+
+    def __len__(self):
+        return len(self.worker_urls)
+
+    def owner(self, room_code):
+        if len(self.worker_urls) == 1:
+            return 0
+        return self.ring.node_for(room_code)
+
+    def owns(self, room_code):
+        return self.owner(room_code) == self.index
+
+    def url_for(self, room_code):
+        return self.worker_urls[self.owner(room_code)]
+
+def shard_from_env(getenv):
+    worker_urls = [url for url in getenv("ZOMBEANS_WORKER_URLS", default='').split(',') if url]
+    index = int(getenv("ZOMBEANS_WORKER_INDEX", default='0'))
+    return Shard(index, worker_urls)
+
+def socketio_queue_options(url, channel='zombeans'):
+    if not url:
+        return {}
+    if url == LOCAL_QUEUE_URL:
+        return {'client_manager': LocalPubSubManager(channel=channel)}
+    return {'message_queue': url, 'channel': channel}
+
+# In-process stand-in for a message queue, every manager created on the same channel receives
+# everything published on it. Only useful for tests and for several servers inside one process.
+class LocalPubSubManager(socketio.PubSubManager):
+    name = 'local'
+
+    channels = {}
+
+    def __init__(self, channel='socketio', write_only=False, logger=None):
+        super(LocalPubSubManager, self).__init__(channel, write_only, logger)
+        self.queue = Queue()
+        LocalPubSubManager.channels.setdefault(channel, []).append(self)
+
+    def _publish(self, data):
+        for manager in LocalPubSubManager.channels[self.channel]:
+            if not manager.write_only:
+                manager.queue.put(data)
+
+    def _listen(self):
+        while True:
+            yield self.queue.get()
@@ -14,7 +14,6 @@ for _ in range(50):
     print(game.tick())
 game.input(1, "u", "r")
 game.input(1, "d", "pressed")
-game.input(1, "", KeyAction.PRESSED)
 for i in range(25):
     print(game.tick())
 y_pos = 0
@@ -0,0 +1,35 @@
+from collections import defaultdict
+from unittest.mock import MagicMock
+
+import pytest
+
+from game_server import Server
+
+# Socket.IO server keeping track of which connections are in which room
+class FakeSocketServer:
+    def __init__(self):
+        # Map (namespace, room) to the connection ids in it
+        self.rooms = defaultdict(set)
+
+    def enter_room(self, sid, room, namespace=None):
+        self.rooms[(namespace, room)].add(sid)
+
+    def leave_room(self, sid, room, namespace=None):
+        self.rooms[(namespace, room)].discard(sid)
+
+    def members(self, namespace, room):
+        return self.rooms[(namespace, room)]
+
+# A Server whose namespaces, broadcaster and scheduler are mocks, handlers can be called directly
+@pytest.fixture
+def server():
+    server = Server(None, None, None)
+    server.socket_io = MagicMock()
+    server.socket_io.server = FakeSocketServer()
+    server.host_namespace = MagicMock()
+    server.viewer_namespace = MagicMock()
+    server.player_namespace = MagicMock()
+    server.broadcaster = MagicMock()
+    server.scheduler = MagicMock()
+    server.scheduler.call_when_idle = lambda function, *args: function(*args)
+    return server
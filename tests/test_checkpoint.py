@@ -0,0 +1,32 @@
+import game_server
+from checkpoint import read_checkpoint
+
+def test_checkpoint_is_written_by_offload(server, tmp_path, monkeypatch):
+    path = str(tmp_path / 'rooms.checkpoint')
+    monkeypatch.setattr(game_server, 'CHECKPOINT_PATH', path)
+    offloaded = []
+    server.offload = lambda function, args, done: offloaded.append((function, args, done))
+    server.register_host_connect('host')
+
+    server.save_checkpoint()
+    assert len(offloaded) == 1
+    # Nothing is written on the event loop, and no second write starts while one is running
+    assert not (tmp_path / 'rooms.checkpoint').exists()
+    server.save_checkpoint()
+    assert len(offloaded) == 1
+
+    function, args, done = offloaded.pop()
+    done(function(*args), None)
+    assert not server.checkpoint_writing
+    rooms = read_checkpoint(path)['rooms']
+    assert [room['host_id'] for room in rooms] == ['host']
+
+def test_shutdown_writes_in_place(server, tmp_path, monkeypatch):
+    path = str(tmp_path / 'rooms.checkpoint')
+    monkeypatch.setattr(game_server, 'CHECKPOINT_PATH', path)
+    server.offload = lambda function, args, done: None
+    server.register_host_connect('host')
+    server.save_checkpoint()
+
+    server.save_checkpoint(blocking=True)
+    assert [room['host_id'] for room in read_checkpoint(path)['rooms']] == ['host']
@@ -0,0 +1,62 @@
+from game import Game
+from game.movement import DIR_RIGHT
+from game_server import Server, GAME_STATE_RUNNING, PLAYER_STATE_IN_GAME, VIEWER_ENCODINGS
+from ratelimit import TokenBucket
+from sessions import RoomSession, PlayerSession
+
+class FrozenClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def running_room(server, player_ids, burst):
+    game = Game()
+    room = RoomSession('host', 'ABCDEF', GAME_STATE_RUNNING, game, None, VIEWER_ENCODINGS)
+    for player_id in player_ids:
+        game.add_player(player_id)
+        input_limit = TokenBucket(1, burst, FrozenClock())
+        player = PlayerSession(player_id, PLAYER_STATE_IN_GAME, input_limit)
+        player.room = room
+        player.game = game
+        room.add_player(player)
+        server.players[player_id] = player
+    game.start()
+    return game
+
+def test_release_is_applied_with_an_empty_bucket():
+    server = Server(None, None, None)
+    # The first player is the zombie and the second the god, the third moves
+    game = running_room(server, ['zombie', 'god', 'human'], burst=1)
+    human = game.players['human']
+
+    server.register_make_move('human', 'normal', {'key': 'r', 'state': 'pressed'})
+    assert game.pending_dirs[human.slot] == DIR_RIGHT
+    # The bucket is empty now, further presses are dropped
+    server.register_make_move('human', 'normal', {'key': 'u', 'state': 'pressed'})
+    assert server.input_counts['dropped'] == 1
+    assert game.pending_dirs[human.slot] == DIR_RIGHT
+
+    server.register_make_move('human', 'normal', {'key': 'r', 'state': 'released'})
+    assert game.pending_dirs[human.slot] == 0
+    assert server.input_counts['dropped'] == 1
+    assert server.input_counts['accepted'] == 2
+
+def test_god_spells_are_charged():
+    server = Server(None, None, None)
+    game = running_room(server, ['zombie', 'god', 'human'], burst=1)
+    code = next(iter(game.god.possible_actions))
+
+    server.register_make_move('god', 'god', {'code': code})
+    server.register_make_move('god', 'god', {'code': code})
+    assert server.input_counts['accepted'] == 1
+    assert server.input_counts['dropped'] == 1
+
+def test_release_of_a_key_not_held_is_ignored():
+    game = Game()
+    for player_id in ('zombie', 'god', 'human'):
+        game.add_player(player_id)
+    assert not game.input('human', 'r', 'released')
+    assert game.input('human', 'r', 'pressed')
+    assert game.input('human', 'r', 'released')
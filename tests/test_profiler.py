@@ -0,0 +1,63 @@
+import subprocess
+import sys
+from pathlib import Path
+from threading import Thread
+
+import pytest
+
+from profiler import SamplingProfiler
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Monkey patching cannot be undone, so the eventlet server is stood in for by a child process
+GREEN_THREAD_PROFILE = '''
+import time
+
+import eventlet
+eventlet.monkey_patch()
+
+from profiler import SamplingProfiler
+
+def busy():
+    total = 0
+    for i in range(200000):
+        total += i * i
+    return total
+
+def profile():
+    profiler = SamplingProfiler()
+    profiler.start(0.001)
+    deadline = time.monotonic() + 0.2
+    while time.monotonic() < deadline:
+        busy()
+        eventlet.sleep(0)
+    return profiler.stop()
+
+profile = eventlet.spawn(profile).wait()
+print(profile.summary()['samples'])
+'''
+
+def test_profiler_starts_from_a_green_thread():
+    pytest.importorskip('eventlet')
+    result = subprocess.run(
+        [sys.executable, '-c', GREEN_THREAD_PROFILE], cwd=ROOT, capture_output=True, text=True,
+        timeout=30
+    )
+    assert result.returncode == 0, result.stderr
+    assert int(result.stdout.split()[-1]) > 0
+
+def test_profiler_refuses_other_threads():
+    profiler = SamplingProfiler()
+    errors = []
+
+    def start():
+        try:
+            profiler.start(0.001)
+        except RuntimeError as error:
+            errors.append(error)
+
+    thread = Thread(target=start)
+    thread.start()
+    thread.join()
+    assert len(errors) == 1
+    assert not profiler.running
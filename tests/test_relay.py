@@ -0,0 +1,62 @@
+import socket
+
+from relay import (
+    RelayPublisher, RelaySubscriber, read_message, MESSAGE_ROOM_INFO, MESSAGE_ROOM_CLOSED,
+    MESSAGE_TICK_JSON, MESSAGE_TICK_BINARY
+)
+
+def full_subscriber(publisher):
+    connection, _ = socket.socketpair()
+    subscriber = RelaySubscriber(connection, 1)
+    publisher.subscribers.append(subscriber)
+    publisher.publish(MESSAGE_TICK_BINARY, 'ABCDEF', b'\x00')
+    return subscriber
+
+def test_deltas_and_binary_ticks_are_dropped_for_a_full_relay():
+    publisher = RelayPublisher('127.0.0.1:0', None, None)
+    subscriber = full_subscriber(publisher)
+
+    publisher.publish(MESSAGE_TICK_BINARY, 'ABCDEF', b'\x00')
+    publisher.publish(MESSAGE_TICK_JSON, 'ABCDEF', {'keyframe': False, 'players': {}})
+    assert subscriber.dropped == 2
+    assert not subscriber.closed
+
+def test_keyframes_disconnect_a_full_relay():
+    publisher = RelayPublisher('127.0.0.1:0', None, None)
+    subscriber = full_subscriber(publisher)
+
+    publisher.publish(MESSAGE_TICK_JSON, 'ABCDEF', {'keyframe': True, 'players': {}})
+    assert subscriber.dropped == 0
+    assert subscriber.closed
+    assert not publisher.subscribed
+
+def test_snapshot_is_not_bound_by_the_queue():
+    rooms = ['R{:05d}'.format(i) for i in range(300)]
+    tasks = []
+    publisher = RelayPublisher(
+        '127.0.0.1:0', lambda function, *args: tasks.append((function, args)),
+        lambda: [(MESSAGE_ROOM_INFO, room, {'running': False}) for room in rooms], max_queue=8
+    )
+    connection, relay_end = socket.socketpair()
+    subscriber = publisher.subscribe(connection)
+    assert not subscriber.closed
+    assert publisher.subscribed
+
+    # Updates published before the writer runs follow the snapshot
+    publisher.publish(MESSAGE_ROOM_CLOSED, 'R00000', {'winner': None})
+    subscriber.queue.put_nowait(None)
+    (write, args), = tasks
+    write(*args)
+    assert not publisher.subscribed
+
+    stream = relay_end.makefile('rb')
+    received = [read_message(stream)[:2] for _ in range(len(rooms) + 1)]
+    assert received[:-1] == [(MESSAGE_ROOM_INFO, room) for room in rooms]
+    assert received[-1] == (MESSAGE_ROOM_CLOSED, 'R00000')
+
+def test_closed_subscriber_is_dropped():
+    publisher = RelayPublisher('127.0.0.1:0', None, None)
+    subscriber = full_subscriber(publisher)
+    subscriber.closed = True
+    publisher.close(subscriber)
+    assert not publisher.subscribed
@@ -0,0 +1,46 @@
+from game_server import (
+    Server, GAME_STATE_FINISHED, PLAYER_STATE_NOTHING, PLAYER_NS_ENDPOINT, VIEWER_NS_ENDPOINT,
+    VIEWER_ENCODING_JSON, VIEWER_ENCODINGS
+)
+from sessions import RoomSession
+
+def open_room(server, host_id, player_ids, viewer_ids=()):
+    server.register_host_connect(host_id)
+    room = server.hosts[host_id]
+    for player_id in player_ids:
+        server.register_player_connect(player_id)
+        server.register_player_join_request(player_id, room.room_code, player_id)
+    for viewer_id in viewer_ids:
+        server.register_viewer_connect(viewer_id)
+        server.register_request_game_view(viewer_id, room.room_code, VIEWER_ENCODING_JSON)
+    return room
+
+def test_finished_room_cannot_be_started_again():
+    server = Server(None, None, None)
+    room = RoomSession('host', 'ABCDEF', GAME_STATE_FINISHED, None, None, VIEWER_ENCODINGS)
+    room.players = [object()] * 4
+    server.hosts['host'] = room
+
+    server.register_request_start_game('host')
+    assert room.game_state == GAME_STATE_FINISHED
+
+def test_recycled_code_does_not_reach_the_previous_room(server):
+    first = open_room(server, 'host-a', ['p1', 'p2', 'p3'], ['v1'])
+    server.register_request_start_game('host-a')
+    first.game_state = GAME_STATE_FINISHED
+    server.release_game(first)
+    server.register_host_disconnect('host-a')
+
+    assert server.players['p1'].room is None
+    assert server.players['p1'].game is None
+    assert server.players['p1'].state == PLAYER_STATE_NOTHING
+    assert server.viewers['v1'].room is None
+
+    second = open_room(server, 'host-b', ['p4', 'p5', 'p6'])
+    assert second.room_code == first.room_code
+    sockets = server.socket_io.server
+    assert sockets.members(PLAYER_NS_ENDPOINT, second.room_code) == {'p4', 'p5', 'p6'}
+    assert not sockets.members(VIEWER_NS_ENDPOINT, second.room_code)
+    assert not sockets.members(
+        VIEWER_NS_ENDPOINT, server.tick_room(second.room_code, VIEWER_ENCODING_JSON)
+    )
@@ -0,0 +1,67 @@
+import struct
+
+from game import Game
+from game.replay import Recorder, Recording
+from packets import encode_binary_tick, BINARY_HEADER_FORMAT, BINARY_PLAYER_FORMAT
+
+def binary_indexes(game):
+    data = encode_binary_tick(game, 0)
+    header = struct.calcsize(BINARY_HEADER_FORMAT)
+    player = struct.calcsize(BINARY_PLAYER_FORMAT)
+    return sorted(
+        struct.unpack_from(BINARY_PLAYER_FORMAT, data, header + i * player)[0]
+        for i in range(len(game.players))
+    )
+
+def test_lobby_leave_frees_the_slot_for_the_next_player():
+    game = Game()
+    assert [game.add_player(id) for id in ('a', 'b', 'c', 'd')] == [0, 1, 2, 3]
+    game.remove_player('c')
+    assert game.add_player('e') == 2
+    assert game.players['e'].index == 2
+    assert binary_indexes(game) == [0, 2, 3]
+
+def test_god_and_zombie_slots_are_handed_out_again():
+    game = Game()
+    for id in ('a', 'b', 'c'):
+        game.add_player(id)
+    game.remove_player('a')
+    game.remove_player('b')
+    assert game.god is None and not game.zombies
+    assert game.add_player('d') == 0
+    assert game.add_player('e') == 1
+    assert game.players['d'].is_zombie()
+    assert game.god.id == 'e'
+
+def test_server_characters_match_binary_indexes(server):
+    server.register_host_connect('host')
+    room_code = server.hosts['host'].room_code
+    for player_id in ('p0', 'p1', 'p2', 'p3'):
+        server.register_player_connect(player_id)
+        server.register_player_join_request(player_id, room_code, player_id)
+    server.register_player_disconnect('p2')
+    server.register_player_connect('p4')
+    server.register_player_join_request('p4', room_code, 'p4')
+
+    characters = sorted(player.character for player in server.hosts['host'].players)
+    assert characters == [0, 1, 2, 3]
+    game = server.hosts['host'].game
+    assert game.players['p4'].index == server.players['p4'].character
+    assert binary_indexes(game) == [0, 2, 3]
+
+def test_replay_keeps_free_slots(tmp_path):
+    game = Game()
+    for id in ('a', 'b', 'c', 'd', 'e'):
+        game.add_player(id)
+    game.remove_player('c')
+    path = tmp_path / 'game.zbr'
+    Recorder(path).start(game)
+    game.start()
+    game.input('e', 'r', 'pressed')
+    for _ in range(20):
+        game.advance()
+    game.recorder.close()
+
+    recording = Recording.load(path)
+    assert recording.player_ids == ['a', 'b', '', 'd', 'e']
+    assert all(matches for _, _, matches in recording.simulate())
@@ -0,0 +1,19 @@
+import random
+
+from game import Game, Player
+from game.arena import Arena
+
+def clear_of_walls(points, width, height):
+    return all(
+        Player.RADIUS <= x <= width - Player.RADIUS and Player.RADIUS <= y <= height - Player.RADIUS
+        for x, y in points
+    )
+
+def test_default_spawn_points_are_clear_of_the_walls():
+    game = Game()
+    assert clear_of_walls(game.starting_positions, game.width, game.height)
+
+def test_arena_spawn_points_are_clear_of_the_walls():
+    arena = Arena(200)
+    points = arena.spawn_points(200, random.Random(1))
+    assert clear_of_walls(points, arena.width, arena.height)
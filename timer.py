@@ -1,28 +1,315 @@
-import logging, functools, time
+import asyncio, logging, time
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Steps a PeriodicTimer schedule yields
+STEP_SLEEP = 'sleep'
+STEP_CALL = 'call'
+
+# What a PeriodicTimer does when a call finishes after the next one was due:
+#   - catch up: run the missed calls back to back, at most max_catch_up in a row, then skip the
+#     rest. The function is told these calls are catching up (catching_up=True) so it can do the
+#     minimum work for them.
+#   - skip: drop the missed calls and continue on the original schedule
+#   - stretch: run the next call right away and restart the schedule from it
+OVERRUN_CATCH_UP = 'catch_up'
+OVERRUN_SKIP = 'skip'
+OVERRUN_STRETCH = 'stretch'
+OVERRUN_POLICIES = (OVERRUN_CATCH_UP, OVERRUN_SKIP, OVERRUN_STRETCH)
+
+class TimerStats:
+    __slots__ = (
+        'calls', 'overruns', 'caught_up', 'skipped', 'stretched', 'total_lateness', 'max_lateness'
+    )
+
+    def __init__(self):
+        self.calls = 0
+        # Calls that finished after the next one was due, and how each was resolved
+        self.overruns = 0
+        self.caught_up = 0
+        self.skipped = 0
+        self.stretched = 0
+        # Seconds calls started after they were due
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
 class PeriodicTimer:
-    def __init__(self, interval, sleepfunc, function, args=None, kwargs=None):
+    def __init__(
+        self, interval, sleepfunc, function, args=None, kwargs=None, on_late=None,
+        overrun_policy=OVERRUN_SKIP, max_catch_up=3, stats=None, clock=time.monotonic
+    ):
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise ValueError("Unknown overrun policy {}".format(overrun_policy))
+
         self.interval = interval
         self.function = function
         self.args = args if args is not None else []
         self.kwargs = kwargs if kwargs is not None else {}
         self.sleepfunc = sleepfunc
+        # Called with the seconds every call started after it was due
+        self.on_late = on_late
+        self.overrun_policy = overrun_policy
+        self.max_catch_up = max_catch_up
+        self.stats = stats if stats is not None else TimerStats()
+        self.clock = clock
+        self.stopped = False
+
+    # Stops the timer before its next call, the current call (if any) finishes
+    def stop(self):
+        self.stopped = True
 
+    # Runs the timer with a blocking sleepfunc (eventlet, threads)
     def run(self):
-        next_call = time.time() + self.interval
-        should_cancel = False
+        schedule = self.schedule()
+        result = None
+        while True:
+            try:
+                step, value = schedule.send(result)
+            except StopIteration:
+                return
+            result = None
+            if step == STEP_SLEEP:
+                self.sleepfunc(value)
+            else:
+                result = self.call(value)
+
+    # Runs the timer as an asyncio task, sleepfunc and function may be coroutine functions
+    async def run_async(self):
+        schedule = self.schedule()
+        result = None
+        while True:
+            try:
+                step, value = schedule.send(result)
+            except StopIteration:
+                return
+            result = None
+            if step == STEP_SLEEP:
+                await self.sleepfunc(value)
+            else:
+                result = self.call(value)
+                if asyncio.iscoroutine(result):
+                    result = await result
+
+    def call(self, catching_up):
+        if self.overrun_policy == OVERRUN_CATCH_UP:
+            return self.function(*self.args, catching_up=catching_up, **self.kwargs)
+        return self.function(*self.args, **self.kwargs)
 
-        self.sleepfunc(self.interval)
+    # Generator deciding when to sleep and call, independent of how either is done. Yields
+    # (STEP_SLEEP, seconds) and (STEP_CALL, catching_up), the result of every call is sent back.
+    def schedule(self):
+        next_call = self.clock() + self.interval
+        catching_up = False
+        caught_up_in_row = 0
 
-        while not should_cancel:
-            should_cancel = self.function(*self.args, **self.kwargs)
+        yield STEP_SLEEP, self.interval
 
-            next_call = next_call + self.interval
-            to_wait = max(next_call - time.time(), 0)
-            self.sleepfunc(to_wait)
+        while not self.stopped:
+            lateness = max(self.clock() - next_call, 0.0)
+            self.stats.calls += 1
+            self.stats.total_lateness += lateness
+            self.stats.max_lateness = max(self.stats.max_lateness, lateness)
+            if self.on_late is not None:
+                self.on_late(lateness)
+
+            should_cancel = yield STEP_CALL, catching_up
+            if should_cancel:
+                break
+
+            next_call += self.interval
+            now = self.clock()
+            catching_up = False
+            if now > next_call:
+                self.stats.overruns += 1
+                if self.overrun_policy == OVERRUN_CATCH_UP and caught_up_in_row < self.max_catch_up:
+                    self.stats.caught_up += 1
+                    caught_up_in_row += 1
+                    catching_up = True
+                elif self.overrun_policy == OVERRUN_STRETCH:
+                    self.stats.stretched += 1
+                    next_call = now
+                else:
+                    missed = int((now - next_call) // self.interval) + 1
+                    self.stats.skipped += missed
+                    next_call += missed * self.interval
+                    caught_up_in_row = 0
+            else:
+                caught_up_in_row = 0
+
+            # Always yield, even when the next call is already due
+            yield STEP_SLEEP, max(next_call - now, 0)
 
 def start_timer(timer):
     timer.run()
+
+async def start_timer_async(timer):
+    await timer.run_async()
+
+# Tick scheduler:
+#   - Steps every registered entry from a single periodic loop instead of one timer per entry
+#   - Entries are removed once their callback returns True, or explicitly through remove. An entry
+#     whose callback raises is logged and removed, the other entries keep being stepped.
+#   - The loop is started on the first add and exits once there is nothing left to step, or when
+#     stopped
+#   - With the catch up overrun policy every entry is called with catching_up, see PeriodicTimer
+#   - An asynchronous scheduler runs its loop as an asyncio task, sleepfunc is then a coroutine
+#     function. It can hand work that does not touch the event loop to an executor before every
+#     tick: prepare is called there with the args of every entry, and the entries are called once
+#     it is done. Calls that must not overlap that work go through call_when_idle.
+
+class TickScheduler:
+    def __init__(
+        self, interval, sleepfunc, start_task, on_late=None, on_tick=None,
+        overrun_policy=OVERRUN_SKIP, max_catch_up=3, asynchronous=False, executor=None,
+        prepare=None
+    ):
+        self.interval = interval
+        self.sleepfunc = sleepfunc
+        self.start_task = start_task
+        self.overrun_policy = overrun_policy
+        self.max_catch_up = max_catch_up
+        # Called with the lateness of every tick, and with the duration of every tick
+        self.on_late = on_late
+        self.on_tick = on_tick
+        self.asynchronous = asynchronous
+        self.executor = executor
+        self.prepare = prepare if executor is not None else None
+        self.preparing = False
+        # (function, args) deferred by call_when_idle while preparing
+        self.idle_calls = []
+
+        # Map entry key to (function, args)
+        self.entries = {}
+        self.running = False
+        self.timer = None
+        self.timer_thread = None
+
+        # Overrun accounting, timer_stats is shared by every timer the scheduler starts
+        self.timer_stats = TimerStats()
+        self.ticks = 0
+        self.overruns = 0
+        self.total_overrun = 0.0
+        self.max_overrun = 0.0
+        self.last_tick_duration = 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key, function, args=()):
+        self.entries[key] = (function, args)
+
+        if not self.running:
+            self.running = True
+            self.timer = PeriodicTimer(
+                self.interval, self.sleepfunc, self.tick_async if self.asynchronous else self.tick,
+                on_late=self.on_late, overrun_policy=self.overrun_policy,
+                max_catch_up=self.max_catch_up, stats=self.timer_stats
+            )
+            self.timer_thread = self.start_task(
+                start_timer_async if self.asynchronous else start_timer, self.timer
+            )
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    # Stops stepping entries, they are kept and stepped again once the next entry is added
+    def stop(self):
+        if self.timer is not None:
+            self.timer.stop()
+        self.running = False
+        self.timer = None
+        self.timer_thread = None
+
+    # Calls function now, or once the executor is done if it is preparing a tick
+    def call_when_idle(self, function, *args):
+        if self.preparing:
+            self.idle_calls.append((function, args))
+        else:
+            function(*args)
+
+    async def tick_async(self, **kwargs):
+        finished = True
+        try:
+            tick_start = time.monotonic()
+            if self.prepare is not None and self.entries:
+                await self.prepare_entries()
+            finished = self.step_entries(tick_start, kwargs)
+        finally:
+            # The loop ends with this tick, either normally or because it raised
+            if finished:
+                self.reset_loop()
+        return finished
+
+    def tick(self, **kwargs):
+        finished = True
+        try:
+            finished = self.step_entries(time.monotonic(), kwargs)
+        finally:
+            if finished:
+                self.reset_loop()
+        return finished
+
+    # A failing prepare is logged, the entries are then stepped without its work
+    async def prepare_entries(self):
+        entry_args = [args for _, args in self.entries.values()]
+        self.preparing = True
+        try:
+            await asyncio.get_event_loop().run_in_executor(self.executor, self.prepare, entry_args)
+        except Exception:
+            logger.exception("Preparing tick failed (entries: {})".format(len(entry_args)))
+        finally:
+            self.preparing = False
+            idle_calls, self.idle_calls = self.idle_calls, []
+            for function, args in idle_calls:
+                function(*args)
+
+    def reset_loop(self):
+        self.running = False
+        self.timer = None
+        self.timer_thread = None
+
+    # Returns True once there is nothing left to step
+    def step_entries(self, tick_start, kwargs):
+        for key, (function, args) in list(self.entries.items()):
+            # An earlier callback in this tick may have removed this entry
+            if key not in self.entries:
+                continue
+            try:
+                finished = function(*args, **kwargs)
+            except Exception:
+                logger.exception("Tick entry raised, removing it (key: {})".format(key))
+                finished = True
+            if finished:
+                self.entries.pop(key, None)
+
+        duration = time.monotonic() - tick_start
+        self.ticks += 1
+        self.last_tick_duration = duration
+        if self.on_tick is not None:
+            self.on_tick(duration)
+        if duration > self.interval:
+            overrun = duration - self.interval
+            self.overruns += 1
+            self.total_overrun += overrun
+            self.max_overrun = max(self.max_overrun, overrun)
+            logger.debug(
+                "Tick overran its period (entries: {}, duration: {:.4f}s, interval: {:.4f}s)"
+                .format(len(self.entries), duration, self.interval)
+            )
+
+        return not self.entries
+
+    def stats(self):
+        return {
+            'timer': self.timer_stats.as_dict(),
+            'entries': len(self.entries),
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'total_overrun': self.total_overrun,
+            'max_overrun': self.max_overrun,
+            'last_tick_duration': self.last_tick_duration,
+        }